@@ -0,0 +1,97 @@
+#########################################################
+# Bit Buffer
+# A compact, append-only stream of bits
+#########################################################
+
+# Every bit pattern a byte can hold, most significant bit first, so bytes can be unpacked with a single lookup
+_BYTE_TO_BITS = tuple(tuple((byte >> (7 - i)) & 1 for i in range(8)) for byte in range(256))
+
+
+class BitBuffer:
+    """
+    Stores a sequence of bits packed into a bytearray, most significant bit first
+
+    Complete bytes are kept in a bytearray, and the last few bits that do not yet fill a byte are held in an integer
+    """
+
+    __slots__ = ('_data', '_pending', '_pending_bits')
+
+    def __init__(self, data: bytes = b''):
+        """
+        :param data: Optional whole bytes to start the buffer with
+        :type data: bytes
+        """
+
+        self._data = bytearray(data)
+        self._pending = 0
+        self._pending_bits = 0
+
+    def __len__(self) -> int:
+        return len(self._data) * 8 + self._pending_bits
+
+    def __repr__(self) -> str:
+        return f"BitBuffer({''.join(map(str, self.iter_bits()))!r})"
+
+    def append_bits(self, value: int, nbits: int) -> None:
+        """
+        Appends the lowest nbits of value to the buffer, most significant bit first
+
+        :param value: The non-negative integer to append
+        :type value: int
+        :param nbits: How many bits the value takes up
+        :type nbits: int
+        """
+
+        if nbits < 0 or value < 0 or value >> nbits:
+            raise ValueError(f"{value} does not fit in {nbits} bits.")
+
+        total_bits = self._pending_bits + nbits
+        accumulator = (self._pending << nbits) | value
+
+        full_bytes, remaining_bits = divmod(total_bits, 8)
+        if full_bytes:
+            self._data += (accumulator >> remaining_bits).to_bytes(full_bytes, 'big')
+            accumulator &= (1 << remaining_bits) - 1
+
+        self._pending = accumulator
+        self._pending_bits = remaining_bits
+
+    def append_bytes(self, data: bytes) -> None:
+        """
+        Appends whole bytes to the buffer
+
+        :param data: The bytes to append
+        :type data: bytes
+        """
+
+        if self._pending_bits:
+            self.append_bits(int.from_bytes(data, 'big'), len(data) * 8)
+        else:
+            self._data += data
+
+    def to_bytes(self) -> bytes:
+        """
+        Returns the buffer as bytes. If the length is not a multiple of 8, the last byte is padded with 0s on the right
+
+        :return: The packed bits
+        :rtype: bytes
+        """
+
+        if self._pending_bits:
+            return bytes(self._data) + bytes([self._pending << (8 - self._pending_bits)])
+
+        return bytes(self._data)
+
+    def iter_bits(self):
+        """
+        Iterates over every bit in the buffer, in order
+
+        :return: An iterator of 0s and 1s
+        :rtype: Iterator[int]
+        """
+
+        for byte in self._data:
+            yield from _BYTE_TO_BITS[byte]
+
+        for i in range(self._pending_bits - 1, -1, -1):
+            yield (self._pending >> i) & 1
@@ -0,0 +1,198 @@
+#########################################################
+# Galois Field 256 arithmetic
+# https://www.thonky.com/qr-code-tutorial/error-correction-coding
+#########################################################
+
+# QR codes do all of their Reed-Solomon arithmetic inside GF(256), using the
+# primitive polynomial x^8 + x^4 + x^3 + x^2 + 1 (285 in decimal).
+# Instead of working out 2**exp by repeated doubling every time, the exponent,
+# logarithm and multiplication tables are all built once when the module is imported.
+
+PRIMITIVE_POLYNOMIAL = 285
+
+# Generator polynomials for the format and version information BCH codes
+FORMAT_GENERATOR = 0b10100110111
+VERSION_GENERATOR = 0b1111100100101
+
+
+def _build_exp_log_tables() -> tuple[bytes, tuple[int, ...]]:
+    """
+    Builds the exponent (antilog) and logarithm tables for GF(256)
+
+    The exponent table is 512 entries long so that EXP[LOG[a] + LOG[b]] never needs a modulo
+
+    :return: The exponent table and the logarithm table. LOG[0] is -1 since 0 has no logarithm
+    :rtype: tuple[bytes, tuple[int, ...]]
+    """
+
+    exp_table = bytearray(512)
+    log_table = [-1] * 256
+
+    num = 1
+    for exp in range(255):
+        exp_table[exp] = num
+        log_table[num] = exp
+
+        num <<= 1
+        if num > 255:
+            num ^= PRIMITIVE_POLYNOMIAL
+
+    # Repeat the cycle so sums of two logarithms can be looked up directly
+    for exp in range(255, 512):
+        exp_table[exp] = exp_table[exp - 255]
+
+    return bytes(exp_table), tuple(log_table)
+
+
+EXP, LOG = _build_exp_log_tables()
+
+
+def _build_mul_table() -> tuple[bytes, ...]:
+    """
+    Builds the full 256x256 multiplication table, one bytes row per left operand
+
+    :return: MUL[a][b] is a * b inside GF(256)
+    :rtype: tuple[bytes, ...]
+    """
+
+    rows = [bytes(256)]
+
+    for a in range(1, 256):
+        log_a = LOG[a]
+        rows.append(bytes([0] + [EXP[log_a + LOG[b]] for b in range(1, 256)]))
+
+    return tuple(rows)
+
+
+MUL = _build_mul_table()
+
+
+def add(a: int, b: int) -> int:
+    """
+    Adds two elements of GF(256). Addition and subtraction are both XOR
+
+    :param a: First element (0-255)
+    :type a: int
+    :param b: Second element (0-255)
+    :type b: int
+    :return: a + b in GF(256)
+    :rtype: int
+    """
+
+    return a ^ b
+
+
+def mul(a: int, b: int) -> int:
+    """
+    Multiplies two elements of GF(256)
+
+    :param a: First element (0-255)
+    :type a: int
+    :param b: Second element (0-255)
+    :type b: int
+    :return: a * b in GF(256)
+    :rtype: int
+    """
+
+    return MUL[a][b]
+
+
+def div(a: int, b: int) -> int:
+    """
+    Divides two elements of GF(256)
+
+    :param a: The dividend (0-255)
+    :type a: int
+    :param b: The divisor (1-255)
+    :type b: int
+    :return: a / b in GF(256)
+    :rtype: int
+    """
+
+    if b == 0:
+        raise ZeroDivisionError("Division by zero in GF(256).")
+    if a == 0:
+        return 0
+
+    return EXP[LOG[a] + 255 - LOG[b]]
+
+
+def pow(a: int, exp: int) -> int:
+    """
+    Raises an element of GF(256) to an integer power. pow(2, exp) is the same as the alpha notation a^exp
+
+    :param a: The base (0-255)
+    :type a: int
+    :param exp: The exponent, which may be negative for non-zero bases
+    :type exp: int
+    :return: a**exp in GF(256)
+    :rtype: int
+    """
+
+    if a == 0:
+        if exp < 0:
+            raise ZeroDivisionError("0 has no negative powers in GF(256).")
+        return 0 if exp else 1
+
+    return EXP[(LOG[a] * exp) % 255]
+
+
+def inverse(a: int) -> int:
+    """
+    Returns the multiplicative inverse of an element of GF(256)
+
+    :param a: The element to invert (1-255)
+    :type a: int
+    :return: The value b where a * b == 1 in GF(256)
+    :rtype: int
+    """
+
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256).")
+
+    return EXP[255 - LOG[a]]
+
+
+#########################################################
+# Binary polynomials for the BCH codes
+# https://www.thonky.com/qr-code-tutorial/format-version-information
+#########################################################
+
+# The format and version strings are protected by BCH codes, which are polynomials over GF(2)
+# Each bit of an integer is a coefficient, so XOR is addition and a shift is multiplication by x
+
+def bch_remainder(value: int, generator: int) -> int:
+    """
+    Returns the remainder of value / generator, treating both as polynomials over GF(2)
+
+    :param value: The dividend, one coefficient per bit
+    :type value: int
+    :param generator: The generator polynomial, one coefficient per bit
+    :type generator: int
+    :return: The remainder, which has fewer bits than the generator
+    :rtype: int
+    """
+
+    generator_degree = generator.bit_length() - 1
+
+    while value.bit_length() > generator_degree:
+        value ^= generator << (value.bit_length() - 1 - generator_degree)
+
+    return value
+
+
+def bch_encode(value: int, generator: int) -> int:
+    """
+    Appends the BCH error correction bits to the given value
+
+    :param value: The data bits to protect
+    :type value: int
+    :param generator: The generator polynomial, one coefficient per bit
+    :type generator: int
+    :return: The value followed by its error correction bits
+    :rtype: int
+    """
+
+    generator_degree = generator.bit_length() - 1
+
+    return (value << generator_degree) | bch_remainder(value << generator_degree, generator)
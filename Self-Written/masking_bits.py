@@ -0,0 +1,227 @@
+#######################################################
+# Bit-Parallel Data Masking
+# https://www.thonky.com/qr-code-tutorial/data-masking
+#######################################################
+
+# A pure Python mask engine for when NumPy cannot be used
+# The whole QR code is packed into one integer, 1 bit per module, row after row with the first module in the highest bit
+# A mask is applied with a single XOR, and the penalty rules are worked out with shifts and ANDs over every row at once
+# The columns are scored the same way from a second integer that holds the modules column after column
+#
+# Shifting right by k lines each module up with the module k places before it in the same row (or column)
+# Windows that would wrap from one row into the next are removed with precomputed masks of the valid window positions
+
+from functools import lru_cache
+
+import qr_spec
+from qr_matrix import QRMatrix
+
+
+# Converts module bytes (0 or 1) into the ASCII digits '0' and '1', so int(..., 2) can pack them, and back again
+_MODULE_TO_DIGIT = bytes.maketrans(b'\x00\x01', b'01')
+_DIGIT_TO_MODULE = bytes.maketrans(b'01', b'\x00\x01')
+
+# Condition 3 patterns with 1 as a light module, first module in the highest bit
+# dark-light-dark-dark-dark-light-dark with 4 light modules on one side
+FINDER_LIKE_PATTERNS = (0b01000101111, 0b11110100010)
+
+# Every mask repeats after 12 rows and 12 columns, so only 12 rows of each need to be worked out
+MASK_PERIOD = 12
+
+
+def pack(modules: bytes) -> int:
+    """
+    Packs module bytes into an integer, 1 bit per module, the first module in the highest bit
+
+    :param modules: Module values, 0 or 1
+    :type modules: bytes
+    :return: The packed modules
+    :rtype: int
+    """
+
+    return int(bytes(modules).translate(_MODULE_TO_DIGIT), 2)
+
+
+def unpack(value: int, num_of_modules: int) -> bytearray:
+    """
+    Reverses pack
+
+    :param value: The packed modules
+    :type value: int
+    :param num_of_modules: How many modules were packed
+    :type num_of_modules: int
+    :return: Module values, 0 or 1
+    :rtype: bytearray
+    """
+
+    return bytearray(format(value, f'0{num_of_modules}b').encode().translate(_DIGIT_TO_MODULE))
+
+
+def transpose(modules: bytes, size: int) -> bytes:
+    """
+    :param modules: Modules stored row after row
+    :type modules: bytes
+    :param size: The number of modules along each side
+    :type size: int
+    :return: The same modules stored column after column
+    :rtype: bytes
+    """
+
+    return b''.join(modules[column::size] for column in range(size))
+
+
+@lru_cache(maxsize=None)
+def window_positions(size: int, length: int) -> int:
+    """
+    Returns the bit positions where a window of the given length starts and ends in the same line
+
+    :param size: The number of modules along each side
+    :type size: int
+    :param length: The number of modules in the window
+    :type length: int
+    :return: A bit is set wherever it and the length - 1 bits above it are in the same line
+    :rtype: int
+    """
+
+    # The lowest size - length + 1 bits of each line, repeated for every line
+    line = (1 << (size - length + 1)) - 1
+
+    return sum(line << (i * size) for i in range(size))
+
+
+@lru_cache(maxsize=None)
+def block_positions(size: int) -> int:
+    """
+    Returns the bit positions that are the bottom right module of a 2x2 block, for a QR code packed row after row
+
+    :param size: The number of modules along each side
+    :type size: int
+    :return: A bit is set for every module with a module to its left and a module above it
+    :rtype: int
+    """
+
+    # Every row except the first (the highest bits), without the first module of each row (the highest bit of the row)
+    line = (1 << (size - 1)) - 1
+
+    return sum(line << (i * size) for i in range(size - 1))
+
+
+@lru_cache(maxsize=None)
+def mask_words(size: int, function_mask: bytes) -> tuple[tuple[int, ...], tuple[int, ...]]:
+    """
+    Returns every mask pattern, restricted to the data modules and packed row after row and column after column
+
+    :param size: The number of modules along each side
+    :type size: int
+    :param function_mask: size * size flags, 1 for function modules, which are never masked
+    :type function_mask: bytes
+    :return: The row-major patterns and the column-major patterns, in mask order
+    :rtype: tuple[tuple[int, ...], tuple[int, ...]]
+    """
+
+    data_rows = pack(function_mask) ^ ((1 << (size * size)) - 1)
+    data_columns = pack(transpose(function_mask, size)) ^ ((1 << (size * size)) - 1)
+
+    row_words, column_words = [], []
+
+    for condition in qr_spec.MASK_CONDITIONS:
+        # The pattern of each row (and each column) only depends on its position within the period
+        rows = [''.join('1' if condition(row, column) else '0' for column in range(size)) for row in range(MASK_PERIOD)]
+        columns = [''.join('1' if condition(row, column) else '0' for row in range(size)) for column in range(MASK_PERIOD)]
+
+        row_words.append(int(''.join(rows[row % MASK_PERIOD] for row in range(size)), 2) & data_rows)
+        column_words.append(int(''.join(columns[column % MASK_PERIOD] for column in range(size)), 2) & data_columns)
+
+    return tuple(row_words), tuple(column_words)
+
+
+def _line_penalty(light: int, size: int) -> int:
+    """
+    Conditions 1 and 3 for every line at once
+
+    :param light: The packed lines, 1 for light modules
+    :type light: int
+    :param size: The number of modules along each side
+    :type size: int
+    :return: The penalty for every line
+    :rtype: int
+    """
+
+    dark = light ^ ((1 << (size * size)) - 1)
+    score = 0
+
+    # Condition 1: 3 points for every run of 5 modules of the same colour, plus 1 for each extra module in the run
+    # A run of n modules has n - 4 windows of 5, and n - 2 = (n - 4) + 2, so count the windows plus 2 for every run
+    for modules in (light, dark):
+        runs = modules & (modules >> 1) & (modules >> 2) & (modules >> 3) & (modules >> 4) & window_positions(size, 5)
+        score += runs.bit_count() + 2 * (runs & ~(runs >> 1)).bit_count()
+
+    # Condition 3: 40 points for every finder-like pattern
+    # Each pattern is matched at every window position at once, one module at a time
+    shifted_light = [light >> k for k in range(11)]
+    shifted_dark = [dark >> k for k in range(11)]
+
+    for pattern in FINDER_LIKE_PATTERNS:
+        matches = window_positions(size, 11)
+        for k in range(11):
+            matches &= shifted_light[k] if (pattern >> k) & 1 else shifted_dark[k]
+        score += 40 * matches.bit_count()
+
+    return score
+
+
+def score_mask(rows: int, columns: int, size: int) -> int:
+    """
+    Scores a packed, masked QR code with all four penalty conditions
+
+    :param rows: The QR code packed row after row, 1 for light modules
+    :type rows: int
+    :param columns: The same QR code packed column after column
+    :type columns: int
+    :param size: The number of modules along each side
+    :type size: int
+    :return: The total penalty
+    :rtype: int
+    """
+
+    score = _line_penalty(rows, size) + _line_penalty(columns, size)
+
+    # Condition 2: 3 points for every 2x2 block of the same colour
+    # Compare each module with the one above it, and with the one to its left
+    same_above = ~(rows ^ (rows >> size))
+    same_left = ~(rows ^ (rows >> 1))
+    blocks = same_above & (same_above >> 1) & same_left & block_positions(size)
+    score += 3 * blocks.bit_count()
+
+    # Condition 4: 10 points for every 5% the proportion of dark modules is away from 50%
+    total_modules = size * size
+    counter = total_modules - rows.bit_count()
+
+    previous_multiple_of_five = (counter * 20 // total_modules) * 5
+    next_multiple_of_five = previous_multiple_of_five + 5
+
+    return score + min(abs(previous_multiple_of_five - 50), abs(next_multiple_of_five - 50)) // 5 * 10
+
+
+def apply_best_mask(matrix: QRMatrix) -> tuple[QRMatrix, int]:
+    """
+    Applies all 8 masks to the data modules, scores them, and returns the best one
+
+    :param matrix: The unmasked QR code, with 0 for dark modules and 1 for light modules. Its function modules are never masked
+    :type matrix: QRMatrix
+    :return: The QR code with the optimal mask applied, and the number of the mask
+    :rtype: tuple[QRMatrix, int]
+    """
+
+    size = matrix.size
+    row_words, column_words = mask_words(size, matrix.function_mask)
+
+    rows = pack(matrix.modules)
+    columns = pack(transpose(matrix.modules, size))
+
+    scores = [score_mask(rows ^ row_word, columns ^ column_word, size) for row_word, column_word in zip(row_words, column_words)]
+
+    # Ties go to the lowest numbered mask, like list.index(min(...))
+    best = scores.index(min(scores))
+
+    return QRMatrix(size, unpack(rows ^ row_words[best], size * size), matrix.function_mask), best
@@ -0,0 +1,205 @@
+#######################################################
+# Vectorised Data Masking with NumPy
+# https://www.thonky.com/qr-code-tutorial/data-masking
+#######################################################
+
+# An optional replacement for the evaluation loops in apply_mask
+# All 8 masks are applied and scored at once with array operations, using the same rules, so the same mask is chosen
+# NumPy is not required; is_available() reports whether this engine can be used
+
+from functools import lru_cache
+
+import qr_spec
+from qr_matrix import QRMatrix
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Condition 3 patterns with 1 as a dark module: dark-light-dark-dark-dark-light-dark with 4 light modules on one side
+# Each 11 module window is packed into an integer, first module in the highest bit
+FINDER_LIKE_PATTERNS = (0b10111010000, 0b00001011101)
+
+
+def is_available() -> bool:
+    """
+    Returns whether NumPy is installed, so this engine can be used
+
+    :return: True if NumPy can be imported
+    :rtype: bool
+    """
+
+    return np is not None
+
+
+@lru_cache(maxsize=None)
+def mask_patterns(size: int):
+    """
+    Returns all 8 mask patterns for a QR code of the given size, built once per size
+
+    :param size: The number of modules along each side of the QR code
+    :type size: int
+    :return: A read-only boolean array of shape (8, size, size). True where the mask flips the module
+    :rtype: numpy.ndarray
+    """
+
+    row, column = np.indices((size, size))
+
+    patterns = np.stack([condition(row, column) for condition in qr_spec.MASK_CONDITIONS])
+    patterns.flags.writeable = False
+
+    return patterns
+
+
+def _run_penalty(lines):
+    """
+    Condition 1: 3 points for every run of 5 modules of the same colour, plus 1 for each extra module in the run
+
+    :param lines: Array of shape (candidates, lines, size) where each line is a row or column
+    :type lines: numpy.ndarray
+    :return: The penalty for each candidate
+    :rtype: numpy.ndarray
+    """
+
+    candidates, num_of_lines, size = lines.shape
+
+    # Mark the start of every run, plus an extra column marking the end of each line
+    # Flattened, the distance between consecutive marks is the length of each run
+    # The gap between the end of one line and the start of the next is 1, which is never penalised
+    run_starts = np.ones((candidates, num_of_lines, size + 1), dtype=bool)
+    run_starts[:, :, 1:size] = lines[:, :, 1:] != lines[:, :, :-1]
+
+    scores = np.zeros(candidates, dtype=np.int64)
+    for i in range(candidates):
+        run_lengths = np.diff(np.flatnonzero(run_starts[i]))
+        long_runs = run_lengths[run_lengths >= 5]
+        scores[i] = (long_runs - 2).sum()
+
+    return scores
+
+
+def _block_penalty(candidates):
+    """
+    Condition 2: 3 points for every 2x2 block of the same colour, counting overlapping blocks
+
+    :param candidates: Array of shape (candidates, size, size)
+    :type candidates: numpy.ndarray
+    :return: The penalty for each candidate
+    :rtype: numpy.ndarray
+    """
+
+    top_left = candidates[:, :-1, :-1]
+    same = (top_left == candidates[:, :-1, 1:]) & (top_left == candidates[:, 1:, :-1]) & (top_left == candidates[:, 1:, 1:])
+
+    return same.sum(axis=(1, 2)) * 3
+
+
+def _finder_like_penalty(dark):
+    """
+    Condition 3: 40 points for every occurrence of a finder-like pattern in a row or column
+
+    :param dark: Array of shape (candidates, size, size), 1 for dark modules
+    :type dark: numpy.ndarray
+    :return: The penalty for each candidate
+    :rtype: numpy.ndarray
+    """
+
+    scores = np.zeros(dark.shape[0], dtype=np.int64)
+
+    for lines in (dark, dark.transpose(0, 2, 1)):
+        size = lines.shape[2]
+
+        # Convolve every row with the powers of 2, so each 11 module window becomes one integer
+        windows = np.zeros(lines.shape[:2] + (size - 10,), dtype=np.int32)
+        for k in range(11):
+            windows += lines[:, :, k:size - 10 + k].astype(np.int32) << (10 - k)
+
+        for pattern in FINDER_LIKE_PATTERNS:
+            scores += (windows == pattern).sum(axis=(1, 2)) * 40
+
+    return scores
+
+
+def _balance_penalty(dark):
+    """
+    Condition 4: 10 points for every 5% the proportion of dark modules is away from 50%
+
+    :param dark: Array of shape (candidates, size, size), 1 for dark modules
+    :type dark: numpy.ndarray
+    :return: The penalty for each candidate
+    :rtype: numpy.ndarray
+    """
+
+    total_modules = dark.shape[1] * dark.shape[2]
+    counter = dark.sum(axis=(1, 2), dtype=np.int64)
+
+    previous_multiple_of_five = (counter * 20 // total_modules) * 5
+    next_multiple_of_five = previous_multiple_of_five + 5
+
+    return np.minimum(abs(previous_multiple_of_five - 50), abs(next_multiple_of_five - 50)) // 5 * 10
+
+
+def score_masks(candidates):
+    """
+    Scores a stack of masked QR codes with all four penalty conditions
+
+    :param candidates: Array of shape (candidates, size, size), 0 for dark modules and 1 for light modules
+    :type candidates: numpy.ndarray
+    :return: The total penalty for each candidate
+    :rtype: numpy.ndarray
+    """
+
+    dark = (candidates == 0).astype(np.uint8)
+
+    return (
+        _run_penalty(dark)
+        + _run_penalty(dark.transpose(0, 2, 1))
+        + _block_penalty(dark)
+        + _finder_like_penalty(dark)
+        + _balance_penalty(dark)
+    )
+
+
+def scatter_bits(modules: bytearray, data_indices, packed_bits: bytes, num_of_bits: int) -> None:
+    """
+    Places the data bits into the modules in one step. 1 is a light module, so each bit is flipped as it is placed
+
+    :param modules: The flat modules of the QR code, written in place
+    :type modules: bytearray
+    :param data_indices: The flat index of every data module, in placement order
+    :type data_indices: memoryview
+    :param packed_bits: The bits to place, packed most significant bit first
+    :type packed_bits: bytes
+    :param num_of_bits: How many of the packed bits to place
+    :type num_of_bits: int
+    """
+
+    bits = np.unpackbits(np.frombuffer(packed_bits, dtype=np.uint8), count=num_of_bits)
+    np.frombuffer(modules, dtype=np.uint8)[np.frombuffer(data_indices, dtype=np.uint32)] = 1 - bits
+
+
+def apply_best_mask(matrix: QRMatrix) -> tuple[QRMatrix, int]:
+    """
+    Applies all 8 masks to the data modules, scores them, and returns the best one
+
+    :param matrix: The unmasked QR code, with 0 for dark modules and 1 for light modules. Its function modules are never masked
+    :type matrix: QRMatrix
+    :return: The QR code with the optimal mask applied, and the number of the mask
+    :rtype: tuple[QRMatrix, int]
+    """
+
+    if not is_available():
+        raise ImportError("NumPy is needed for the 'numpy' mask engine. Install numpy, or use the 'bits' or 'python' engine.")
+
+    modules = np.asarray(matrix)
+    data_region = np.frombuffer(matrix.function_mask, dtype=np.uint8).reshape(matrix.size, matrix.size) == 0
+
+    candidates = modules ^ (mask_patterns(matrix.size) & data_region)
+    scores = score_masks(candidates)
+
+    # argmin picks the lowest numbered mask on a tie, like list.index(min(...))
+    best = int(np.argmin(scores))
+
+    return QRMatrix(matrix.size, bytearray(candidates[best].tobytes()), matrix.function_mask), best
@@ -6,48 +6,199 @@
 # Importing useful modules
 ###########################
 
-from copy import copy, deepcopy
-from PIL import Image
-from itertools import product
+import argparse
+import asyncio
+from bisect import bisect_left
+from array import array
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice, product
+import csv
+import json
+import os
+import re
+from types import MappingProxyType
+from typing import NamedTuple
+
+import galois_field as gf
+import masking_bits
+import masking_numpy
+import qr_cache
+import qr_decoder
+import qr_service
+import qr_spec
+import reed_solomon
+import renderers
+from bit_buffer import BitBuffer
+from qr_matrix import QRMatrix
 
 #########################################################
 # Stage 1: Data Analysis
 # https://www.thonky.com/qr-code-tutorial/data-analysis
 #########################################################
 
-def determine_encoding(data: str) -> str:
+# There are 4 encoding modes. Each one is identified by a 4-bit mode indicator:
+#   Numeric mode -> 0001 (digits only, 10 bits per 3 characters)
+#   Alphanumeric mode -> 0010 (the 45 characters below, 11 bits per 2 characters)
+#   Byte mode -> 0100 (8 bits per byte)
+#   Kanji mode -> 1000 (Shift JIS double-byte characters, 13 bits per character)
+
+# Instead of picking one mode for the whole input, the data is split into segments, each with its own mode
+# e.g., at version 1, "ORDER-0001234567890123/ABCD" takes 155 bits as an alphanumeric segment ("ORDER-"), a numeric segment
+# ("0001234567890123") and another alphanumeric segment ("/ABCD"), against 162 bits as a single alphanumeric segment
+# A shorter run of digits does not pay for the extra mode and character count indicators, e.g., "ORDER-000123456789/ABCD" stays in one segment
+# https://www.thonky.com/qr-code-tutorial/data-analysis#mixing-modes
+
+NUMERIC_CHARS = "0123456789"
+ALPHANUMERIC_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+
+# The order the modes are tried in, which is also the order of the cost lists below
+SEGMENT_MODES = ('0001', '0010', '0100', '1000')
+
+
+# Helper function to convert a character to its 13-bit Kanji mode value
+def get_kanji_value(char: str) -> int | None:
+    """
+    Returns the 13-bit value used to store the character in Kanji mode, or None if it cannot be stored in Kanji mode
+    
+    :param char: A single character
+    :type char: str
+    :return: The value to be written in 13 bits, or None
+    :rtype: int | None
+    """
+    
+    try:
+        sjis_bytes = char.encode('shift_jis')
+    except UnicodeEncodeError:
+        return None
+    
+    if len(sjis_bytes) != 2:
+        return None
+    
+    code = (sjis_bytes[0] << 8) | sjis_bytes[1]
+    
+    # Subtract the start of the range the character is in, then pack the two bytes into 13 bits
+    if 0x8140 <= code <= 0x9FFC:
+        code -= 0x8140
+    elif 0xE040 <= code <= 0xEBBF:
+        code -= 0xC140
+    else:
+        return None
+    
+    return (code >> 8) * 0xC0 + (code & 0xFF)
+
+
+def determine_segments(data: str, version: int) -> list[tuple[str, str | bytes]]:
     """
-    Returns 4 bits representing the encoding type to be used in the QR code; only supports up to byte mode for now
-        \tNumeric mode -> 0001
-        \tAlphanumeric Mode -> 0010
-        \tByte Mode -> 0011
+    Splits the data into the sequence of mode segments that takes the fewest bits for the given version
+    \nThe character count indicator widths change with the version, so the best split can differ between versions
+    \nByte mode segments hold their encoded bytes (ISO-8859-1 if the whole input allows it, otherwise UTF-8)
     
     :param data: The data to be encoded in the QR code
     :type data: str
-    :return: Binary correlating to encoding modes
-    :rtype: str
+    :param version: The version that determines the character count indicator widths
+    :type version: int
+    :return: A list of (mode indicator, segment data) tuples
+    :rtype: list[tuple[str, str | bytes]]
     """
     
-    digits = "0123456789"
-    alphanumeric_chars = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
-    iso_8859_1 = ''.join(chr(i) for i in range(256))
+    if not data:
+        return []
+    
+    try:
+        data.encode('iso-8859-1')
+        byte_encoding = 'iso-8859-1'
+    except UnicodeEncodeError:
+        byte_encoding = 'utf-8'
+    
+    # All costs are in sixths of a bit, so numeric (10/3 bits) and alphanumeric (11/2 bits) characters have whole costs
+    # A segment's total is rounded up to a whole bit when the next segment starts
+    head_costs = [(4 + determine_character_count_indicator(version, mode)) * 6 for mode in SEGMENT_MODES]
+    infinity = float('inf')
+    
+    # previous_modes[i][j] is the mode used for character i on the cheapest path where the segment after it is in mode j
+    previous_modes = []
+    costs = head_costs[:]
+    
+    for char in data:
+        char_costs = [
+            20 if char in NUMERIC_CHARS else infinity,
+            33 if char in ALPHANUMERIC_CHARS else infinity,
+            len(char.encode(byte_encoding)) * 48,
+            78 if get_kanji_value(char) is not None else infinity,
+        ]
+        
+        # Either continue the current segment in the same mode...
+        continue_costs = [costs[j] + char_costs[j] for j in range(4)]
+        new_costs = continue_costs[:]
+        modes = [j if char_costs[j] != infinity else None for j in range(4)]
+        
+        # ...or end the segment after this character and pay for the next mode indicator and character count indicator
+        for j in range(4):
+            for k in range(4):
+                if char_costs[k] == infinity:
+                    continue
+                
+                switch_cost = -(-continue_costs[k] // 6) * 6 + head_costs[j]
+                if switch_cost < new_costs[j]:
+                    new_costs[j] = switch_cost
+                    modes[j] = k
+        
+        previous_modes.append(modes)
+        costs = new_costs
+    
+    # Walk back from the cheapest final mode to find the mode of every character
+    current_mode = min(range(4), key=lambda j: -(-costs[j] // 6))
+    char_modes = [0] * len(data)
+    
+    for i in range(len(data) - 1, -1, -1):
+        current_mode = previous_modes[i][current_mode]
+        char_modes[i] = current_mode
     
-    # Numeric mode
-    if all(i in digits for i in data):
-        return '0001'
+    # Group runs of the same mode into segments
+    segments = []
+    start = 0
+    
+    for i in range(1, len(data) + 1):
+        if i == len(data) or char_modes[i] != char_modes[start]:
+            mode = SEGMENT_MODES[char_modes[start]]
+            text = data[start:i]
+            segments.append((mode, text.encode(byte_encoding) if mode == '0100' else text))
+            start = i
+    
+    return segments
+
+
+def get_segments_bit_length(segments: list[tuple[str, str | bytes]], version: int) -> int:
+    """
+    Returns the exact number of bits needed to store the segments, including their mode and character count indicators
+    
+    :param segments: A list of (mode indicator, segment data) tuples
+    :type segments: list[tuple[str, str | bytes]]
+    :param version: The version that determines the character count indicator widths
+    :type version: int
+    :return: The total number of bits
+    :rtype: int
+    """
     
-    # Alphanumeric mode
-    if all(i in alphanumeric_chars for i in data):
-        return '0010'
+    total = 0
     
-    # Byte mode
-    # Possible issue:
-    # https://www.thonky.com/qr-code-tutorial/data-analysis#a-note-about-utf8
-    if all(i in iso_8859_1 for i in data):
-        return '0011'
+    for mode, segment_data in segments:
+        num_of_chars = len(segment_data)
+        total += 4 + determine_character_count_indicator(version, mode)
+        
+        if mode == '0001':
+            total += (num_of_chars // 3) * 10 + [0, 4, 7][num_of_chars % 3]
+        elif mode == '0010':
+            total += (num_of_chars // 2) * 11 + (num_of_chars % 2) * 6
+        elif mode == '0100':
+            total += num_of_chars * 8
+        else:
+            total += num_of_chars * 13
     
-    # Not supporting other encodings yet, raises NotImplemented otherwise
-    raise NotImplementedError("Invalid encoding mode detected. Only Numeric, Alphanumeric, and Byte modes are implemented.")
+    return total
 
 
 ########################################################
@@ -67,64 +218,193 @@ def determine_encoding(data: str) -> str:
 # Version Capacity Table:
 # https://www.thonky.com/qr-code-tutorial/character-capacities
 
-# As far as I can tell (for now, at least), this must be chosen before the encoding can begin
-# Potential TODO when done: find the highest EC level on the lowest version where the data still fits, prioritise smaller size or higher EC?
+# The EC level can be chosen by the caller, or with ec_level='auto', the highest EC level
+# on the lowest version where the data still fits is used (see choose_ec_level)
+# This prioritises the smallest size, then the highest damage tolerance that comes for free at that size
 
 
 # Step 2: Determine the Smallest Version
-# The version depends on the length of the data, the chosen error correction level, and the encoding type
+# The version depends on the length of the data, the chosen error correction level, and the encoding modes
+
+# Capacity Index
+# Built once from the spec tables, for determine_version and for validating payloads up front
+# The character capacity tables on Thonky's website are derived from the same numbers
+
+# Versions that share the same character count indicator widths
+VERSION_RANGES = ((1, 9), (10, 26), (27, 40))
+
+def build_capacity_index() -> tuple[dict[str, tuple[int, ...]], dict[tuple[int, str, str], int]]:
+    """
+    Builds the number of data bits available in each version, and the maximum number of characters in each mode
+    
+    :return: Data bits per version (index 0 is version 1) for each EC level, and the maximum payload keyed by (version, EC level, mode)
+    :rtype: tuple[dict[str, tuple[int, ...]], dict[tuple[int, str, str], int]]
+    """
+    
+    data_bits = {ec_level: tuple(qr_spec.DATA_CODEWORDS[version][ec_index] * 8 for version in qr_spec.VERSIONS) for ec_index, ec_level in enumerate(qr_spec.EC_LEVELS)}
+    max_payload = {}
+    
+    for ec_level in qr_spec.EC_LEVELS:
+        for version in qr_spec.VERSIONS:
+            for mode in SEGMENT_MODES:
+                # Bits left over after a single segment's mode indicator and character count indicator
+                available = data_bits[ec_level][version - 1] - 4 - qr_spec.CHARACTER_COUNT_BITS[mode][version]
+                
+                if mode == '0001':
+                    num_of_chars = (available // 10) * 3 + [0, 0, 0, 0, 1, 1, 1, 2, 2, 2][available % 10]
+                elif mode == '0010':
+                    num_of_chars = (available // 11) * 2 + (available % 11 >= 6)
+                elif mode == '0100':
+                    num_of_chars = available // 8
+                else:
+                    num_of_chars = available // 13
+                
+                max_payload[(version, ec_level, mode)] = num_of_chars
+    
+    return data_bits, max_payload
+
+
+DATA_BITS, MAX_PAYLOAD = build_capacity_index()
+
 
-def determine_version(encoding_type: str, ec_level: str, data: str) -> int:
+def find_smallest_version(ec_level: str, num_of_bits: int, first_version: int = 1, last_version: int = 40) -> int | None:
     """
-    Returns an integer representing the smallest version of QR code for the given EC level and input text
+    Returns the smallest version in the given range with room for the given number of data bits, found by binary search
     
-    :param encoding_type: Binary representation of encoding type (e.g., 0001, 0010, 0011)
-    :type encoding_type: str
     :param ec_level: Error Correction Level. Single Character (e.g., 'L', 'M', 'Q', 'H')
     :type ec_level: str
+    :param num_of_bits: The exact number of bits the segments take up
+    :type num_of_bits: int
+    :param first_version: The smallest version to consider
+    :type first_version: int
+    :param last_version: The largest version to consider
+    :type last_version: int
+    :return: The smallest version that fits, or None if none of them do
+    :rtype: int | None
+    """
+    
+    index = bisect_left(DATA_BITS[ec_level], num_of_bits, first_version - 1, last_version)
+    
+    if index == last_version:
+        return None
+    
+    return index + 1
+
+
+def get_max_payload(version: int, ec_level: str, mode: str) -> int:
+    """
+    Returns the maximum number of characters (bytes in byte mode) that fit in a single-segment QR code
+    
+    :param version: The version of the QR code
+    :type version: int
+    :param ec_level: Error Correction Level. Single Character (e.g., 'L', 'M', 'Q', 'H')
+    :type ec_level: str
+    :param mode: The mode indicator of the segment
+    :type mode: str
+    :return: The maximum number of characters
+    :rtype: int
+    """
+    
+    return MAX_PAYLOAD[(version, ec_level, mode)]
+
+
+def get_range_segments(data: str, first_version: int, segments_per_range: dict[int, tuple[list[tuple[str, str | bytes]], int]]) -> tuple[list[tuple[str, str | bytes]], int]:
+    """
+    Returns the best segments, and their exact length in bits, for the range of versions starting at first_version
+    \nThe segments are only worked out the first time a range is asked for, and kept in segments_per_range after that
+    
     :param data: Text to be encoded into the QR code
     :type data: str
-    :return: Version of the QR code
-    :rtype: int
+    :param first_version: The first version of a range in VERSION_RANGES
+    :type first_version: int
+    :param segments_per_range: The ranges worked out so far, keyed by their first version
+    :type segments_per_range: dict[int, tuple[list[tuple[str, str | bytes]], int]]
+    :return: The segments and their number of bits
+    :rtype: tuple[list[tuple[str, str | bytes]], int]
     """
     
-    version_capacities = {
-        'L': {
-            '0001': ['41', '77', '127', '187', '255', '322', '370', '461', '552', '652', '772', '883', '1022', '1101', '1250', '1408', '1548', '1725', '1903', '2061', '2232', '2409', '2620', '2812', '3057', '3283', '3517', '3669', '3909', '4158', '4417', '4686', '4965', '5253', '5529', '5836', '6153', '6479', '6743', '7089'],
-            '0010': ['25', '47', '77', '114', '154', '195', '224', '279', '335', '395', '468', '535', '619', '667', '758', '854', '938', '1046', '1153', '1249', '1352', '1460', '1588', '1704', '1853', '1990', '2132', '2223', '2369', '2520', '2677', '2840', '3009', '3183', '3351', '3537', '3729', '3927', '4087', '4296'],
-            '0011': ['17', '32', '53', '78', '106', '134', '154', '192', '230', '271', '321', '367', '425', '458', '520', '586', '644', '718', '792', '858', '929', '1003', '1091', '1171', '1273', '1367', '1465', '1528', '1628', '1732', '1840', '1952', '2068', '2188', '2303', '2431', '2563', '2699', '2809', '2953']
-        },
-        'M': {
-            '0001': ['34', '63', '101', '149', '202', '255', '293', '365', '432', '513', '604', '691', '796', '871', '991', '1082', '1212', '1346', '1500', '1600', '1708', '1872', '2059', '2188', '2395', '2544', '2701', '2857', '3035', '3289', '3486', '3693', '3909', '4134', '4343', '4588', '4775', '5039', '5313', '5596'],
-            '0010': ['20', '38', '61', '90', '122', '154', '178', '221', '262', '311', '366', '419', '483', '528', '600', '656', '734', '816', '909', '970', '1035', '1134', '1248', '1326', '1451', '1542', '1637', '1732', '1839', '1994', '2113', '2238', '2369', '2506', '2632', '2780', '2894', '3054', '3220', '3391'],
-            '0011': ['14', '26', '42', '62', '84', '106', '122', '152', '180', '213', '251', '287', '331', '362', '412', '450', '504', '560', '624', '666', '711', '779', '857', '911', '997', '1059', '1125', '1190', '1264', '1370', '1452', '1538', '1628', '1722', '1809', '1911', '1989', '2099', '2213', '2331']
-        },
-        'Q': {
-            '0001': ['27', '48', '77', '111', '144', '178', '207', '259', '312', '364', '427', '489', '580', '621', '703', '775', '876', '948', '1063', '1159', '1224', '1358', '1468', '1588', '1718', '1804', '1933', '2085', '2181', '2358', '2473', '2670', '2805', '2949', '3081', '3244', '3417', '3599', '3791', '3993'], 
-            '0010': ['16', '29', '47', '67', '87', '108', '125', '157', '189', '221', '259', '296', '352', '376', '426', '470', '531', '574', '644', '702', '742', '823', '890', '963', '1041', '1094', '1172', '1263', '1322', '1429', '1499', '1618', '1700', '1787', '1867', '1966', '2071', '2181', '2298', '2420'],
-            '0011': ['11', '20', '32', '46', '60', '74', '86', '108', '130', '151', '177', '203', '241', '258', '292', '322', '364', '394', '442', '482', '509', '565', '611', '661', '715', '751', '805', '868', '908', '982', '1030', '1112', '1168', '1228', '1283', '1351', '1423', '1499', '1579', '1663']
-        },
-        'H': {
-            '0001': ['17', '34', '58', '82', '106', '139', '154', '202', '235', '288', '331', '374', '427', '468', '530', '602', '674', '746', '813', '919', '969', '1056', '1108', '1228', '1286', '1425', '1501', '1581', '1677', '1782', '1897', '2022', '2157', '2301', '2361', '2524', '2625', '2735', '2927', '3057'],
-            '0010': ['10', '20', '35', '50', '64', '84', '93', '122', '143', '174', '200', '227', '259', '283', '321', '365', '408', '452', '493', '557', '587', '640', '672', '744', '779', '864', '910', '958', '1016', '1080', '1150', '1226', '1307', '1394', '1431', '1530', '1591', '1658', '1774', '1852'],
-            '0011': ['7', '14', '24', '34', '44', '58', '64', '84', '98', '119', '137', '155', '177', '194', '220', '250', '280', '310', '338', '382', '403', '439', '461', '511', '535', '593', '625', '658', '698', '742', '790', '842', '898', '958', '983', '1051', '1093', '1139', '1219', '1273']
-        }
-    }
+    if first_version not in segments_per_range:
+        segments = determine_segments(data, first_version)
+        segments_per_range[first_version] = (segments, get_segments_bit_length(segments, first_version))
+    
+    return segments_per_range[first_version]
+
+
+def determine_version(ec_level: str, data: str, max_version: int = 40, segments_per_range: dict | None = None) -> tuple[int, list[tuple[str, str | bytes]]]:
+    """
+    Returns the smallest version of QR code that can hold the input text at the given EC level, and the segments to encode it with
     
-    num_of_chars = len(data)
+    :param ec_level: Error Correction Level. Single Character (e.g., 'L', 'M', 'Q', 'H')
+    :type ec_level: str
+    :param data: Text to be encoded into the QR code
+    :type data: str
+    :param max_version: The largest version that may be used. Defaults to 40
+    :type max_version: int, optional
+    :param segments_per_range: The segments already worked out for each range, see get_range_segments. Ranges that are checked are added to it
+    :type segments_per_range: dict, optional
+    :return: Version of the QR code and the segments for that version
+    :rtype: tuple[int, list[tuple[str, str | bytes]]]
+    """
     
-    for version in range(1, 41):
-        if num_of_chars <= int(version_capacities[ec_level][encoding_type][version - 1]):
-            return version
+    if segments_per_range is None:
+        segments_per_range = {}
+    
+    # The character count indicators only change size at versions 10 and 27, so there are 3 ranges to check
+    # Most data fits in the first range, so the later ranges are only segmented when the earlier ones are too small
+    for first_version, last_version in VERSION_RANGES:
+        if first_version > max_version:
+            break
+        
+        segments, num_of_bits = get_range_segments(data, first_version, segments_per_range)
+        version = find_smallest_version(ec_level, num_of_bits, first_version, min(last_version, max_version))
+        
+        if version is not None:
+            return version, segments
     
     if ec_level == "L":
-        raise Exception("Input too long, even with lowest EC level.")
+        raise qr_spec.DataTooLongError("Input too long, even with lowest EC level.")
     else:
-        raise Exception("Input too long. Use a lower EC level or use a shorter input.")
+        raise qr_spec.DataTooLongError("Input too long. Use a lower EC level or use a shorter input.")
+
+
+def choose_ec_level(data: str, min_ec: str = 'L', max_version: int = 40) -> tuple[str, int, list[tuple[str, str | bytes]]]:
+    """
+    Finds the highest EC level that fits the data in the smallest possible version
+    \nEvery EC level is checked against the capacity index using the same segments, so each range of versions is analysed at most once
+    
+    :param data: Text to be encoded into the QR code
+    :type data: str
+    :param min_ec: The lowest EC level that may be chosen. Defaults to 'L'
+    :type min_ec: str, optional
+    :param max_version: The largest version that may be used. Defaults to 40
+    :type max_version: int, optional
+    :return: The EC level, the version, and the segments for that version
+    :rtype: tuple[str, int, list[tuple[str, str | bytes]]]
+    """
+    
+    segments_per_range = {}
+    best = None
+    
+    for ec_level in qr_spec.EC_LEVELS[qr_spec.EC_INDEX[min_ec]:]:
+        try:
+            version, segments = determine_version(ec_level, data, max_version, segments_per_range)
+        except qr_spec.DataTooLongError:
+            break # Higher EC levels hold even less data
+        
+        # Higher EC levels are checked last, so a tie on version means more error correction for the same size
+        if best is None or version <= best[1]:
+            best = (ec_level, version, segments)
+        else:
+            break
+    
+    if best is None:
+        raise qr_spec.DataTooLongError(f"Input too long to fit in version {max_version} with EC level {min_ec} or higher.")
+    
+    return best
 
 
 # Step 3: Add the Mode Indicator
-# Already retrieved by the determine_encoding function
+# Each segment starts with its own mode indicator, see determine_segments
 
 
 # Step 4: Add the Character Count Indicator
@@ -142,27 +422,8 @@ def determine_character_count_indicator(version: int, encoding_mode: str) -> int
     :rtype: int
     """
     
-    if version <= 9:
-        if encoding_mode == '0001':
-            return 10   
-        if encoding_mode == '0010':
-            return 9
-        if encoding_mode == '0011':
-            return 8
-    if version <= 26:
-        if encoding_mode == '0001':
-            return 12
-        if encoding_mode == '0010':
-            return 11
-        if encoding_mode == '0011':
-            return 16
-    if version <= 40:
-        if encoding_mode == '0001':
-            return 14
-        if encoding_mode == '0010':
-            return 13
-        if encoding_mode == '0011':
-            return 16
+    if encoding_mode in qr_spec.CHARACTER_COUNT_BITS and version in qr_spec.VERSIONS:
+        return qr_spec.CHARACTER_COUNT_BITS[encoding_mode][version]
     
     raise Exception("Invalid version or encoding mode.")
 
@@ -170,40 +431,31 @@ def determine_character_count_indicator(version: int, encoding_mode: str) -> int
 # Step 5: Encode Using the Selected Mode
 # Each encoding mode must be handled differently
 
-def convert_to_binary(encoding_mode: str, data: str) -> str:
+def convert_to_binary(encoding_mode: str, data: str | bytes, bit_buffer: BitBuffer | None = None) -> BitBuffer:
     """
-    Returns a concatenated string of binary after correctly converting the data to binary for the given encoding mode
+    Converts the data to binary for the given encoding mode and appends it to a bit buffer
     
     :param encoding_mode: String of binary representing the encription mode for the given data
     :type encoding_mode: str
-    :param data: The data to be encoded into the QR code
-    :type data: str
-    :return: A string containing the data converted into binary via the specific method for the encoding type
-    :rtype: str
+    :param data: The data to be encoded into the QR code. Byte mode also accepts already encoded bytes
+    :type data: str | bytes
+    :param bit_buffer: The buffer to append the bits to. A new buffer is created if not given
+    :type bit_buffer: BitBuffer, optional
+    :return: The bit buffer, with the data converted into binary via the specific method for the encoding type
+    :rtype: BitBuffer
     """
     
-    split_up_data = None
+    if bit_buffer is None:
+        bit_buffer = BitBuffer()
     
     # Numeric Mode
     if encoding_mode == '0001':
-        split_up_data = [data[i:i + 3] for i in range(0, len(data), 3)]
+        # Groups of 3 digits take 10 bits, a final group of 2 takes 7 bits and a final single digit takes 4 bits
+        group_bits = [0, 4, 7, 10]
         
-        # Turn into binary
-        for i in range(len(split_up_data)):
-            if len(split_up_data[i]) == 3:
-                if split_up_data[i][0:2] == '00':
-                    split_up_data[i] = bin(int(split_up_data[i]))[2:].zfill(4)
-                elif split_up_data[i][0] == '0':
-                    split_up_data[i] = bin(int(split_up_data[i]))[2:].zfill(7)
-                else:
-                    split_up_data[i] = bin(int(split_up_data[i]))[2:].zfill(10)
-            elif len(split_up_data[i]) == 2:
-                if split_up_data[i][0] == '0':
-                    split_up_data[i] = bin(int(split_up_data[i]))[2:].zfill(4)
-                else:
-                    split_up_data[i] = bin(int(split_up_data[i]))[2:].zfill(10)
-            else:
-                split_up_data[i] = bin(int(split_up_data[i]))[2:].zfill(4)
+        for i in range(0, len(data), 3):
+            group = data[i:i + 3]
+            bit_buffer.append_bits(int(group), group_bits[len(group)])
     
     # Alphanumeric Mode
     elif encoding_mode == '0010':
@@ -255,28 +507,50 @@ def convert_to_binary(encoding_mode: str, data: str) -> str:
             ':': 44
         }
         
-        split_up_data = [data[i:i + 2] for i in range(0, len(data), 2)]
+        for i in range(0, len(data) - 1, 2):
+            bit_buffer.append_bits(char_mapping[data[i]]*45 + char_mapping[data[i+1]], 11)
         
-        # Turn into binary
-        for i in range(len(split_up_data)):
-            if len(split_up_data[i]) == 1:
-                split_up_data[i] = bin(char_mapping[split_up_data[i]])[2:].zfill(6)
-            else:
-                split_up_data[i] = bin(char_mapping[split_up_data[i][0]]*45 + char_mapping[split_up_data[i][1]])[2:].zfill(11)
+        # An odd character at the end only needs 6 bits
+        if len(data) % 2 == 1:
+            bit_buffer.append_bits(char_mapping[data[-1]], 6)
     
     # Byte Mode
-    elif encoding_mode == '0011':
-        split_up_data = list(data)
-        
-        # Turn into binary
-        for i in range(len(split_up_data)):
-            # The Thonky tutorial says to convert to hex, then to binary, but I will skip straight to binary
-            split_up_data[i] = bin(ord(split_up_data[i]))[2:].zfill(8)
+    elif encoding_mode == '0100':
+        # The Thonky tutorial says to convert to hex, then to binary, but I will skip straight to the bytes
+        bit_buffer.append_bytes(data if isinstance(data, bytes) else data.encode('iso-8859-1'))
+    
+    # Kanji Mode
+    elif encoding_mode == '1000':
+        for char in data:
+            bit_buffer.append_bits(get_kanji_value(char), 13)
     
-    if split_up_data is not None:
-        return ''.join(split_up_data)
+    else:
+        raise Exception("Data not encoded in a supported mode.")
+    
+    return bit_buffer
 
-    raise Exception("Data not encoded in a supported mode.")
+
+# Every segment is written as its mode indicator, then its character count indicator, then its data
+def convert_segments_to_binary(segments: list[tuple[str, str | bytes]], version: int) -> BitBuffer:
+    """
+    Writes every segment, with its mode indicator and character count indicator, into a single bit buffer
+    
+    :param segments: A list of (mode indicator, segment data) tuples
+    :type segments: list[tuple[str, str | bytes]]
+    :param version: The version of the QR code
+    :type version: int
+    :return: A bit buffer holding all of the segments
+    :rtype: BitBuffer
+    """
+    
+    bit_buffer = BitBuffer()
+    
+    for mode, segment_data in segments:
+        bit_buffer.append_bits(int(mode, base=2), 4)
+        bit_buffer.append_bits(len(segment_data), determine_character_count_indicator(version, mode))
+        convert_to_binary(mode, segment_data, bit_buffer)
+    
+    return bit_buffer
 
 
 # Step 6: Up into 8-bit Codewords and Add Pad Bytes if Necessary
@@ -296,209 +570,47 @@ def get_num_of_codewords(version: int, ec_level: str, block: int) -> int:
     :rtype: int
     """
     
-    num_of_codewords = {
-		"1-L": [19, 7],
-		"1-M": [16, 10],
-		"1-Q": [13, 13],
-		"1-H": [9, 17],
-		"2-L": [34, 10],
-		"2-M": [28, 16],
-		"2-Q": [22, 22],
-		"2-H": [16, 28],
-		"3-L": [55, 15],
-		"3-M": [44, 26],
-		"3-Q": [34, 18],
-		"3-H": [26, 22],
-		"4-L": [80, 20],
-		"4-M": [64, 18],
-		"4-Q": [48, 26],
-		"4-H": [36, 16],
-		"5-L": [108, 26],
-		"5-M": [86, 24],
-		"5-Q": [62, 18],
-		"5-H": [46, 22],
-		"6-L": [136, 18],
-		"6-M": [108, 16],
-		"6-Q": [76, 24],
-		"6-H": [60, 28],
-		"7-L": [156, 20],
-		"7-M": [124, 18],
-		"7-Q": [88, 18],
-		"7-H": [66, 26],
-		"8-L": [194, 24],
-		"8-M": [154, 22],
-		"8-Q": [110, 22],
-		"8-H": [86, 26],
-		"9-L": [232, 30],
-		"9-M": [182, 22],
-		"9-Q": [132, 20],
-		"9-H": [100, 24],
-		"10-L": [274, 18],
-		"10-M": [216, 26],
-		"10-Q": [154, 24],
-		"10-H": [122, 28],
-		"11-L": [324, 20],
-		"11-M": [254, 30],
-		"11-Q": [180, 28],
-		"11-H": [140, 24],
-		"12-L": [370, 24],
-		"12-M": [290, 22],
-		"12-Q": [206, 26],
-		"12-H": [158, 28],
-		"13-L": [428, 26],
-		"13-M": [334, 22],
-		"13-Q": [244, 24],
-		"13-H": [180, 22],
-		"14-L": [461, 30],
-		"14-M": [365, 24],
-		"14-Q": [261, 20],
-		"14-H": [197, 24],
-		"15-L": [523, 22],
-		"15-M": [415, 24],
-		"15-Q": [295, 30],
-		"15-H": [223, 24],
-		"16-L": [589, 24],
-		"16-M": [453, 28],
-		"16-Q": [325, 24],
-		"16-H": [253, 30],
-		"17-L": [647, 28],
-		"17-M": [507, 28],
-		"17-Q": [367, 28],
-		"17-H": [283, 28],
-		"18-L": [721, 30],
-		"18-M": [563, 26],
-		"18-Q": [397, 28],
-		"18-H": [313, 28],
-		"19-L": [795, 28],
-		"19-M": [627, 26],
-		"19-Q": [445, 26],
-		"19-H": [341, 26],
-		"20-L": [861, 28],
-		"20-M": [669, 26],
-		"20-Q": [485, 30],
-		"20-H": [385, 28],
-		"21-L": [932, 28],
-		"21-M": [714, 26],
-		"21-Q": [512, 28],
-		"21-H": [406, 30],
-		"22-L": [1006, 28],
-		"22-M": [782, 28],
-		"22-Q": [568, 30],
-		"22-H": [442, 24],
-		"23-L": [1094, 30],
-		"23-M": [860, 28],
-		"23-Q": [614, 30],
-		"23-H": [464, 30],
-		"24-L": [1174, 30],
-		"24-M": [914, 28],
-		"24-Q": [664, 30],
-		"24-H": [514, 30],
-		"25-L": [1276, 26],
-		"25-M": [1000, 28],
-		"25-Q": [718, 30],
-		"25-H": [538, 30],
-		"26-L": [1370, 28],
-		"26-M": [1062, 28],
-		"26-Q": [754, 28],
-		"26-H": [596, 30],
-		"27-L": [1468, 30],
-		"27-M": [1128, 28],
-		"27-Q": [808, 30],
-		"27-H": [628, 30],
-		"28-L": [1531, 30],
-		"28-M": [1193, 28],
-		"28-Q": [871, 30],
-		"28-H": [661, 30],
-		"29-L": [1631, 30],
-		"29-M": [1267, 28],
-		"29-Q": [911, 30],
-		"29-H": [701, 30],
-		"30-L": [1735, 30],
-		"30-M": [1373, 28],
-		"30-Q": [985, 30],
-		"30-H": [745, 30],
-		"31-L": [1843, 30],
-		"31-M": [1455, 28],
-		"31-Q": [1033, 30],
-		"31-H": [793, 30],
-		"32-L": [1955, 30],
-		"32-M": [1541, 28],
-		"32-Q": [1115, 30],
-		"32-H": [845, 30],
-		"33-L": [2071, 30],
-		"33-M": [1631, 28],
-		"33-Q": [1171, 30],
-		"33-H": [901, 30],
-		"34-L": [2191, 30],
-		"34-M": [1725, 28],
-		"34-Q": [1231, 30],
-		"34-H": [961, 30],
-		"35-L": [2306, 30],
-		"35-M": [1812, 28],
-		"35-Q": [1286, 30],
-		"35-H": [986, 30],
-		"36-L": [2434, 30],
-		"36-M": [1914, 28],
-		"36-Q": [1354, 30],
-		"36-H": [1054, 30],
-		"37-L": [2566, 30],
-		"37-M": [1992, 28],
-		"37-Q": [1426, 30],
-		"37-H": [1096, 30],
-		"38-L": [2702, 30],
-		"38-M": [2102, 28],
-		"38-Q": [1502, 30],
-		"38-H": [1142, 30],
-		"39-L": [2812, 30],
-		"39-M": [2216, 28],
-		"39-Q": [1582, 30],
-		"39-H": [1222, 30],
-		"40-L": [2956, 30],
-		"40-M": [2334, 28],
-		"40-Q": [1666, 30],
-		"40-H": [1276, 30],
-	}
-    
-    return num_of_codewords[f"{version}-{ec_level}"][block]
-
-
-def convert_to_codewords(version: int, ec_level: str, encoding_type: str, char_count_indicator: str, binary_data: str) -> list[str]:
-    """
-    Ensures the encoded data contains the correct amount of bits, then returns the full encoded binary data as a list of the binary string separated into bytes.
+    ec_index = qr_spec.EC_INDEX[ec_level]
+    
+    if block == 0:
+        return qr_spec.DATA_CODEWORDS[version][ec_index]
+    
+    return qr_spec.EC_CODEWORDS_PER_BLOCK[version][ec_index]
+
+
+def convert_to_codewords(version: int, ec_level: str, bit_buffer: BitBuffer) -> bytes:
+    """
+    Ensures the encoded data contains the correct amount of bits, then returns the full encoded data as 8-bit codewords.
+    \nThe terminator and padding bits are appended to the given bit buffer.
     
     :param version: Version of the QR code
     :type version: int
     :param ec_level: Error Correction level used in the QR code
     :type ec_level: str
-    :param encoding_type: Encoding mode used in the QR code
-    :type encoding_type: str
-    :param char_count_indicator: Binary string containing the character count indicator
-    :type char_count_indicator: str
-    :param binary_data: Data to be encoded into the QR code in a string of binary
-    :type binary_data: str
-    :return: Returns a list containing the full binary data, separated into bytes
-    :rtype: list[str]
+    :param bit_buffer: The mode indicator, character count indicator and encoded data
+    :type bit_buffer: BitBuffer
+    :return: Returns the full encoded data, separated into bytes
+    :rtype: bytes
     """
     
     num_of_bits = get_num_of_codewords(version, ec_level, 0) * 8
     
-    bit_string = encoding_type + char_count_indicator + binary_data
+    if len(bit_buffer) > num_of_bits:
+        raise qr_spec.DataTooLongError("Input too long for the chosen version.")
     
     # Add up to 4 0s as a terminator
-    if len(bit_string) <= num_of_bits:
-        bit_string += '0' * min(num_of_bits - len(bit_string), 4)
+    bit_buffer.append_bits(0, min(num_of_bits - len(bit_buffer), 4))
     
     # Add padding 0s to the end until it is a multiple of 8 bits
-    while len(bit_string)%8 != 0:
-        bit_string += '0'
+    bit_buffer.append_bits(0, -len(bit_buffer) % 8)
     
-    repeating_bytes = ["11101100","00010001"]
+    codewords = bit_buffer.to_bytes()
     
-    while len(bit_string) != num_of_bits:
-        bit_string += repeating_bytes[int((num_of_bits - len(bit_string))/8)%2]
+    # Fill the remaining space with the repeating pad bytes 11101100 and 00010001
+    num_of_pad_bytes = num_of_bits // 8 - len(codewords)
+    repeating_bytes = bytes([0b11101100, 0b00010001]) * (num_of_pad_bytes // 2 + 1)
     
-    
-    return [bit_string[i:i+8] for i in range(0,len(bit_string),8)]
+    return codewords + repeating_bytes[:num_of_pad_bytes]
 
 
 ####################################
@@ -507,115 +619,64 @@ def convert_to_codewords(version: int, ec_level: str, encoding_type: str, char_c
 ####################################
 
 # Step 1: Break Data Codewords into Blocks if Necessary
-# TODO come back to this
-
-
-# TODO Steps 3-6
-
+# Larger QR codes split the data codewords into groups, and each group into blocks
+# Every block gets its own error correction codewords
 
-# Step 7: The Generator Polynomial
-# Start by generating the Message Polynomial
-def generate_message_polynomial(codewords: list[str]) -> list[int]:
+# Helper function to get the block structure for a specific version and EC level
+def get_block_structure(version: int, ec_level: str) -> tuple[int, int, int, int, int]:
     """
-    Takes the codewords, broken into 8-bit bytes, and returns the alpha_exponents of the polynomial, starting with the highest coefficient at index 0
+    Returns the block layout from the ISO 18004 error correction table for the given version and EC level:
+        \tEC codewords per block
+        \tNumber of blocks in group 1
+        \tData codewords in each of group 1's blocks
+        \tNumber of blocks in group 2
+        \tData codewords in each of group 2's blocks
     
-    :param codewords: An array of codewords broken into 8-bit bytes
-    :type codewords: list[str]
-    :return: Returns a list containing the alpha_exponents of the polynomial, starting with the highest coefficient at index 0
-    :rtype: list[int]
-    """
-    
-    converted_to_ints = []
-    
-    for i in range(len(codewords)):
-        converted_to_ints.append(int(codewords[i], base=2))
-    
-    return converted_to_ints
-
-# Helper function for the Galois Field
-def gf256(exp: int) -> int:
-    """
-    Returns the value of 2**exp inside the Galois Field 256
-    
-    :param exp: The exponent of 2**exp
-    :type exp: int
-    :return: Returns 2**exp in the Galois Field 256
-    :rtype: int
+    :param version: The version of the QR code
+    :type version: int
+    :param ec_level: The error correction level of the QR code
+    :type ec_level: str
+    :return: The EC codewords per block, followed by the block count and block size of each group
+    :rtype: tuple[int, int, int, int, int]
     """
     
-    if exp > 255:
-        exp %= 285
-    
-    if exp < 0:
-        return -1
-    if exp <= 7:
-        return 2**exp
-    
-    num = (2**8)^285
-    for _ in range(8, exp):
-        num *= 2
-        if num > 255:
-            num ^= 285
-    
-    return num
+    return qr_spec.BLOCK_STRUCTURE[version][qr_spec.EC_INDEX[ec_level]]
 
-# Helper function to reverse the Galois Field
-def reverse_gf256(n: int) -> int:
-    """
-    Returns the value of the exponent of 2**exp inside the Galois Field 256
-    \ne.g., reverse_gf256(50) -> 194
-    \n 2**194 in gf(256) is 50, so the exponent, 194, is returned
-    
-    :param n: Takes a number 2**exp
-    :type n: int
-    :return: Returns the exponent of 2**exp in the Galois Field 256
-    :rtype: int
-    """
-    for i in range(256):
-        if gf256(i) == n:
-            return i
-    
-    return -1
 
-# Sepcialised helper function for bracket expansion
-def expand_brackets(expr1: list[str], expr2: list[str]) -> list[str]:
+def split_into_blocks(codewords: bytes, version: int, ec_level: str) -> list[bytes]:
     """
-    A specialised helper function that takes 2 polynomials as input, multiplies them together, and returns a list of strings that contain the coefficients of x in the new polynomial
+    Splits the data codewords into the blocks used for error correction, in order (group 1 first, then group 2)
     
-    :param expr1: A list of strings containing the coefficients of x. The first term should be 1; all other terms should be in alpha notation
-    :type expr1: list[str]
-    :param expr2: A list of strings containing the coefficients of x. The first term should be 1; the other term should be in alpha notation
-    :type expr2: list[str]
-    :return: Returns a list of strings that contain the coefficients of x in the polynomial
-    :rtype: list[str]
+    :param codewords: The data codewords
+    :type codewords: bytes
+    :param version: The version of the QR code
+    :type version: int
+    :param ec_level: The error correction level of the QR code
+    :type ec_level: str
+    :return: A list of blocks, each holding its data codewords
+    :rtype: list[bytes]
     """
     
-    # Make a copy to multiply by a{n}
-    temp = copy(expr1)
-    
-    temp[0] = str(gf256(int(expr2[1].replace('a', ''))))
+    _, group1_blocks, group1_size, group2_blocks, group2_size = get_block_structure(version, ec_level)
     
-    for i in range(1, len(temp)):
-        temp[i] += expr2[1]
-        temp[i] = str(gf256(eval(temp[i].replace('a', '+')[1:])))
+    blocks = []
+    index = 0
     
-    # Multiply the original by x
-    expr1 += ['0']
+    for num_of_blocks, block_size in ((group1_blocks, group1_size), (group2_blocks, group2_size)):
+        for _ in range(num_of_blocks):
+            blocks.append(codewords[index:index + block_size])
+            index += block_size
     
-    for i in range(1, len(expr1)-1):
-        expr1[i] = str(gf256(int(expr1[i].replace('a', ''))))
-    
-    # Add the 2 expressions together and simplify
-    for i in range(1, len(expr1)):
-        expr1[i] = str(int(expr1[i]) ^ int(temp[i-1]))
-        expr1[i] = 'a' + str(reverse_gf256(int(expr1[i])))
-    
-    return expr1
+    return blocks
 
+
+# Step 7: The Generator Polynomial
+# The data codewords are already the coefficients of the Message Polynomial
 # Next, generate the Generator Polynomial
 def generate_generator_polynomial(version: int, ec_level: str, block: int) -> list[int]:
     """
-    Generates the Generator Polynomial used for Reed-Solomon Error Correction. Returns a list of integers containing the coefficients of x
+    Returns the Generator Polynomial used for Reed-Solomon Error Correction as a list of integers containing the coefficients of x
+    \nThe polynomials are computed once per degree and shared, see reed_solomon.generator_polynomial
     
     :param version: The QR code's version
     :type version: int
@@ -623,79 +684,34 @@ def generate_generator_polynomial(version: int, ec_level: str, block: int) -> li
     :type ec_level: str
     :param block: Which block to check the number of needed codewords
     :type block: int
-    :return: A list of integers containing the coefficients of x in the generator polynomial
+    :return: A list of integers containing the coefficients of x in the generator polynomial, starting with the highest power
     :rtype: list[int]
     """
     
     num_of_codewords = get_num_of_codewords(version, ec_level, block)
     
-    polynomial = ['1', 'a0']
-    
-    for i in range(1, num_of_codewords):
-        polynomial = expand_brackets(polynomial, ['1', f"a{i}"])
-    
-    alpha_exponents = [0]
-    
-    for i in range(1, len(polynomial)):
-        alpha_exponents.append(int(polynomial[i].replace('a', '')))
-    
-    return alpha_exponents
+    return list(reed_solomon.generator_polynomial(num_of_codewords))
 
 
 # Step 9: Divide the Message Polynomial by the Generator Polynomial
-def polynomial_division(version: int, ec_level: str, poly1: list[int], poly2: list[int]) -> list[int]:
+# The remainder of the division is the error correction codewords, see reed_solomon.encode
+def generate_error_codewords(data_blocks: list[bytes], version: int, ec_level: str) -> list[bytes]:
     """
-    Divides the Message Polynomail by the Generator Polynomial, returning the Error Codewords
+    Generates the error correction codewords for every block of data codewords
     
+    :param data_blocks: The data codewords, split into blocks
+    :type data_blocks: list[bytes]
     :param version: The version of the QR code
     :type version: int
-    :param ec_level: The error coding level for the QR code
+    :param ec_level: The error correction level of the QR code
     :type ec_level: str
-    :param poly1: The message polynomial
-    :type poly1: list[int]
-    :param poly2: The generator polynomial
-    :type poly2: list[int]
-    :return: Returns the error codewords to be put into the QR code
-    :rtype: list[int]
+    :return: The error correction codewords for each block, in the same order as the data blocks
+    :rtype: list[bytes]
     """
     
-    msg_poly = copy(poly1)
-    msg_poly += [0] * get_num_of_codewords(version, ec_level, 1)
-
-    for _ in range(get_num_of_codewords(version, ec_level, 0)):
-        gen_poly = copy(poly2)
-    
-        # Convert message polynomial to alpha notation
-        msg_poly = [-1 if msg_poly[i] == 1 else msg_poly[i] for i in range(len(msg_poly))]
-        msg_poly = [reverse_gf256(msg_poly[i]) if msg_poly[i] != 0 else msg_poly[i] for i in range(len(msg_poly))]
-    
-        # Multiply the generator polynomial by the lead term of the message polynomial
-        gen_poly = [gen_poly[i] + msg_poly[0] for i in range(len(gen_poly))]
-        
-        for i in range(len(gen_poly)):
-            if gen_poly[i] > 255:
-                gen_poly[i] %= 255
-        
-        # Convert both polynomials to integer notation
-        msg_poly = [gf256(msg_poly[i]) if msg_poly[i] != 0 else msg_poly[i] for i in range(len(msg_poly))]
-        gen_poly = [gf256(gen_poly[i]) if gen_poly[i] != 0 else gen_poly[i] for i in range(len(gen_poly))]
-        
-        msg_poly = [1 if msg_poly[i] == -1 else msg_poly[i] for i in range(len(msg_poly))]
-        
-        # Add 0s to the end of gen_poly to make it the same length as msg_poly
-        gen_poly += [0] * (len(msg_poly) - len(gen_poly))
-        
-        # XOR the two polynomials together
-        msg_poly = [msg_poly[i] ^ gen_poly[i] for i in range(len(msg_poly))]
-        
-        # Remove the leading 0
-        if msg_poly[0] == 0:
-            del msg_poly[0]
-        
-        # Convert gen_poly back to alpha notation for the next loop
-        gen_poly = [gf256(gen_poly[i]) for i in range(len(gen_poly))]
+    ec_codewords_per_block = get_block_structure(version, ec_level)[0]
     
-    return msg_poly
+    return [reed_solomon.encode(block, ec_codewords_per_block) for block in data_blocks]
 
 
 ##################################################################
@@ -703,54 +719,61 @@ def polynomial_division(version: int, ec_level: str, poly1: list[int], poly2: li
 # https://www.thonky.com/qr-code-tutorial/structure-final-message
 ##################################################################
 
-# TODO come back to this stage
-# I will come back to this after confirming the rest of the program works. I am testing with a code that is too small to have blocks
-# I still need to convert the codewords from the previous stage into binary and add them to the rest of the binary
-def convert_codewords_to_binary(codewords: list[str], error_codewords: list[int]) -> list[str]:
+# Steps 1-3: Interleave the Blocks
+# Take the first codeword from each block, then the second from each block, and so on
+# Group 2's blocks are one codeword longer, so their last codewords go at the end
+# The error correction codewords are interleaved the same way and placed after the data codewords
+def interleave_blocks(data_blocks: list[bytes], error_blocks: list[bytes]) -> list[int]:
     """
-    Converts the Error Correction Codewords into Binary and appends them to the current codewords
+    Interleaves the data blocks, followed by the error correction blocks
     
-    :param codewords: The first set of codewords generated
-    :type codewords: list[str]
-    :param error_codewords: The error codewords generated for step 3
-    :type error_codewords: list[int]
-    :return: A list of 8-bit bytes of all the data and codewords
-    :rtype: list[str]
+    :param data_blocks: The data codewords of each block
+    :type data_blocks: list[bytes]
+    :param error_blocks: The error correction codewords of each block
+    :type error_blocks: list[bytes]
+    :return: The final sequence of codewords
+    :rtype: list[int]
     """
     
-    temp = ""
-    # TODO Need to handle negtive codewords properly, this is a bandaid solution that probably won't work
-    for num in error_codewords:
-        temp += bin(int(str(num).replace('-','')))[2:].zfill(8)
+    interleaved = []
     
-    codewords += [temp[i:i+8] for i in range(0, len(temp), 8)]
+    for blocks in (data_blocks, error_blocks):
+        for i in range(max(len(block) for block in blocks)):
+            interleaved += [block[i] for block in blocks if i < len(block)]
     
-    return codewords
+    return interleaved
 
 
-def add_remainder_bits(codewords: list[str], version: int) -> list[str]:
+# Step 4: Convert to Binary
+def convert_codewords_to_binary(codewords: list[int]) -> BitBuffer:
+    """
+    Packs the interleaved codewords into a bit buffer
+    
+    :param codewords: The interleaved data and error correction codewords
+    :type codewords: list[int]
+    :return: A bit buffer holding all the data and error correction codewords
+    :rtype: BitBuffer
+    """
+    
+    return BitBuffer(bytes(codewords))
+
+
+# Step 5: Add Remainder Bits if Necessary
+def add_remainder_bits(bit_buffer: BitBuffer, version: int) -> BitBuffer:
     """
     Adds the necessary amount of remainder bits to the codewords
     
-    :param codewords: The full list of codewords in bytes of Binary
-    :type codewords: list[str]
+    :param bit_buffer: The full bit buffer of codewords
+    :type bit_buffer: BitBuffer
     :param version: The version of the QR Code
     :type version: int
     :return: All codewords, with the remainder bits added at the end
-    :rtype: list[str]
+    :rtype: BitBuffer
     """
     
-    if version in [1,7,8,9,10,11,12,13,35,36,37,38,39,40]:
-        return codewords
-    if version in [2,3,4,5,6]:
-        codewords.append('0000000')
-    elif version in [21,22,23,24,25,26,27]:
-        codewords.append('0000')
-    else:
-        codewords.append('000')
-    
+    bit_buffer.append_bits(0, qr_spec.REMAINDER_BITS[version])
     
-    return codewords
+    return bit_buffer
 
 
 
@@ -770,69 +793,27 @@ def create_array(version: int) -> list[list]:
     :rtype: list[list]
     """
 
-    size = ((version - 1) * 4) + 21
+    size = qr_spec.SIZES[version]
 
     return [[None for _ in range(size)] for _ in range(size)]
 
 # Helper function to find the locations of the Alignment Patterns
-def alignment_positions(version: int) -> list[int]:
+def alignment_positions(version: int) -> tuple[int, ...]:
     """
-    Returns an array containing the locations of the finder patterns
+    Returns the row/column coordinates of the alignment pattern centres
     
     :param version: The QR Code's version
     :type version: int
-    :return: A list of locations for the finder patterns
-    :rtype: list[int]
+    :return: The locations for the alignment patterns
+    :rtype: tuple[int, ...]
     """
     
-    locations = {
-        2: [6, 18],
-        3: [6, 22],
-        4: [6, 26],
-        5: [6, 30],
-        6: [6, 34],
-        7: [6, 22, 38],
-        8: [6, 24, 42],
-        9: [6, 26, 46],
-        10: [6, 28, 50],
-        11: [6, 30, 54],
-        12: [6, 32, 58],
-        13: [6, 34, 62],
-        14: [6, 26, 46, 66],
-        15: [6, 26, 48, 70],
-        16: [6, 26, 50, 74],
-        17: [6, 30, 54, 78],
-        18: [6, 30, 56, 82],
-        19: [6, 30, 58, 86],
-        20: [6, 34, 62, 90],
-        21: [6, 28, 50, 72, 94],
-        22: [6, 26, 50, 74, 98],
-        23: [6, 30, 54, 78, 102],
-        24: [6, 28, 54, 80, 106],
-        25: [6, 32, 58, 84, 110],
-        26: [6, 30, 58, 86, 114],
-        27: [6, 34, 62, 90, 118],
-        28: [6, 26, 50, 74, 98, 122],
-        29: [6, 30, 54, 78, 102, 126],
-        30: [6, 26, 52, 78, 104, 130],
-        31: [6, 30, 56, 82, 108, 134],
-        32: [6, 34, 60, 86, 112, 138],
-        33: [6, 30, 58, 86, 114, 142],
-        34: [6, 34, 62, 90, 118, 146],
-        35: [6, 30, 54, 78, 102, 126, 150],
-        36: [6, 24, 50, 76, 102, 128, 154],
-        37: [6, 28, 54, 80, 106, 132, 158],
-        38: [6, 32, 58, 84, 110, 136, 162],
-        39: [6, 26, 54, 82, 110, 138, 166],
-        40: [6, 30, 58, 86, 114, 142, 170],
-    }
-
-    return locations[version]
+    return qr_spec.ALIGNMENT_POSITIONS[version]
 
 
 # Step 1,2,3,4
 # Function to insert the Finder Patterns, Separators, Alignment Patterns, and Timing Patterns
-def prefill_finder_patterns(version: int, arr: list[list], valid_locations: list[list[int]] = []) -> tuple[list[list[int]], list[list[int]]]:
+def prefill_finder_patterns(version: int, arr: list[list], valid_locations: list[list[int]] | None = None) -> tuple[list[list[int]], list[list[int]]]:
     """
     Takes the empty array generated by the create_array function, and inserts the function patterns
 
@@ -841,12 +822,15 @@ def prefill_finder_patterns(version: int, arr: list[list], valid_locations: list
     :param arr: The empty array that will hold the have the function patterns added
     :type arr: list[list]
     :param valid_locations: Optional parameter for valid alignment patterns, to be used after the mask is applied
-    :type valid_locations: list[list[int]]
+    :type valid_locations: list[list[int]], optional
     :return: The array, now containing the function patterns, and a 2nd 2D array containing valid locations for the alignment patterns, to be used after applying a mask
     :rtype: tuple[list[list[int]], list[list[int]]]
     """
 
     # 0 is a black space on the QR code
+    
+    if valid_locations is None:
+        valid_locations = []
 
     # Finder Patterns
     finder_pattern = [[0,0,0,0,0,0,0],
@@ -968,91 +952,143 @@ def reserve_info_areas(version: int, arr: list[list[int]]) -> list[list[int]]:
     return arr
 
 
-#Step 6: Placing the Data Bits
-def place_data_bits(codewords: list[str], code_arr: list[list[int]]) -> list[list[int]]:
+# Function Pattern Templates
+# Everything drawn so far only depends on the version, so it is drawn once per version and reused for every QR code
+# The templates are immutable (bytes and a read-only view), so they can be shared between threads and forked processes without being copied
+
+class Template(NamedTuple):
+    modules: bytes # The function patterns and reserved areas row by row for QRMatrix, with 0 for data modules
+    function_mask: bytes # 1 for function modules and reserved areas, 0 for data modules, row by row
+    data_indices: memoryview # Flat index into modules of every data module, in the order the data bits are placed (read-only, unsigned 32-bit)
+
+
+_templates: dict[int, Template] = {}
+
+
+def get_data_coordinates(is_function: tuple[tuple[bool, ...], ...]) -> tuple[tuple[int, int], ...]:
     """
-    Places the data into the QR Code in the correct order
+    Returns the coordinates of the data modules in the order the bits are placed
+    \nThe bits go up and down in 2-module wide columns, starting at the bottom right, skipping the vertical timing pattern
     
-    :param codewords: The codewords to be stored in the QR Code
-    :type codewords: list[str]
-    :param code_arr: The array used to store the QR Code
-    :type code_arr: list[list[int]]
-    :return: The QR Code array with the data correctly placed
-    :rtype: tuple[list[list[int]], list]
+    :param is_function: True for modules that are not data modules
+    :type is_function: tuple[tuple[bool, ...], ...]
+    :return: (row, column) of every data module in placement order
+    :rtype: tuple[tuple[int, int], ...]
     """
     
-    data_bits = [i for i in ''.join(codewords)] # Doing it this way since pop() needs a list
+    size = len(is_function)
+    coordinates = []
     
-    current_index = len(code_arr)-1
+    right_column = size - 1
+    upwards = True
     
-    while len(data_bits) > 36: # Thsis impelemtnation breaks when it reaches the vertical timing pattern, so I am stopping it before it reaches it
-        # Going upwards
-        if current_index <= 6:
-            for i in range(len(code_arr)-1, -1, -1):
-                if code_arr[i][current_index-1] is None:
-                    code_arr[i][current_index-1] = int(not int(data_bits.pop(0)))
-                if code_arr[i][current_index-2] is None:
-                    code_arr[i][current_index-2] = int(not int(data_bits.pop(0)))
-        else:
-            for i in range(len(code_arr)-1, -1, -1):
-                if code_arr[i][current_index] is None:
-                    code_arr[i][current_index] = int(not int(data_bits.pop(0)))
-                if code_arr[i][current_index-1] is None:
-                    code_arr[i][current_index-1] = int(not int(data_bits.pop(0)))
-        
-        # Going downwards
-        if current_index <= 6:
-            for i in range(len(code_arr)):
-                if code_arr[i][current_index-3] is None:
-                    code_arr[i][current_index-3] = int(not int(data_bits.pop(0)))
-                if code_arr[i][current_index-4] is None:
-                    code_arr[i][current_index-4] = int(not int(data_bits.pop(0)))
-        else:
-            for i in range(len(code_arr)):
-                if code_arr[i][current_index-2] is None:
-                    code_arr[i][current_index-2] = int(not int(data_bits.pop(0)))
-                if code_arr[i][current_index-3] is None:
-                    code_arr[i][current_index-3] = int(not int(data_bits.pop(0)))
+    while right_column > 0:
+        # The vertical timing pattern takes up a whole column, so the columns to its left are shifted by 1
+        if right_column == 6:
+            right_column = 5
         
-        current_index-=4
-    
-    # Continuing after the timing pattern
-    for i in range(len(code_arr)-1, -1, -1):
-        if code_arr[i][current_index] is None:
-            code_arr[i][current_index] = int(not int(data_bits.pop(0)))
-        if code_arr[i][current_index-1] is None:
-            code_arr[i][current_index-1] = int(not int(data_bits.pop(0)))
-    
-    current_index -= 3
-    
-    while data_bits:
-        # Going down
-        for i in range(len(code_arr)):
-            if code_arr[i][current_index] is None:
-                code_arr[i][current_index] = int(not int(data_bits.pop(0)))
-            if code_arr[i][current_index-1] is None:
-                code_arr[i][current_index-1] = int(not int(data_bits.pop(0)))
-            
-        current_index -= 2
+        rows = range(size - 1, -1, -1) if upwards else range(size)
         
-        # Intermediary check
-        if len(data_bits) == 0:
-            break
+        for row in rows:
+            for column in (right_column, right_column - 1):
+                if not is_function[row][column]:
+                    coordinates.append((row, column))
         
-        # Going up
-        for i in range(len(code_arr)-1, -1, -1):
-            if code_arr[i][current_index] is None:
-                code_arr[i][current_index] = int(not int(data_bits.pop(0)))
-            if code_arr[i][current_index-1] is None:
-                code_arr[i][current_index-1] = int(not int(data_bits.pop(0)))
-            
-        current_index -= 2
+        upwards = not upwards
+        right_column -= 2
+    
+    return tuple(coordinates)
+
+
+def get_template(version: int) -> Template:
+    """
+    Returns the function pattern template for the given version, drawing it the first time it is needed
+    
+    :param version: The QR Code's version
+    :type version: int
+    :return: The shared, read-only template
+    :rtype: Template
+    """
     
+    template = _templates.get(version)
+    if template is not None:
+        return template
     
-    if data_bits:
-        raise Exception("Something went wrong. There are leftover bits that could not be inserted into the QR code.")
+    arr, _ = prefill_finder_patterns(version, create_array(version))
+    arr = reserve_info_areas(version, arr)
+    
+    is_function = tuple(tuple(module is not None for module in row) for row in arr)
+    size = len(arr)
     
-    return code_arr
+    template = Template(
+        modules=bytes(module or 0 for row in arr for module in row),
+        function_mask=bytes(flag for row in is_function for flag in row),
+        data_indices=memoryview(array('I', (row * size + column for row, column in get_data_coordinates(is_function)))).toreadonly(),
+    )
+    _templates[version] = template
+    
+    return template
+
+
+def build_templates(versions=qr_spec.VERSIONS) -> None:
+    """
+    Draws the templates for every given version up front, e.g. before forking worker processes
+    
+    :param versions: The versions to draw. Defaults to all 40
+    :type versions: Iterable[int]
+    """
+    
+    for version in versions:
+        get_template(version)
+
+
+def create_matrix(version: int) -> QRMatrix:
+    """
+    Returns a new QR matrix with the function patterns drawn. It shares the template's modules until it is written to
+    
+    :param version: The QR Code's version
+    :type version: int
+    :return: A matrix ready for the data to be placed
+    :rtype: QRMatrix
+    """
+    
+    template = get_template(version)
+    
+    return QRMatrix(qr_spec.SIZES[version], template.modules, template.function_mask)
+
+
+#Step 6: Placing the Data Bits
+# The order of the data modules is worked out once per version, see get_data_coordinates
+def place_data_bits(bit_buffer: BitBuffer, matrix: QRMatrix) -> QRMatrix:
+    """
+    Places the data into the QR Code in the correct order
+    
+    :param bit_buffer: The codewords and remainder bits to be stored in the QR Code
+    :type bit_buffer: BitBuffer
+    :param matrix: The matrix used to store the QR Code, with the function patterns drawn
+    :type matrix: QRMatrix
+    :return: The QR Code matrix with the data correctly placed
+    :rtype: QRMatrix
+    """
+    
+    version = (matrix.size - 17) // 4
+    data_indices = get_template(version).data_indices
+    
+    if len(bit_buffer) != len(data_indices):
+        raise Exception(f"Something went wrong. There are {len(bit_buffer)} bits to place in {len(data_indices)} data modules.")
+    
+    modules = bytearray(matrix.modules)
+    
+    # 1 is a light module, so each bit is flipped as it is placed
+    if masking_numpy.is_available():
+        masking_numpy.scatter_bits(modules, data_indices, bit_buffer.to_bytes(), len(bit_buffer))
+    else:
+        for index, bit in zip(data_indices, bit_buffer.iter_bits()):
+            modules[index] = 1 - bit
+    
+    matrix.set_modules(modules)
+    
+    return matrix
 
 
 
@@ -1061,175 +1097,205 @@ def place_data_bits(codewords: list[str], code_arr: list[list[int]]) -> list[lis
 # https://www.thonky.com/qr-code-tutorial/data-masking
 #######################################################
 
-def apply_mask(arr: list[list[int]], version: int, valid_alignment_positions: list[list[int]] = []) -> tuple[list[list[int]], int]:
+@lru_cache(maxsize=None)
+def get_mask_patterns(version: int) -> tuple[int, ...]:
     """
-    Try all 8 masks and find the best scoring one and applies it
+    Returns the 8 mask patterns for a version, restricted to the data modules and built once per version
+    \nEach pattern is packed into an integer with one byte per module, so XORing it with the matrix's modules applies the mask
     
-    :param arr: The unmasked QR code array
-    :type arr: list[list[int]]
-    :param version: The version fo the QR code
+    :param version: The version of the QR code
     :type version: int
-    :return: The QR code with the optimal mask applied
-    :rtype: list[list[int]]
+    :return: The packed patterns, in mask order
+    :rtype: tuple[int, ...]
     """
     
-    arr_copies = [deepcopy(arr) for _ in range(8)]
-    original_copy = deepcopy(arr)
-    
-    for row in range(len(arr)):
-        for column in range(len(arr)):
-            if (row + column) % 2 == 0: # Mask 0: (row + column) mod 2 == 0
-                arr_copies[0][row][column] = int(not arr_copies[0][row][column])
-            if row % 2 == 0: # Mask 1: (row) mod 2 == 0
-                arr_copies[1][row][column] = int(not arr_copies[1][row][column])
-            if column % 3 == 0: # Mask 2: (column) mod 3 == 0
-                arr_copies[2][row][column] = int(not arr_copies[2][row][column])
-            if (row + column) % 3 == 0: # Mask 3: (row + column) mod 3 == 0
-                arr_copies[3][row][column] = int(not arr_copies[3][row][column])
-            if (int(row/2) + int(column/3)) % 2 == 0: # Mask 4: (floor(row/2) + floor(column/3)) mod 2 == 0
-                arr_copies[4][row][column] = int(not arr_copies[4][row][column])
-            if ((row * column) % 2) + ((row * column) % 3) == 0: # Mask 5: ((row * column) mod 2) + ((row * column) mod 3) == 0
-                arr_copies[5][row][column] = int(not arr_copies[5][row][column])
-            if (((row * column) % 2) + ((row * column) % 3)) % 2 == 0: # Mask 6: (((row * column) mod 2) + ((row * column) mod 3) mod 2) == 0
-                arr_copies[6][row][column] = int(not arr_copies[6][row][column])
-            if (((row + column) % 2) + ((row * column) % 3)) % 2 == 0: # Mask 7: (((row + column) mod 2) + ((row * column) mod 3)) mod 2 == 0
-                arr_copies[7][row][column] = int(not arr_copies[7][row][column])
+    size = qr_spec.SIZES[version]
+    function_mask = get_template(version).function_mask
     
+    # The function patterns and reserved areas must not be masked
+    return tuple(
+        int.from_bytes(bytes(
+            int(condition(row, column) and not function_mask[row * size + column])
+            for row in range(size) for column in range(size)
+        ), 'big')
+        for condition in qr_spec.MASK_CONDITIONS
+    )
+
+
+#############
+# Evaluation
+#############
+
+# Every mask is scored with 4 penalty rules, and the lowest score wins
+# All 4 rules are worked out together in one sweep over the rows and one over the columns, using the runs of same coloured modules
+
+# A run of same coloured modules. Matching the bytes regex splits a row or column into its runs in one go
+RUN_PATTERN = re.compile(rb'\x00+|\x01+')
+
+def get_line_penalty(line: bytes) -> int:
+    """
+    Scores one row or column for conditions 1 and 3, from its runs of same coloured modules
     
-    # Refill finder patterns and reserved space
-    for i in range(len(arr_copies)):
-        arr_copies[i], _ = prefill_finder_patterns(version, arr_copies[i], valid_alignment_positions)
-        arr_copies[i] = reserve_info_areas(version, arr_copies[i])
-    
+    :param line: The modules of the row or column, 0 for dark and 1 for light
+    :type line: bytes
+    :return: The penalty for the line
+    :rtype: int
+    """
     
-    #############
-    # Evaluation
-    #############
+    run_lengths = [len(run) for run in RUN_PATTERN.findall(line)]
     
-    scores = [0,0,0,0,0,0,0,0]
+    score = 0
     
     # Condition #1
+    # Any five consecutive modules of the same colour add 3 points. Each extra consecutive module of the same colour adds an aditional 1 point
+    for length in run_lengths:
+        if length >= 5:
+            score += length - 2
     
-    # Check each row 1 by 1. Any five consecutive modules of the same colour add 3 points.
-    # Each extra consecutive module of the same colour adds an aditional 1 point
-    for i in range(len(arr_copies)):
-        temp_copy = deepcopy(arr_copies[i])
-        
-        for row in temp_copy:
-            temp_row = deepcopy(row)
-            temp_arr = []
-            
-            while temp_row:
-                if int(not temp_row[0]) in temp_row:
-                    temp_arr += [temp_row[:temp_row.index(int(not(temp_row[0])))]]
-                    temp_row = temp_row[temp_row.index(int(not temp_row[0])):]
-                else:
-                    temp_arr += [temp_row]
-                    temp_row = []
-
-            for array in temp_arr:
-                if len(array) >= 5:
-                    scores[i] += 3 + len(array)-5
-    
-    # Do the same for columns
-    for i in range(len(arr_copies)):
-        temp_copy = deepcopy(arr_copies[i])
+    # Condition #3
+    # Looks for dark-light-dark-dark-dark-light-dark with 4 light modules on one side (01000101111 and 11110100010)
+    # In runs, that is a 1:1:3:1:1 dark-light-dark-light-dark core, with a light run of at least 4 right after or before it
+    # The dark runs at either end of the core only need to be 1 long if they are on the same side as the light modules
+    dark_first = line[0] == 0
+    for i in range(len(run_lengths) - 4):
+        # The core must start on a dark run
+        if (i % 2 == 0) != dark_first:
+            continue
         
-        # Swap the rows and columns to make it easier
-        for row in range(len(temp_copy)):
-            for col in range(len(temp_copy)):
-                temp_copy[row][col] = original_copy[col][row]
+        first, light_1, middle, light_2, last = run_lengths[i:i + 5]
+        if light_1 != 1 or middle != 3 or light_2 != 1:
+            continue
         
-        for row in temp_copy:
-            temp_row = deepcopy(row)
-            temp_arr = []
-            
-            while temp_row:
-                if int(not temp_row[0]) in temp_row:
-                    temp_arr += [temp_row[:temp_row.index(int(not(temp_row[0])))]]
-                    temp_row = temp_row[temp_row.index(int(not temp_row[0])):]
-                else:
-                    temp_arr += [temp_row]
-                    temp_row = []
+        if last == 1 and i + 5 < len(run_lengths) and run_lengths[i + 5] >= 4:
+            score += 40
+        if first == 1 and i > 0 and run_lengths[i - 1] >= 4:
+            score += 40
+    
+    return score
 
-            for array in temp_arr:
-                if len(array) >= 5:
-                    scores[i] += 3 + len(array)-5
 
+def get_block_penalty(row: bytes, next_row: bytes) -> int:
+    """
+    Condition #2: Scores a pair of neighbouring rows. Add 3 points for each 2x2 solid-colour block. Allows overlapping e.g., a 3x2 block shouyld be counted as 2 2x2 blocks
     
-    # Condition #2
+    :param row: The upper row
+    :type row: bytes
+    :param next_row: The row underneath it
+    :type next_row: bytes
+    :return: The penalty for the 2x2 blocks spanning the two rows
+    :rtype: int
+    """
     
-    # Add 3 points for each 2x2 solid-colour block. Allows overlapping e.g., a 3x2 block shouyld be counted as 2 2x2 blocks
+    return 3 * sum(1 for a, b, c, d in zip(row, row[1:], next_row, next_row[1:]) if a == b == c == d)
+
+
+def score_mask(matrix: QRMatrix, bound: int | None = None) -> int | None:
+    """
+    Scores a masked QR code with all 4 penalty rules in a single sweep
+    \nWith a bound, scoring stops as soon as the partial score reaches it, since every rule only adds points
+    
+    :param matrix: The masked QR code
+    :type matrix: QRMatrix
+    :param bound: The score to beat, e.g. the best complete score so far. Defaults to None, which always scores the whole QR code
+    :type bound: int | None, optional
+    :return: The total penalty, or None if the partial score reached the bound
+    :rtype: int | None
+    """
     
-    for i in range(len(arr_copies)):
-        temp_copy = deepcopy(arr_copies[i])
+    score = 0
+    dark_modules = 0
+    previous_row = None
+    
+    # Rows: conditions 1 and 3, condition 2 with the row above, and the dark modules for condition 4
+    for row in matrix.rows():
+        score += get_line_penalty(row)
+        if previous_row is not None:
+            score += get_block_penalty(previous_row, row)
+        dark_modules += row.count(0)
+        previous_row = row
         
-        for row in range(len(temp_copy)-1):
-            for column in range(len(temp_copy[row])-1):
-                if temp_copy[row][column] == temp_copy[row][column+1] == temp_copy[row+1][column] == temp_copy[row+1][column+1]:
-                    scores[i] += 3
+        if bound is not None and score >= bound:
+            return None
     
+    # Columns: conditions 1 and 3
+    for column in range(matrix.size):
+        score += get_line_penalty(matrix.column(column))
+        
+        if bound is not None and score >= bound:
+            return None
     
+    # Condition #4
+    # Compare the ratio of dark modules
+    total_modules = matrix.size ** 2
     
+    # The multiples of five either side of the percentage of dark modules, worked out with integers to avoid rounding errors
+    previous_multiple_of_five = (dark_modules * 20 // total_modules) * 5
+    next_multiple_of_five = previous_multiple_of_five + 5
     
-    # Condition #3
+    score += min(abs(previous_multiple_of_five - 50), abs(next_multiple_of_five - 50)) // 5 * 10
     
-    # Looks for a specific pattern horizontally
-    pattern1 = '00000100010'
-    pattern2 = '01000100000'
+    if bound is not None and score >= bound:
+        return None
     
-    for i in range(len(arr_copies)):
-        temp_copy = deepcopy(arr_copies[i])
-        
-        for row in temp_copy:
-            temp_row = ''.join([str(i) for i in row])
-            if pattern1 in temp_row:
-                scores[i] += 40
-            if pattern2 in temp_row:
-                scores[i] += 40
+    return score
+
+
+def apply_mask(matrix: QRMatrix, version: int, engine: str = 'auto', mask: str = 'auto', branch_and_bound: bool = True) -> tuple[QRMatrix, int]:
+    """
+    Try all 8 masks and find the best scoring one and applies it
+    \nThe masks are only applied to the data modules; the function patterns and reserved areas are left as they are
     
+    :param matrix: The unmasked QR code
+    :type matrix: QRMatrix
+    :param version: The version fo the QR code
+    :type version: int
+    :param engine: 'bits' for the bit-parallel engine, 'numpy', 'python' for the module by module sweep, or 'auto', which uses 'bits'. All choose the same mask
+    :type engine: str, optional
+    :param mask: 'auto' to choose the best mask, or 'fixed:N' to apply mask N (0-7) without evaluating any of them
+    :type mask: str, optional
+    :param branch_and_bound: Whether the Python engine stops scoring a mask once it cannot beat the best one so far. Defaults to True
+    :type branch_and_bound: bool, optional
+    :return: The QR code with the optimal mask applied, and the number of the mask
+    :rtype: tuple[QRMatrix, int]
+    """
     
-    # Check vertically too
-    for i in range(len(arr_copies)):
-        temp_copy = deepcopy(arr_copies[i])
+    num_of_modules = matrix.size * matrix.size
+    
+    if mask.startswith('fixed:'):
+        mask_num = int(mask[len('fixed:'):])
+        if not 0 <= mask_num <= 7:
+            raise Exception(f"There is no mask {mask_num}. Use a mask from 0 to 7.")
         
-        # Swap the rows and columns to make it easier
-        for row in range(len(temp_copy)):
-            for col in range(len(temp_copy)):
-                temp_copy[row][col] = original_copy[col][row]
+        masked = (int.from_bytes(matrix.modules, 'big') ^ get_mask_patterns(version)[mask_num]).to_bytes(num_of_modules, 'big')
         
-        for row in temp_copy:
-            temp_row = ''.join([str(i) for i in row])
-            if pattern1 in temp_row:
-                scores[i] += 40
-            if pattern2 in temp_row:
-                scores[i] += 40
+        return QRMatrix(matrix.size, bytearray(masked), matrix.function_mask), mask_num
     
+    if mask != 'auto':
+        raise Exception(f"Unknown mask option '{mask}'. Use 'auto' or 'fixed:N'.")
     
+    if engine in ('bits', 'auto'):
+        return masking_bits.apply_best_mask(matrix)
     
+    if engine == 'numpy':
+        return masking_numpy.apply_best_mask(matrix)
     
-    # Condition #4
+    if engine != 'python':
+        raise Exception(f"Unknown mask engine '{engine}'. Use 'auto', 'bits', 'numpy' or 'python'.")
     
-    # Compare the ratio of dark modules
-    counter = 0 # Will hold the count of dark modules
+    unmasked = int.from_bytes(matrix.modules, 'big')
     
-    for i in range(len(arr_copies)):
-        for row in range(len(arr_copies[i])):
-            for column in range(len(arr_copies[i])):
-                if arr_copies[i][row][column] == 1:
-                    counter += 1
+    best_candidate, best_mask, best_score = None, None, None
     
-        total_modules = len(arr_copies[i])**2
+    # Masks are tried in order and a later mask must score strictly lower to win, so ties go to the lowest numbered mask
+    for mask_num, pattern in enumerate(get_mask_patterns(version)):
+        candidate = QRMatrix(matrix.size, bytearray((unmasked ^ pattern).to_bytes(num_of_modules, 'big')), matrix.function_mask)
         
-        percentage = (counter / total_modules) * 100
+        score = score_mask(candidate, best_score if branch_and_bound else None)
         
-        lower_multiple_of_five = abs((percentage - (percentage % 5)) - 50)/5
-        upper_multiple_of_five = abs((lower_multiple_of_five + 5) - 50)/5
-        
-        scores[i] += int(min(lower_multiple_of_five, upper_multiple_of_five) * 10)
-    
+        if score is not None and (best_score is None or score < best_score):
+            best_candidate, best_mask, best_score = candidate, mask_num, score
     
-    return arr_copies[scores.index(min(scores))], scores.index(min(scores))
+    return best_candidate, best_mask
 
 
 
@@ -1243,10 +1309,11 @@ def apply_mask(arr: list[list[int]], version: int, valid_alignment_positions: li
 # The format string contains the EC level and which maks pattern was used. It is alwasy 15 bits long
 # The first 5 bits are 2 bits for the EC level, and 3 bits for the mask
 # The other 10 bits are generated as error correction bits, for a total of 15 bits
+# There are only 32 format strings and 34 version strings, so they are all worked out once when the module is loaded
 
-def generate_format_string(ec_level: str, mask: int) -> str:
+def compute_format_string(ec_level: str, mask: int) -> str:
     """
-    Generates the format bits to be inserted into the QR code
+    Works out the format bits for an EC level and mask with the BCH code
     
     :param ec_level: The Error Correction Level used in the QR code
     :type ec_level: str
@@ -1265,71 +1332,89 @@ def generate_format_string(ec_level: str, mask: int) -> str:
     
     bitstring += bin(mask)[2:].zfill(3)
     
-    gen_polynomial = '10100110111'
+    # Append the 10 BCH error correction bits
+    format_string = gf.bch_encode(int(bitstring, base=2), gf.FORMAT_GENERATOR)
+    
+    # XOR the format string with a hard-coded 'Mask String'
+    format_string = bin(format_string ^ int('101010000010010', base=2))[2:].zfill(15)
     
     
-    # Put 10 0s to the right of the format string and remove leading 0s
-    ec_bits = str(int(bitstring.ljust(15, '0')))
+    return format_string
 
-    # Pad the generator polynomial with 0s until it is the same length as the current format string
-    new_gen_polynomial = gen_polynomial.ljust(len(ec_bits), '0')
+FORMAT_STRINGS = MappingProxyType({(ec_level, mask): compute_format_string(ec_level, mask) for ec_level in qr_spec.EC_LEVELS for mask in range(8)})
 
-    while len(ec_bits) > 10:
-        # Pad the generator polynomial with 0s until it is the same length as the current format string
-        new_gen_polynomial = gen_polynomial.ljust(len(ec_bits), '0')
-        
-        # XOR the padded generator polynomial with the curent format string
-        ec_bits = bin(int(ec_bits, base=2) ^ int(new_gen_polynomial, base=2))[2:]
+def generate_format_string(ec_level: str, mask: int) -> str:
+    """
+    Looks up the format bits to be inserted into the QR code
+    
+    :param ec_level: The Error Correction Level used in the QR code
+    :type ec_level: str
+    :param mask: The mask applied to the QR code (0-7)
+    :type mask: int
+    :return: A string of bits containing the format string
+    :rtype: str
+    """
+    
+    format_string = FORMAT_STRINGS.get((ec_level, mask))
+    if format_string is None:
+        raise Exception(f"There is no format string for EC level '{ec_level}' and mask {mask}.")
+    
+    return format_string
 
-        # Remove any leading 0s
-        ec_bits = str(int(ec_bits))
 
-    # Padd from the left to make it 10 bits long
-    ec_bits = ec_bits.ljust(10, '0')
-    
-    # Combine the original format string and the error correction bits
-    format_string = bitstring + ec_bits
+# The flat module index of each format bit, in order, for both copies
+# The first copy goes around the top left finder pattern: along row 8 (skipping the timing pattern), then up column 8
+# The second copy goes up column 8 from the bottom left, then along row 8 to the right edge
+def get_format_coordinates(size: int) -> tuple[tuple[int, ...], tuple[int, ...]]:
+    """
+    Works out where the 15 format bits go for a QR code of the given size
     
-    # XOR the format string with a hard-coded 'Mask String'
-    format_string = bin(int(format_string, base=2) ^ int('101010000010010', base=2))[2:]
+    :param size: The number of modules along each side of the QR code
+    :type size: int
+    :return: The flat indices of the first copy and of the second copy, in bit order
+    :rtype: tuple[tuple[int, ...], tuple[int, ...]]
+    """
     
+    top_left = [(8, column) for column in (0, 1, 2, 3, 4, 5, 7, 8)] + [(row, 8) for row in (7, 5, 4, 3, 2, 1, 0)]
+    split = [(size - 1 - i, 8) for i in range(7)] + [(8, size - 8 + i) for i in range(8)]
     
-    return format_string
+    return (
+        tuple(row * size + column for row, column in top_left),
+        tuple(row * size + column for row, column in split),
+    )
+
+FORMAT_COORDINATES = (None,) + tuple(get_format_coordinates(qr_spec.SIZES[version]) for version in qr_spec.VERSIONS)
 
 # Insert the format bits into the QR code
-def insert_format_bits(format_bits: str, code_array: list[list[int]]) -> list[list[int]]:
+def insert_format_bits(format_bits: str, matrix: QRMatrix) -> QRMatrix:
     """
     Inserts the format bits into the QR code
     
     :param format_bits: THe format bits to be inserted
     :type format_bits: str
-    :param code_array: The current QR code array
-    :type code_array: list[list[int]]
-    :return: The QR code array with the format bits inserted
-    :rtype: list[list[int]]
+    :param matrix: The current QR code
+    :type matrix: QRMatrix
+    :return: The QR code with the format bits inserted
+    :rtype: QRMatrix
     """
     
-    # The bits always go into pre-defined positions
-    code_array[8][:6] = [int(not int(i)) for i in format_bits[:6]] # Top Left - Horizontal
-    code_array[8][7:9] = [int(not int(i)) for i in format_bits[6:8]] # Top Left - Horizontal (After timing pattern)
-    code_array[7][8] = int(not int(format_bits[8])) # Top Left - Vertical (Single bit under timing pattern)
-    for i in range(1,7):
-        code_array[i-1][8] = int(not int(format_bits[-i])) # Top Left - Vertical
-    
+    version = (matrix.size - 17) // 4
+    modules = bytearray(matrix.modules)
     
-    code_array[8][-7:] = [int(not int(i)) for i in format_bits[8:]] # Top Right
+    # The bits always go into pre-defined positions. 1 is a light module, so each bit is flipped
+    for coordinates in FORMAT_COORDINATES[version]:
+        for index, bit in zip(coordinates, format_bits):
+            modules[index] = 1 - int(bit)
     
-    for i in range(1,8):
-        code_array[-i][8] = int(not int(format_bits[i-1])) # Bottom Right - Vertical
+    matrix.set_modules(modules)
     
-    
-    return code_array
+    return matrix
 
 
 # Step 6: Version Information
-def generate_version_string(version: int) -> str:
+def compute_version_string(version: int) -> str:
     """
-    Generates the bits to store the version information
+    Works out the bits to store the version information with the BCH code
     
     :param version: The version fo the QR code
     :type version: int
@@ -1340,179 +1425,722 @@ def generate_version_string(version: int) -> str:
     # Create a 6-bit string of the version
     version_string = bin(version)[2:].zfill(6)
     
-    gen_polynomial = '1111100100101'
+    # Append the 12 BCH error correction bits
+    format_string = bin(gf.bch_encode(int(version_string, base=2), gf.VERSION_GENERATOR))[2:].zfill(18)
+    
     
-    # Put 0s to the right until it is 18 bits long, then remove leading 0s
-    ec_bits = str(int(version_string.ljust(18, '0')))
+    return format_string
 
-    # Pad the generator polynomial with 0s until it is the same length as the current format string
-    new_gen_polynomial = gen_polynomial.ljust(len(ec_bits), '0')
+# Only versions 7 and up have version information
+VERSION_STRINGS = tuple(compute_version_string(version) if version >= 7 else '' for version in range(41))
 
-    while len(ec_bits) > 12:
-        # Pad the generator polynomial with 0s until it is the same length as the current format string
-        new_gen_polynomial = gen_polynomial.ljust(len(ec_bits), '0')
-        
-        # XOR the padded generator polynomial with the curent format string
-        ec_bits = bin(int(ec_bits, base=2) ^ int(new_gen_polynomial, base=2))[2:]
+def generate_version_string(version: int) -> str:
+    """
+    Looks up the bits to store the version information
+    
+    :param version: The version fo the QR code (7-40)
+    :type version: int
+    :return: The bits that represent the version information
+    :rtype: str
+    """
+    
+    if not 7 <= version <= 40:
+        raise Exception(f"Version {version} does not have version information. Only versions 7 to 40 do.")
+    
+    return VERSION_STRINGS[version]
 
-        # Remove any leading 0s
-        ec_bits = str(int(ec_bits))
 
-    # Padd from the left to make it 10 bits long
-    ec_bits = ec_bits.ljust(10, '0')
+# The flat module index of each version bit, in order, for both copies
+# The last bit goes first: the top right block is filled row by row and the bottom left block, its transpose, column by column
+def get_version_coordinates(size: int) -> tuple[tuple[int, ...], tuple[int, ...]]:
+    """
+    Works out where the 18 version bits go for a QR code of the given size
     
-    # Combine the original format string and the error correction bits
-    format_string = version_string + ec_bits
+    :param size: The number of modules along each side of the QR code
+    :type size: int
+    :return: The flat indices of the bottom left copy and of the top right copy, in bit order
+    :rtype: tuple[tuple[int, ...], tuple[int, ...]]
+    """
     
+    bottom_left = [(size - 11 + i % 3, i // 3) for i in range(17, -1, -1)]
+    top_right = [(i // 3, size - 11 + i % 3) for i in range(17, -1, -1)]
     
-    return format_string
+    return (
+        tuple(row * size + column for row, column in bottom_left),
+        tuple(row * size + column for row, column in top_right),
+    )
+
+VERSION_COORDINATES = (None,) + tuple(get_version_coordinates(qr_spec.SIZES[version]) if version >= 7 else () for version in qr_spec.VERSIONS)
 
 # Insert the version bits into the QR code
-def insert_version_bits(version_bits: str, code_arr: list[list[int]]) -> list[list[int]]:
+def insert_version_bits(version_bits: str, matrix: QRMatrix) -> QRMatrix:
     """
     Inserts the version information into the QR code
     
     :param version_bits: Bitstring containing the version information
     :type version_bits: str
-    :param code_arr: The current QR code array
-    :type code_arr: list[list[int]]
-    :return: The updated QR code array, with the version information inserted
-    :rtype: list[list[int]]
+    :param matrix: The current QR code
+    :type matrix: QRMatrix
+    :return: The updated QR code, with the version information inserted
+    :rtype: QRMatrix
     """
     
-    version_bits_1 = [int(not int(i)) for i in version_bits]
-    version_bits_2 = [int(not int(i)) for i in version_bits]
+    version = (matrix.size - 17) // 4
+    modules = bytearray(matrix.modules)
     
-    # Bottom Left
-    for i in range(len(code_arr)-11, len(code_arr)-8):
-        for j in range(6):
-            code_arr[i][j] = version_bits_1.pop()
+    # 1 is a light module, so each bit is flipped
+    for coordinates in VERSION_COORDINATES[version]:
+        for index, bit in zip(coordinates, version_bits):
+            modules[index] = 1 - int(bit)
     
-    # Top Right
-    for i in range(6):
-        for j in range(len(code_arr)-11, len(code_arr)-8):
-            code_arr[i][j] = version_bits_2.pop()
+    matrix.set_modules(modules)
     
-    
-    return code_arr
+    return matrix
 
 
 
 
 
-# Convert the data-filled array into a PIL-valid image and display it
-# https://stackoverflow.com/a/32106188
-def create_image(arr: list[list]):
+# Save the finished matrix as an image file
+# The renderers module turns a matrix into PNG bytes, a PIL image, a NumPy array or packed 1-bit rows in memory
+def create_image(matrix: QRMatrix, filename: str = "QR Code.png", scale: int = 1, border: int = 0):
     """
-    Converts the 2D array with the data palced into a PIL image, and displays it
-    
-    :param arr: The array containing the data
-    :type arr: list[list]
+    Converts the QR code matrix into an image, and saves it
+    \nFilenames ending in .svg or .pdf are saved as vector images, anything else as a PIL image
+    
+    :param matrix: The matrix containing the data
+    :type matrix: QRMatrix
+    :param filename: Where to save the image. Defaults to "QR Code.png"
+    :type filename: str, optional
+    :param scale: How many pixels wide and high each module becomes. Defaults to 1
+    :type scale: int, optional
+    :param border: How many modules of quiet zone to add on every side. Defaults to 0
+    :type border: int, optional
     """
     
-    size = len(arr)
-    img = Image.new('1', (size, size))
-    pixels = img.load()
-
-    for i in range(size):
-        for j in range(size):
-            pixels[i,j] = arr[j][i]
+    extension = os.path.splitext(filename)[1].lower()
+    
+    if extension == '.svg':
+        with open(filename, 'w', encoding='utf-8') as file:
+            renderers.write_svg(matrix, file, scale, border)
+        return
+    
+    if extension == '.pdf':
+        with open(filename, 'wb') as file:
+            renderers.write_pdf(matrix, file, scale, border)
+        return
+    
+    img = renderers.to_pil(matrix, scale, border)
     
-    img.save(fp="QR Code.png")
+    img.save(fp=filename)
     # img.show()
 
     return
 
 
 
+# Verification
+# The finished QR code is read back with the independent decoder in qr_decoder, so a mistake in any stage is caught before the code is used
+def verify_qr_matrix(matrix: QRMatrix, data: str, version: int, ec_level: str, mask: int) -> None:
+    """
+    Decodes a finished QR code and raises an Exception if it does not match what was encoded
+    
+    :param matrix: The finished QR code
+    :type matrix: QRMatrix
+    :param data: The data that was encoded
+    :type data: str
+    :param version: The version that was used
+    :type version: int
+    :param ec_level: The EC level that was used
+    :type ec_level: str
+    :param mask: The mask that was applied
+    :type mask: int
+    """
+    
+    try:
+        decoded = qr_decoder.decode_matrix(matrix)
+    except ValueError as error:
+        raise Exception(f"The QR code for {data!r} cannot be decoded: {error}") from error
+    
+    if (decoded.version, decoded.ec_level, decoded.mask) != (version, ec_level, mask):
+        raise Exception(f"The QR code for {data!r} reads as version {decoded.version}, EC level {decoded.ec_level} and mask {decoded.mask}, "
+                        f"but was encoded with version {version}, EC level {ec_level} and mask {mask}.")
+    if decoded.corrected:
+        raise Exception(f"The QR code for {data!r} only decodes after correcting {decoded.corrected} codewords.")
+    if decoded.text != data:
+        raise Exception(f"The QR code for {data!r} decodes as {decoded.text!r}.")
+
+
+# Function to combine all the stages into the finished QR code matrix
+def encode_qr_matrix(data: str, ec_level: str, output_stages: bool = False, min_ec: str = 'L', max_version: int = 40, mask: str = 'auto',
+                     verify: bool = False) -> QRMatrix:
+    """
+    Takes the desired data and EC level and encodes it into a QR code matrix, without writing any files
+    
+    :param data: The data to be encoded into a QR code
+    :type data: str
+    :param ec_level: Predefined Error Correction Level (e.g., 'L', 'M', 'Q', 'H'), or 'auto' to pick the highest level that fits the smallest version
+    :type ec_level: str
+    :param output_stages: Whether or not it should print relevant info. Defaults to False
+    :type output_stages: bool, optional
+    :param min_ec: The lowest EC level 'auto' may choose. Defaults to 'L'
+    :type min_ec: str, optional
+    :param max_version: The largest version that may be used. Defaults to 40
+    :type max_version: int, optional
+    :param mask: 'auto' to choose the best mask, or 'fixed:N' to always use mask N and skip the evaluation. Defaults to 'auto'
+    :type mask: str, optional
+    :param verify: Whether to decode the finished QR code again and raise an Exception if it does not read back as the data. Defaults to False
+    :type verify: bool, optional
+    :return: The finished QR code
+    :rtype: QRMatrix
+    """
+    
+    if ec_level == 'auto':
+        ec_level, version, segments = choose_ec_level(data, min_ec, max_version)
+    else:
+        version, segments = determine_version(ec_level, data, max_version)
+    
+    bit_buffer = convert_segments_to_binary(segments, version)
+    
+    codewords = convert_to_codewords(version, ec_level, bit_buffer)
+    
+    data_blocks = split_into_blocks(codewords, version, ec_level)
+    
+    error_blocks = generate_error_codewords(data_blocks, version, ec_level)
+    
+    all_codewords = convert_codewords_to_binary(interleave_blocks(data_blocks, error_blocks))
+    
+    remainder_bits = add_remainder_bits(all_codewords, version)
+
+    data_placed = place_data_bits(remainder_bits, create_matrix(version))
+    
+    masked, mask_num = apply_mask(data_placed, version, mask=mask)
+    
+    format_bits = generate_format_string(ec_level, mask_num)
+    
+    final = insert_format_bits(format_bits, masked)
+    
+    if version >= 7:
+        version_bits = generate_version_string(version)
+        
+        final = insert_version_bits(version_bits, final)
+    
+    if output_stages:
+        print(f"Data: {data}")
+        print(f"Segments: {segments}")
+        print(f"Version: {version}")
+        print(f"Error Correction Level: {ec_level}")
+        print(f"Codewords: {list(codewords)}")
+        print(f"Generator Polynomial: {generate_generator_polynomial(version, ec_level, 1)}")
+        print(f"Data Blocks: {[list(block) for block in data_blocks]}")
+        print(f"Error Codewords: {[list(block) for block in error_blocks]}")
+        print(f"All Codewords With Remainder Bits Added: {remainder_bits}")
+        print(f"Maks Used: {mask_num}")
+    
+    if verify:
+        verify_qr_matrix(final, data, version, ec_level, mask_num)
+    
+    
+    return final
+
+
 # Function to combine all the stages and generate the complete QR code
-def generate_qr_code(data: str, ec_level: str, output_stages: bool = False) -> None:
+def generate_qr_code(data: str, ec_level: str, output_stages: bool = False, min_ec: str = 'L', max_version: int = 40, mask: str = 'auto',
+                     save_as: str | None = None, verify: bool = False, cache: qr_cache.QRCache | None = None) -> QRMatrix:
     """
     Takes the desired data and EC level and generates a QR Code
+    \nNothing is written to disk unless save_as is given. Use the renderers module to turn the result into an image in memory
+    \nWith a cache, QR codes (and PNG, SVG and PDF images for save_as) that were made before are reused.
+    output_stages and verify are not used then: the cache's own verify setting applies to QR codes it has to make (see create_cache)
     
     :param data: The data to be encoded into a QR code
     :type data: str
-    :param ec_level: Predefined Error Correction Level (e.g., 'L', 'M', 'Q', 'H')
+    :param ec_level: Predefined Error Correction Level (e.g., 'L', 'M', 'Q', 'H'), or 'auto' to pick the highest level that fits the smallest version
     :type ec_level: str
     :param output_stages: Whether or not it should print relevant info. Defaults to False
     :type output_stages: bool, optional
+    :param min_ec: The lowest EC level 'auto' may choose. Defaults to 'L'
+    :type min_ec: str, optional
+    :param max_version: The largest version that may be used. Defaults to 40
+    :type max_version: int, optional
+    :param mask: 'auto' to choose the best mask, or 'fixed:N' to always use mask N and skip the evaluation. Defaults to 'auto'
+    :type mask: str, optional
+    :param verify: Whether to decode the finished QR code again and raise an Exception if it does not read back as the data. Defaults to False
+    :type verify: bool, optional
+    :param save_as: A filename to also save the QR code to as an image, e.g. "QR Code.png". Defaults to None
+    :type save_as: str | None, optional
+    :param cache: A cache to take the QR code from, and to add it to. Defaults to None
+    :type cache: qr_cache.QRCache | None, optional
+    :return: The finished QR code
+    :rtype: QRMatrix
     """
     
-    encoding_type = determine_encoding(data)
+    if cache is None:
+        matrix = encode_qr_matrix(data, ec_level, output_stages, min_ec, max_version, mask, verify)
+    else:
+        matrix = cache.matrix(data, ec_level, mask, max_version, min_ec)
+    
+    if save_as is not None:
+        file_format = os.path.splitext(save_as)[1].lower().lstrip('.')
+        
+        if cache is not None and file_format in qr_cache.RENDER_FORMATS:
+            with open(save_as, 'wb') as file:
+                file.write(cache.render(data, ec_level, 1, 0, file_format, mask, max_version, min_ec))
+        else:
+            create_image(matrix, save_as)
     
-    version = determine_version(encoding_type, ec_level, data)
     
-    character_count_indicator = bin(len(data))[2:].zfill(determine_character_count_indicator(version, encoding_type))
+    return matrix
+
+
+
+#################################
+# Caching
+#################################
+
+# Repeated payloads are served from an in-memory LRU cache instead of being encoded and rendered again, see qr_cache
+# Rendered images can also be kept in a directory, so a restarted process serves them without running the stages at all
+
+def create_cache(max_entries: int | None = 1024, max_bytes: int | None = 64 * 1024 * 1024, ttl: float | None = None,
+                 verify: bool = False, disk_dir: str | None = None, disk_max_bytes: int | None = 1024 * 1024 * 1024,
+                 sweep_interval: float | None = 300.0) -> qr_cache.QRCache:
+    """
+    Creates a thread-safe cache of QR codes and their images, for generate_qr_code or for serving images directly
+    
+    :param max_entries: The most QR codes and images to keep altogether, or None for no limit. Defaults to 1024
+    :type max_entries: int | None, optional
+    :param max_bytes: The most bytes to keep altogether, or None for no limit. Defaults to 64 MiB
+    :type max_bytes: int | None, optional
+    :param ttl: How many seconds an entry stays valid, or None to keep entries until they are evicted. Defaults to None
+    :type ttl: float | None, optional
+    :param verify: Whether to decode every QR code before it is cached, as for encode_qr_matrix. Defaults to False
+    :type verify: bool, optional
+    :param disk_dir: A directory to also keep rendered images in, shared by every process that uses it. Defaults to None
+    :type disk_dir: str | None, optional
+    :param disk_max_bytes: The most bytes to leave in disk_dir after each sweep, or None for no limit. Defaults to 1 GiB
+    :type disk_max_bytes: int | None, optional
+    :param sweep_interval: Seconds between sweeps of disk_dir in a background thread, or None to only sweep when DiskCache.sweep is called. Defaults to 300
+    :type sweep_interval: float | None, optional
+    :return: The cache
+    :rtype: qr_cache.QRCache
+    """
+    
+    def encode(data: str, ec_level: str, min_ec: str, max_version: int, mask: str) -> QRMatrix:
+        return encode_qr_matrix(data, ec_level, False, min_ec, max_version, mask, verify)
+    
+    disk = None
+    if disk_dir is not None:
+        disk = qr_cache.DiskCache(disk_dir, disk_max_bytes)
+        if sweep_interval is not None:
+            disk.start_sweeper(sweep_interval)
+    
+    return qr_cache.QRCache(encode, max_entries, max_bytes, ttl, disk)
+
+
+
+#################################
+# Batch Generation
+#################################
+
+# Each QR code is independent, so large batches are split into chunks and encoded in a pool of worker processes
+# Every worker draws all of the templates and mask patterns once when it starts, instead of once per chunk
+# Only a limited number of chunks are queued at a time, so an iterable of millions of payloads is never read into memory at once
+
+BATCH_OUTPUTS = ('matrix', 'png')
+
+def warm_caches(versions=qr_spec.VERSIONS) -> None:
+    """
+    Draws the templates and builds the mask engine's patterns for every given version up front
     
-    binary_data = convert_to_binary(encoding_type, data)
+    :param versions: The versions to prepare. Defaults to all 40
+    :type versions: Iterable[int]
+    """
     
-    codewords = convert_to_codewords(version, ec_level, encoding_type, character_count_indicator, binary_data)
+    for version in versions:
+        template = get_template(version)
+        masking_bits.mask_words(qr_spec.SIZES[version], template.function_mask)
+
+
+def _init_batch_worker() -> None:
+    # Runs once in each worker process. Caches filled before forking are inherited, so this is cheap with fork
+    warm_caches()
+
+
+def _encode_chunk(payloads: list[str], ec_level: str, min_ec: str, max_version: int, mask: str, output: str,
+                  scale: int, border: int, compress_level: int, verify: bool) -> list[QRMatrix | bytes]:
+    """
+    Encodes one chunk of a batch. Runs in a worker process
+    \nThe other parameters are the same as for generate_batch
     
-    message_polynomial = generate_message_polynomial(codewords)
+    :param payloads: The data for each QR code in the chunk
+    :type payloads: list[str]
+    :return: A matrix, or the PNG file contents, for each payload in order
+    :rtype: list[QRMatrix | bytes]
+    """
     
-    generator_polynomial = generate_generator_polynomial(version, ec_level, 1)
-    print(len(generator_polynomial))
-    print(generator_polynomial)
+    matrices = [encode_qr_matrix(data, ec_level, False, min_ec, max_version, mask, verify) for data in payloads]
     
-    error_codewords = polynomial_division(version, ec_level, message_polynomial, generator_polynomial)
+    if output == 'png':
+        return [renderers.to_png(matrix, scale, border, compress_level) for matrix in matrices]
     
-    all_codewords = convert_codewords_to_binary(deepcopy(codewords), error_codewords)
+    return matrices
+
+
+def _chunk(payloads: Iterable[str], chunksize: int) -> Iterator[list[str]]:
+    # Splits the payloads into lists of up to chunksize, reading them lazily
+    iterator = iter(payloads)
     
-    remainder_bits = add_remainder_bits(deepcopy(all_codewords), version)
+    while chunk := list(islice(iterator, chunksize)):
+        yield chunk
 
-    empty_array = create_array(version)
 
-    prefilled, alignment_positions = prefill_finder_patterns(version, deepcopy(empty_array))
+def generate_batch(payloads: Iterable[str], ec_level: str, workers: int | None = None, chunksize: int = 256, max_pending: int | None = None,
+                   output: str = 'matrix', min_ec: str = 'L', max_version: int = 40, mask: str = 'auto',
+                   scale: int = 1, border: int = 0, compress_level: int = 6, verify: bool = False) -> Iterator[QRMatrix | bytes]:
+    """
+    Encodes many QR codes in parallel, yielding them in the same order as the payloads
+    \nNothing is written to disk. Payloads are read lazily, and at most max_pending chunks are in flight at once
+    \nThe arguments are checked when it is called, so a bad output or chunksize raises straight away rather than on the first result
     
-    reserved = reserve_info_areas(version, deepcopy(prefilled))
+    :param payloads: The data for each QR code. Can be any iterable, including a generator of millions of records
+    :type payloads: Iterable[str]
+    :param ec_level: Predefined Error Correction Level (e.g., 'L', 'M', 'Q', 'H'), or 'auto'
+    :type ec_level: str
+    :param workers: The number of worker processes. Defaults to the number of CPUs. 1 encodes in this process without a pool
+    :type workers: int | None, optional
+    :param chunksize: How many payloads are sent to a worker at a time. Defaults to 256
+    :type chunksize: int, optional
+    :param max_pending: How many chunks may be queued or running at once. Defaults to twice the number of workers
+    :type max_pending: int | None, optional
+    :param output: 'matrix' to yield QRMatrix objects, or 'png' to yield the contents of PNG files. Defaults to 'matrix'
+    :type output: str, optional
+    :param min_ec: The lowest EC level 'auto' may choose. Defaults to 'L'
+    :type min_ec: str, optional
+    :param max_version: The largest version that may be used. Defaults to 40
+    :type max_version: int, optional
+    :param mask: 'auto' to choose the best mask, or 'fixed:N'. Defaults to 'auto'
+    :type mask: str, optional
+    :param scale: With output='png', how many pixels wide and high each module becomes. Defaults to 1
+    :type scale: int, optional
+    :param border: With output='png', how many modules of quiet zone to add on every side. Defaults to 0
+    :type border: int, optional
+    :param compress_level: With output='png', the zlib compression level from 0 to 9. Defaults to 6
+    :type compress_level: int, optional
+    :param verify: Whether to decode every QR code again and raise an Exception if one does not read back as its payload. Defaults to False
+    :type verify: bool, optional
+    :return: A matrix, or the PNG file contents, for each payload in order
+    :rtype: Iterator[QRMatrix | bytes]
+    """
     
-    data_placed = place_data_bits(deepcopy(remainder_bits), deepcopy(reserved))
+    if output not in BATCH_OUTPUTS:
+        raise Exception(f"Unknown batch output '{output}'. Use one of {', '.join(BATCH_OUTPUTS)}.")
+    if chunksize < 1:
+        raise Exception("The chunk size must be at least 1.")
     
-    masked, mask_num = apply_mask(deepcopy(data_placed), version, alignment_positions)
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
     
-    format_bits = generate_format_string(ec_level, mask_num)
+    # The work only starts when the results are iterated
+    return _generate_batch(_chunk(payloads, chunksize), workers, max_pending, (ec_level, min_ec, max_version, mask, output, scale, border, compress_level, verify))
+
+
+def _generate_batch(chunks: Iterator[list[str]], workers: int, max_pending: int, options: tuple) -> Iterator[QRMatrix | bytes]:
+    # The generator behind generate_batch. options are the arguments of _encode_chunk after the chunk
+    if workers == 1:
+        for chunk in chunks:
+            yield from _encode_chunk(chunk, *options)
+        return
     
-    format_inserted = insert_format_bits(format_bits, deepcopy(masked))
+    # Fill the caches before the pool starts, so forked workers inherit them
+    warm_caches()
     
-    if version >= 7:
-        version_bits = generate_version_string(version)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker) as executor:
+        pending = deque()
+        
+        # Fill the queue, then wait for the oldest chunk before submitting the next one
+        for chunk in chunks:
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+            pending.append(executor.submit(_encode_chunk, chunk, *options))
         
-        version_inserted = insert_version_bits(version_bits, deepcopy(format_inserted))
+        while pending:
+            yield from pending.popleft().result()
+
+
+
+#################################
+# Streaming Batch Pipeline
+#################################
+
+# Reads payloads from a CSV or JSONL file one row at a time, encodes them with generate_batch, and writes one PNG per row
+# Memory use does not grow with the size of the input: rows are read lazily and only a bounded number of chunks are in flight
+# The number of rows written so far is saved in a progress file after every chunk, so an interrupted run can carry on where it stopped
+
+PAYLOAD_FORMATS = ('jsonl', 'csv')
+PROGRESS_FILE = '.progress'
 
-        final = deepcopy(version_inserted)
+def read_payloads(path: str, field: str = 'data', file_format: str | None = None) -> Iterator[str]:
+    """
+    Lazily reads one payload per row from a CSV or JSONL file
+    \nJSONL rows may be plain JSON strings, or objects with the payload under field. CSV files need a header row with a field column
+    
+    :param path: The file to read
+    :type path: str
+    :param field: The JSON key or CSV column holding the payload. Defaults to 'data'
+    :type field: str, optional
+    :param file_format: 'jsonl' or 'csv'. Defaults to None, which picks the format from the file extension
+    :type file_format: str | None, optional
+    :return: The payload of each row, in order
+    :rtype: Iterator[str]
+    """
     
-    else:
-        final = deepcopy(format_inserted)
+    if file_format is None:
+        file_format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+    if file_format not in PAYLOAD_FORMATS:
+        raise Exception(f"Unknown input format '{file_format}'. Use one of {', '.join(PAYLOAD_FORMATS)}.")
     
-    create_image(final)
+    with open(path, newline='', encoding='utf-8') as file:
+        if file_format == 'csv':
+            reader = csv.DictReader(file)
+            if reader.fieldnames is None or field not in reader.fieldnames:
+                raise Exception(f"The CSV file has no '{field}' column.")
+            
+            for row in reader:
+                yield row[field]
+            return
+        
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            
+            row = json.loads(line)
+            if isinstance(row, dict):
+                if field not in row:
+                    raise Exception(f"Line {line_number} has no '{field}' key.")
+                row = row[field]
+            
+            yield row if isinstance(row, str) else str(row)
+
+
+def read_progress(out_dir: str) -> int:
+    """
+    :param out_dir: The output directory of a batch run
+    :type out_dir: str
+    :return: The number of rows that have already been written, or 0 if the run has not started
+    :rtype: int
+    """
     
-    if output_stages:
-        print(f"Data: {data}")
-        print(f"Encoding: {encoding_type}")
-        print(f"Version: {version}")
-        print(f"Error Correction Level: {ec_level}")
-        print(f"Character Count Indicator: {character_count_indicator}")
-        print(f"Binary Data: {binary_data}")
-        print(f"Codewords: {codewords}")
-        print(f"Message Polynomial: {message_polynomial}")
-        print(f"Generator Polynomial: {generator_polynomial}")
-        print(f"Error Codewords: {error_codewords}")
-        print(f"All Codewords: {all_codewords}")
-        print(f"All Codewords With Remainder Bits Added: {remainder_bits}")
-        print(f"Maks Used: {mask_num}")
+    try:
+        with open(os.path.join(out_dir, PROGRESS_FILE)) as file:
+            return int(file.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_progress(out_dir: str, rows_done: int) -> None:
+    """
+    Records how many rows have been written. The file is replaced in one step, so it is never left half written
+    
+    :param out_dir: The output directory of a batch run
+    :type out_dir: str
+    :param rows_done: The number of rows written so far
+    :type rows_done: int
+    """
     
+    temporary_path = os.path.join(out_dir, PROGRESS_FILE + '.tmp')
+    with open(temporary_path, 'w') as file:
+        file.write(str(rows_done))
     
-    return
+    os.replace(temporary_path, os.path.join(out_dir, PROGRESS_FILE))
 
 
+def run_batch(input_path: str, out_dir: str, ec_level: str = 'M', field: str = 'data', file_format: str | None = None, start_row: int | None = None,
+              workers: int | None = None, chunksize: int = 256, max_pending: int | None = None, scale: int = 1, border: int = 0,
+              compress_level: int = 6, verify: bool = False) -> int:
+    """
+    Encodes every row of a CSV or JSONL file into its own PNG, named after the row number (e.g. 00000042.png)
+    
+    :param input_path: The CSV or JSONL file to read
+    :type input_path: str
+    :param out_dir: The directory to write the images and the progress file to. It is created if needed
+    :type out_dir: str
+    :param ec_level: Predefined Error Correction Level (e.g., 'L', 'M', 'Q', 'H'), or 'auto'. Defaults to 'M'
+    :type ec_level: str, optional
+    :param field: The JSON key or CSV column holding the payload. Defaults to 'data'
+    :type field: str, optional
+    :param file_format: 'jsonl' or 'csv'. Defaults to None, which picks the format from the file extension
+    :type file_format: str | None, optional
+    :param start_row: The first row to encode. Defaults to None, which resumes from the progress file
+    :type start_row: int | None, optional
+    :param workers: The number of worker processes, as for generate_batch
+    :type workers: int | None, optional
+    :param chunksize: How many rows are sent to a worker at a time. Defaults to 256
+    :type chunksize: int, optional
+    :param max_pending: How many chunks may be in flight at once, as for generate_batch
+    :type max_pending: int | None, optional
+    :param scale: How many pixels wide and high each module becomes. Defaults to 1
+    :type scale: int, optional
+    :param border: How many modules of quiet zone to add on every side. Defaults to 0
+    :type border: int, optional
+    :param compress_level: The zlib compression level of the PNGs, from 0 to 9. Defaults to 6
+    :type compress_level: int, optional
+    :param verify: Whether to decode every QR code again before it is written, stopping at the first one that does not read back. Defaults to False
+    :type verify: bool, optional
+    :return: The number of rows written by this run
+    :rtype: int
+    """
+    
+    os.makedirs(out_dir, exist_ok=True)
+    
+    if start_row is None:
+        start_row = read_progress(out_dir)
+    
+    payloads = islice(read_payloads(input_path, field, file_format), start_row, None)
+    images = generate_batch(payloads, ec_level, workers=workers, chunksize=chunksize, max_pending=max_pending, output='png',
+                            scale=scale, border=border, compress_level=compress_level, verify=verify)
+    
+    rows_done = start_row
+    for image in images:
+        with open(os.path.join(out_dir, f"{rows_done:08d}.png"), 'wb') as file:
+            file.write(image)
+        rows_done += 1
+        
+        # Save the progress once per chunk. Rows after the saved count may be written again if the run is interrupted
+        if (rows_done - start_row) % chunksize == 0:
+            write_progress(out_dir, rows_done)
+    
+    write_progress(out_dir, rows_done)
+    
+    return rows_done - start_row
+
+
+#################################
+# HTTP Service
+#################################
+
+# `qr-code.py serve` answers GET /qr?data=...&ec=...&scale=... over HTTP, see qr_service
+# The images are made in worker processes. Each worker keeps its own cache of matrices and images,
+# and with a disk directory they all share the images that any of them (or an earlier run) has made
+
+_service_cache: qr_cache.QRCache | None = None
+
+def _init_service_worker(cache_entries: int, disk_dir: str | None) -> None:
+    # Runs once in each worker process. The disk directory is swept by the main process, not by the workers
+    global _service_cache
+    
+    warm_caches()
+    _service_cache = create_cache(max_entries=cache_entries, disk_dir=disk_dir, sweep_interval=None)
+
+
+def render_for_service(data: str, ec_level: str, scale: int, border: int, file_format: str) -> bytes:
+    """
+    Makes one image for the HTTP service. Runs in a worker process started by run_service
+    
+    :param data: The data to be encoded into a QR code
+    :type data: str
+    :param ec_level: Predefined Error Correction Level (e.g., 'L', 'M', 'Q', 'H')
+    :type ec_level: str
+    :param scale: How many pixels wide and high each module becomes
+    :type scale: int
+    :param border: How many modules of quiet zone to add on every side
+    :type border: int
+    :param file_format: 'png', 'svg' or 'pdf'
+    :type file_format: str
+    :return: The contents of the image file
+    :rtype: bytes
+    """
+    
+    # The result is pickled back to the server process, which a view of a memory mapped file cannot be
+    return bytes(_service_cache.render(data, ec_level, scale, border, file_format))
 
-def main() -> None:
+
+def run_service(host: str = '127.0.0.1', port: int = 8080, workers: int | None = None, cache_entries: int = 4096,
+                disk_dir: str | None = None, disk_max_bytes: int | None = 1024 * 1024 * 1024) -> None:
+    """
+    Serves QR code images over HTTP until interrupted
+    
+    :param host: The address to listen on. Defaults to '127.0.0.1'
+    :type host: str, optional
+    :param port: The port to listen on. Defaults to 8080
+    :type port: int, optional
+    :param workers: The number of worker processes. Defaults to the number of CPUs
+    :type workers: int | None, optional
+    :param cache_entries: The most images the server keeps in memory, and the most entries each worker keeps. Defaults to 4096
+    :type cache_entries: int, optional
+    :param disk_dir: A directory to also keep images in, so they survive restarts. Defaults to None
+    :type disk_dir: str | None, optional
+    :param disk_max_bytes: The most bytes to leave in disk_dir after each sweep, or None for no limit. Defaults to 1 GiB
+    :type disk_max_bytes: int | None, optional
+    """
+    
+    workers = workers or os.cpu_count() or 1
+    
+    # Fill the caches before the pool starts, so forked workers inherit them
+    warm_caches()
+    
+    # The main process sweeps the directory, and serves the images in it without asking a worker
+    disk = None
+    if disk_dir is not None:
+        disk = qr_cache.DiskCache(disk_dir, disk_max_bytes)
+        disk.start_sweeper()
+    
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_service_worker, initargs=(cache_entries, disk_dir)) as executor:
+        service = qr_service.QRService(render_for_service, executor, cache_entries, disk=disk)
+        
+        try:
+            asyncio.run(service.serve(host, port))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if disk is not None:
+                disk.stop_sweeper()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Generate QR codes. With no command, saves an example as \"QR Code.png\".")
+    commands = parser.add_subparsers(dest='command')
+    
+    batch = commands.add_parser('batch', help="Write one PNG per row of a CSV or JSONL file")
+    batch.add_argument('--input', required=True, help="The CSV or JSONL file to read")
+    batch.add_argument('--out', required=True, help="The directory to write the images to")
+    batch.add_argument('--ec', default='M', choices=qr_spec.EC_LEVELS + ('auto',), help="The error correction level. Defaults to M")
+    batch.add_argument('--field', default='data', help="The JSON key or CSV column holding the payload. Defaults to data")
+    batch.add_argument('--format', choices=PAYLOAD_FORMATS, help="The input format. Defaults to the file extension")
+    batch.add_argument('--start', type=int, help="The first row to encode. Defaults to resuming from the last run")
+    batch.add_argument('--workers', type=int, help="The number of worker processes. Defaults to the number of CPUs")
+    batch.add_argument('--chunksize', type=int, default=256, help="Rows per worker task. Defaults to 256")
+    batch.add_argument('--scale', type=int, default=4, help="Pixels per module. Defaults to 4")
+    batch.add_argument('--border', type=int, default=4, help="Modules of quiet zone around each code. Defaults to 4")
+    batch.add_argument('--compress-level', type=int, default=6, choices=range(10), metavar='0-9', help="PNG zlib compression level. Defaults to 6")
+    batch.add_argument('--verify', action='store_true', help="Decode every QR code again and stop if one does not read back as its row")
+    
+    serve = commands.add_parser('serve', help="Serve QR code images over HTTP: GET /qr?data=...&ec=...&scale=... and GET /metrics")
+    serve.add_argument('--host', default='127.0.0.1', help="The address to listen on. Defaults to 127.0.0.1")
+    serve.add_argument('--port', type=int, default=8080, help="The port to listen on. Defaults to 8080")
+    serve.add_argument('--workers', type=int, help="The number of worker processes. Defaults to the number of CPUs")
+    serve.add_argument('--cache-entries', type=int, default=4096, help="Images kept in memory. Defaults to 4096")
+    serve.add_argument('--disk-dir', help="A directory to keep images in across restarts")
+    serve.add_argument('--disk-max-bytes', type=int, default=1024 * 1024 * 1024, help="Size limit of the disk directory. Defaults to 1 GiB")
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == 'batch':
+        written = run_batch(args.input, args.out, args.ec, args.field, args.format, args.start, args.workers, args.chunksize,
+                            scale=args.scale, border=args.border, compress_level=args.compress_level, verify=args.verify)
+        print(f"Wrote {written} QR codes to {args.out}")
+        return
+    
+    if args.command == 'serve':
+        print(f"Serving on http://{args.host}:{args.port}/qr?data=...")
+        run_service(args.host, args.port, args.workers, args.cache_entries, args.disk_dir, args.disk_max_bytes)
+        return
+    
     data = "hello world aaaaaaaaaaa".upper()
     error_correction_level = "M"
     
-    generate_qr_code(data, error_correction_level, False)
+    generate_qr_code(data, error_correction_level, False, save_as="QR Code.png")
     
     return
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
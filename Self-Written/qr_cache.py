@@ -0,0 +1,580 @@
+#########################################################
+# QR Code Cache
+# Keeps finished QR codes and their rendered images in memory, and optionally on disk
+#########################################################
+
+# The same payloads are often requested again and again, so finished QR codes are kept in a bounded, thread-safe LRU cache
+# Rendered images are cached as well, one entry per (scale, border, format) variant, next to the matrix they were drawn from
+# Matrices and images share the same limits on the number of entries and the number of bytes, and the least recently used go first
+#
+# Nothing is encoded or rendered while the lock is held, so a slow miss never holds up hits from other threads
+# Two threads that miss on the same key at the same time both do the work, and the second result replaces the first
+#
+# Rendered images can also be kept on disk, so they survive restarts and are shared by every process using the same directory (see DiskCache)
+
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+from types import MappingProxyType
+from typing import NamedTuple
+
+import renderers
+from qr_matrix import QRMatrix
+
+
+# How each image format is rendered, as bytes
+RENDER_FORMATS = MappingProxyType({
+    'png': lambda matrix, scale, border: renderers.to_png(matrix, scale, border),
+    'svg': lambda matrix, scale, border: renderers.to_svg(matrix, scale, border).encode('utf-8'),
+    'pdf': lambda matrix, scale, border: renderers.to_pdf(matrix, scale, border),
+})
+
+# Marks a missing entry, since None could be a cached value
+_MISSING = object()
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int # Entries removed to stay within the limits
+    expirations: int # Entries found to be older than the TTL
+    entries: int
+    size_bytes: int
+
+
+#################################
+# Memory Cache
+#################################
+
+class LRUCache:
+    """
+    A thread-safe least recently used cache, limited by number of entries and by total size in bytes, with an optional time to live
+    """
+
+    def __init__(self, max_entries: int | None = 1024, max_bytes: int | None = 64 * 1024 * 1024, ttl: float | None = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param max_entries: The most entries to keep, or None for no limit. Defaults to 1024
+        :type max_entries: int | None, optional
+        :param max_bytes: The most bytes to keep, as given to put, or None for no limit. Defaults to 64 MiB
+        :type max_bytes: int | None, optional
+        :param ttl: How many seconds an entry stays valid after it is stored, or None to keep entries until they are evicted. Defaults to None
+        :type ttl: float | None, optional
+        :param clock: Where the time comes from. Defaults to time.monotonic
+        :type clock: Callable[[], float], optional
+        """
+
+        if (max_entries is not None and max_entries < 1) or (max_bytes is not None and max_bytes < 1):
+            raise ValueError("The cache limits must be at least 1.")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("The TTL must be positive.")
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+
+        # key -> (value, size, expiry time or None), least recently used first
+        self._entries: OrderedDict[Hashable, tuple[object, int, float | None]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self._hits = self._misses = self._evictions = self._expirations = 0
+
+    def _lookup(self, key: Hashable) -> object:
+        # Must be called with the lock held. Returns _MISSING for absent or expired entries
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+
+        value, size, expires = entry
+        if expires is not None and self._clock() >= expires:
+            del self._entries[key]
+            self._size -= size
+            self._expirations += 1
+            return _MISSING
+
+        self._entries.move_to_end(key)
+        return value
+
+    def get(self, key: Hashable, default: object = None) -> object:
+        """
+        :param key: The key to look up
+        :type key: Hashable
+        :param default: What to return if the key is not cached. Defaults to None
+        :type default: object, optional
+        :return: The cached value, or default
+        :rtype: object
+        """
+
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self._misses += 1
+                return default
+
+            self._hits += 1
+            return value
+
+    def put(self, key: Hashable, value: object, size: int) -> None:
+        """
+        Stores a value, evicting the least recently used entries until the cache is within its limits
+        \nA value bigger than max_bytes on its own is not stored, but it still replaces any entry already stored under the key
+
+        :param key: The key to store it under
+        :type key: Hashable
+        :param value: The value
+        :type value: object
+        :param size: How many bytes the value counts as
+        :type size: int
+        """
+
+        expires = None if self.ttl is None else self._clock() + self.ttl
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+
+            self._entries[key] = (value, size, expires)
+            self._size += size
+
+            while ((self.max_entries is not None and len(self._entries) > self.max_entries)
+                   or (self.max_bytes is not None and self._size > self.max_bytes)):
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self._evictions += 1
+
+    def get_or_create(self, key: Hashable, create: Callable[[], tuple[object, int]]) -> object:
+        """
+        Returns the cached value, or makes it with create, stores it, and returns it
+
+        :param key: The key to look up
+        :type key: Hashable
+        :param create: Called without the lock held on a miss. Returns the value and how many bytes it counts as
+        :type create: Callable[[], tuple[object, int]]
+        :return: The value
+        :rtype: object
+        """
+
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                self._hits += 1
+                return value
+            self._misses += 1
+
+        value, size = create()
+        self.put(key, value, size)
+
+        return value
+
+    def discard(self, key: Hashable) -> None:
+        """
+        :param key: The key to remove, if it is cached
+        :type key: Hashable
+        """
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry[1]
+
+    def clear(self) -> None:
+        """
+        Removes every entry. The counters are kept
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> CacheStats:
+        """
+        :return: The counters, and how many entries and bytes are cached
+        :rtype: CacheStats
+        """
+
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions, self._expirations, len(self._entries), self._size)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        # Does not count as a hit or a miss, or make the entry more recently used
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[2] is None or self._clock() < entry[2])
+
+
+#################################
+# Disk Cache
+#################################
+
+# Each file is named after the SHA-256 hash of its key, in a subdirectory named after the first 2 hex digits of the hash
+# Files are written to a temporary file in the same directory and renamed into place, so a reader never sees a half written file
+# Reading a file marks it as recently used by updating its modification time, and the sweeper deletes the least recently used files first
+#
+# Files are read by mapping them into memory and handing out a read-only memoryview of the map, so a cached image is served straight from the page cache without being copied
+# The map is closed when the last view of it is released. Views are not kept in the memory cache, since every open map holds a file descriptor
+
+# Part of every key, so files written by an older layout or renderer are never read back. Increase it when the output changes
+DISK_FORMAT_VERSION = 1
+
+TEMPORARY_PREFIX = '.tmp-'
+
+# Temporary files older than this were left behind by a writer that crashed, and are deleted by the sweeper
+STALE_TEMPORARY_SECONDS = 3600
+
+
+class DiskCache:
+    """
+    A content-addressed cache of files in a directory, safe to share between threads and processes
+    """
+
+    def __init__(self, directory: str, max_bytes: int | None = 1024 * 1024 * 1024, max_files: int | None = None):
+        """
+        :param directory: Where to keep the files. It is created if needed
+        :type directory: str
+        :param max_bytes: The most bytes the sweeper leaves in the directory, or None for no limit. Defaults to 1 GiB
+        :type max_bytes: int | None, optional
+        :param max_files: The most files the sweeper leaves in the directory, or None for no limit. Defaults to None
+        :type max_files: int | None, optional
+        """
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._evictions = 0
+
+        self._sweeper: threading.Thread | None = None
+        self._stop_sweeper = threading.Event()
+
+    def path(self, key: Hashable, suffix: str = '') -> str:
+        """
+        :param key: A tuple of strings and numbers, whose repr is the same in every process
+        :type key: Hashable
+        :param suffix: Added to the file name, e.g. '.png'. Defaults to ''
+        :type suffix: str, optional
+        :return: Where the file for the key is kept
+        :rtype: str
+        """
+
+        digest = hashlib.sha256(repr((DISK_FORMAT_VERSION, key)).encode('utf-8')).hexdigest()
+
+        return os.path.join(self.directory, digest[:2], digest + suffix)
+
+    def get(self, key: Hashable, suffix: str = '') -> memoryview | None:
+        """
+        Reads a cached file without copying it into memory
+
+        :param key: The key the file was stored under
+        :type key: Hashable
+        :param suffix: The suffix it was stored with. Defaults to ''
+        :type suffix: str, optional
+        :return: A read-only view of the memory mapped file, or None if it is not cached. The file stays mapped until the view and every slice of it are released
+        :rtype: memoryview | None
+        """
+
+        path = self.path(key, suffix)
+
+        try:
+            with open(path, 'rb') as file:
+                if os.fstat(file.fileno()).st_size:
+                    contents = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+                else:
+                    contents = memoryview(b'') # An empty file cannot be mapped
+        except FileNotFoundError:
+            with self._lock:
+                self._misses += 1
+            return None
+
+        # Mark the file as recently used for the sweeper. It may have just been swept, which does not matter to the open map
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        with self._lock:
+            self._hits += 1
+
+        return contents
+
+    def put(self, key: Hashable, contents: bytes, suffix: str = '') -> str:
+        """
+        Stores a file, replacing it in one step if it already exists
+
+        :param key: The key to store it under
+        :type key: Hashable
+        :param contents: The file contents
+        :type contents: bytes
+        :param suffix: Added to the file name, e.g. '.png'. Defaults to ''
+        :type suffix: str, optional
+        :return: The path of the file
+        :rtype: str
+        """
+
+        path = self.path(key, suffix)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=TEMPORARY_PREFIX)
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(contents)
+            os.replace(temporary_path, path)
+        except BaseException:
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+            raise
+
+        return path
+
+    def _files(self) -> list[tuple[float, int, str]]:
+        # (modification time, size, path) of every cached file, and deletes temporary files left behind by crashed writers
+        files = []
+        stale_before = time.time() - STALE_TEMPORARY_SECONDS
+
+        for subdirectory in os.scandir(self.directory):
+            if not subdirectory.is_dir():
+                continue
+
+            for entry in os.scandir(subdirectory.path):
+                try:
+                    info = entry.stat()
+                except FileNotFoundError:
+                    continue
+
+                if entry.name.startswith(TEMPORARY_PREFIX):
+                    if info.st_mtime < stale_before:
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
+                    continue
+
+                files.append((info.st_mtime, info.st_size, entry.path))
+
+        return files
+
+    def sweep(self) -> int:
+        """
+        Deletes the least recently used files until the directory is within max_bytes and max_files
+
+        :return: The number of files deleted
+        :rtype: int
+        """
+
+        files = self._files()
+        total = sum(size for _, size, _ in files)
+        count = len(files)
+
+        files.sort()
+        deleted = 0
+
+        for _, size, path in files:
+            if (self.max_bytes is None or total <= self.max_bytes) and (self.max_files is None or count <= self.max_files):
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Another process may still have it open (e.g. on Windows). Leave it for the next sweep
+                continue
+
+            total -= size
+            count -= 1
+            deleted += 1
+
+        with self._lock:
+            self._evictions += deleted
+
+        return deleted
+
+    def start_sweeper(self, interval: float = 300.0) -> None:
+        """
+        Sweeps the directory in a background thread every interval seconds, until stop_sweeper is called
+
+        :param interval: Seconds between sweeps. Defaults to 300
+        :type interval: float, optional
+        """
+
+        if self._sweeper is not None:
+            return
+
+        self._stop_sweeper.clear()
+
+        def run() -> None:
+            while not self._stop_sweeper.wait(interval):
+                self.sweep()
+
+        self._sweeper = threading.Thread(target=run, name='qr-disk-cache-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self) -> None:
+        """
+        Stops the background sweeper, if it is running
+        """
+
+        if self._sweeper is None:
+            return
+
+        self._stop_sweeper.set()
+        self._sweeper.join()
+        self._sweeper = None
+
+    def stats(self) -> CacheStats:
+        """
+        :return: The counters, and how many files and bytes are in the directory. Files are never expired, so expirations is always 0
+        :rtype: CacheStats
+        """
+
+        files = self._files()
+
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions, 0, len(files), sum(size for _, size, _ in files))
+
+
+#################################
+# QR Codes
+#################################
+
+def render_key(data: str, ec_level: str, scale: int, border: int, file_format: str, mask: str = 'auto', max_version: int = 40,
+               min_ec: str = 'L') -> tuple:
+    """
+    :return: The key a rendered image is cached under, in memory and on disk. The parameters are the same as for QRCache.render
+    :rtype: tuple
+    """
+
+    return ('render', data, ec_level, min_ec, mask, max_version, scale, border, file_format)
+
+
+
+class QRCache:
+    """
+    Caches finished QR codes by (payload, EC level, min EC level, mask, max version),
+    and their rendered images by the same key plus (scale, border, format)
+    \nImages missing from memory are looked for on disk, if there is a disk cache, before anything is encoded or rendered.
+    Those are returned as views of the mapped file rather than copied into memory (see DiskCache.get)
+    """
+
+    def __init__(self, encode: Callable[..., QRMatrix], max_entries: int | None = 1024, max_bytes: int | None = 64 * 1024 * 1024,
+                 ttl: float | None = None, disk: DiskCache | None = None):
+        """
+        :param encode: Makes a QR code on a miss, called as encode(data, ec_level, min_ec=..., max_version=..., mask=...), like encode_qr_matrix
+        :type encode: Callable[..., QRMatrix]
+        :param max_entries: The most matrices and images to keep altogether, or None for no limit. Defaults to 1024
+        :type max_entries: int | None, optional
+        :param max_bytes: The most bytes to keep altogether, or None for no limit. A matrix counts as one byte per module. Defaults to 64 MiB
+        :type max_bytes: int | None, optional
+        :param ttl: How many seconds an entry stays valid, or None to keep entries until they are evicted. Defaults to None
+        :type ttl: float | None, optional
+        :param disk: Where rendered images are also kept, across restarts and between processes. Defaults to None
+        :type disk: DiskCache | None, optional
+        """
+
+        self._encode = encode
+        self.entries = LRUCache(max_entries, max_bytes, ttl)
+        self.disk = disk
+
+    def matrix(self, data: str, ec_level: str = 'M', mask: str = 'auto', max_version: int = 40, min_ec: str = 'L') -> QRMatrix:
+        """
+        :param data: The data to be encoded into a QR code
+        :type data: str
+        :param ec_level: Predefined Error Correction Level (e.g., 'L', 'M', 'Q', 'H'), or 'auto'. Defaults to 'M'
+        :type ec_level: str, optional
+        :param mask: 'auto' to choose the best mask, or 'fixed:N'. Defaults to 'auto'
+        :type mask: str, optional
+        :param max_version: The largest version that may be used. Defaults to 40
+        :type max_version: int, optional
+        :param min_ec: The lowest EC level 'auto' may choose. Defaults to 'L'
+        :type min_ec: str, optional
+        :return: The finished QR code. It is a copy-on-write copy, so changing it does not change the cached one
+        :rtype: QRMatrix
+        """
+
+        def create() -> tuple[QRMatrix, int]:
+            matrix = self._encode(data, ec_level, min_ec=min_ec, max_version=max_version, mask=mask)
+            return matrix, matrix.size * matrix.size
+
+        return self.entries.get_or_create(('matrix', data, ec_level, min_ec, mask, max_version), create).copy()
+
+    def render(self, data: str, ec_level: str = 'M', scale: int = 1, border: int = 0, file_format: str = 'png', mask: str = 'auto',
+               max_version: int = 40, min_ec: str = 'L') -> bytes | memoryview:
+        """
+        :param data: The data to be encoded into a QR code
+        :type data: str
+        :param ec_level: Predefined Error Correction Level (e.g., 'L', 'M', 'Q', 'H'), or 'auto'. Defaults to 'M'
+        :type ec_level: str, optional
+        :param scale: How many pixels (or points) wide and high each module becomes. Defaults to 1
+        :type scale: int, optional
+        :param border: How many modules of quiet zone to add on every side. Defaults to 0
+        :type border: int, optional
+        :param file_format: 'png', 'svg' or 'pdf'. Defaults to 'png'
+        :type file_format: str, optional
+        :param mask: 'auto' to choose the best mask, or 'fixed:N'. Defaults to 'auto'
+        :type mask: str, optional
+        :param max_version: The largest version that may be used. Defaults to 40
+        :type max_version: int, optional
+        :param min_ec: The lowest EC level 'auto' may choose. Defaults to 'L'
+        :type min_ec: str, optional
+        :return: The contents of the image file, as a read-only view of the mapped file if it was found on disk
+        :rtype: bytes | memoryview
+        """
+
+        renderer = RENDER_FORMATS.get(file_format)
+        if renderer is None:
+            raise ValueError(f"Unknown image format '{file_format}'. Use one of {', '.join(RENDER_FORMATS)}.")
+
+        key = render_key(data, ec_level, scale, border, file_format, mask, max_version, min_ec)
+        suffix = '.' + file_format
+
+        image = self.entries.get(key)
+        if image is not None:
+            return image
+
+        if self.disk is not None:
+            stored = self.disk.get(key, suffix)
+            if stored is not None:
+                return stored
+
+        image = renderer(self.matrix(data, ec_level, mask, max_version, min_ec), scale, border)
+
+        if self.disk is not None:
+            self.disk.put(key, image, suffix)
+        self.entries.put(key, image, len(image))
+
+        return image
+
+    def stats(self) -> CacheStats:
+        """
+        :return: The counters, and how many entries and bytes are cached
+        :rtype: CacheStats
+        """
+
+        return self.entries.stats()
+
+    def clear(self) -> None:
+        """
+        Removes every cached matrix and image
+        """
+
+        self.entries.clear()
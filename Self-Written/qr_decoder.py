@@ -0,0 +1,580 @@
+#########################################################
+# QR Decoder
+# Reads a finished QR matrix back into its data, to check that what was encoded is what a scanner will see
+#########################################################
+
+# This works on a QRMatrix (0 for dark modules, 1 for light modules), not on a photo, so nothing has to be located or sampled
+# The steps are the encoding stages in reverse:
+#   read the format (and version) information, unmask and read the data modules, de-interleave the blocks,
+#   correct them with Reed-Solomon, and parse the segments
+#
+# The layout (function patterns, data module order and masks) is worked out here from the specification again,
+# rather than taken from the encoder, so a mistake in the encoder's layout shows up as a failed decode instead of being repeated
+
+from functools import lru_cache
+from itertools import product
+from typing import NamedTuple
+
+import galois_field as gf
+import qr_spec
+import reed_solomon
+from qr_matrix import QRMatrix
+
+
+class DecodedQR(NamedTuple):
+    version: int
+    ec_level: str
+    mask: int
+    segments: list[tuple[str, str | bytes]] # (mode indicator, segment data), with bytes for byte mode and str for the other modes
+    corrected: int # How many codewords Reed-Solomon had to correct
+
+    @property
+    def text(self) -> str:
+        """
+        The segments joined into one string
+        \nByte mode has no way to say how it was encoded, so this follows the encoder: UTF-8 if the data has characters that
+        ISO-8859-1 cannot store (including any Kanji), otherwise ISO-8859-1
+        """
+
+        raw = b''.join(data for mode, data in self.segments if mode == '0100')
+
+        try:
+            decoded = raw.decode('utf-8')
+            use_utf8 = any(mode == '1000' for mode, _ in self.segments) or any(ord(char) > 0xFF for char in decoded)
+        except UnicodeDecodeError:
+            use_utf8 = False
+
+        encoding = 'utf-8' if use_utf8 else 'iso-8859-1'
+
+        return ''.join(data.decode(encoding) if mode == '0100' else data for mode, data in self.segments)
+
+
+#################################
+# Format and Version Information
+#################################
+
+# Both are BCH codes, so the nearest valid code word is found by comparing against all of them
+# Up to 3 wrong bits can be corrected in either code
+MAX_INFO_ERRORS = 3
+
+FORMAT_MASK = 0b101010000010010
+
+# The EC level bits in the format information
+EC_BITS = {'L': 0b01, 'M': 0b00, 'Q': 0b11, 'H': 0b10}
+
+FORMAT_CODES = {gf.bch_encode((EC_BITS[ec_level] << 3) | mask, gf.FORMAT_GENERATOR) ^ FORMAT_MASK: (ec_level, mask)
+                for ec_level in qr_spec.EC_LEVELS for mask in range(8)}
+
+VERSION_CODES = {gf.bch_encode(version, gf.VERSION_GENERATOR): version for version in range(7, 41)}
+
+
+def nearest_code(value: int, codes: dict[int, object]) -> object:
+    """
+    :param value: The bits that were read
+    :type value: int
+    :param codes: Every valid code word, and what it stands for
+    :type codes: dict[int, object]
+    :return: What the nearest code word stands for. Raises ValueError if every code word is more than MAX_INFO_ERRORS bits away
+    :rtype: object
+    """
+
+    if value in codes:
+        return codes[value]
+
+    distance, code = min(((value ^ code).bit_count(), code) for code in codes)
+    if distance > MAX_INFO_ERRORS:
+        raise ValueError(f"The information bits {value:b} are not within {MAX_INFO_ERRORS} bits of a valid code word.")
+
+    return codes[code]
+
+
+@lru_cache(maxsize=None)
+def format_positions(size: int) -> tuple[tuple[int, ...], tuple[int, ...]]:
+    """
+    :param size: The number of modules along each side
+    :type size: int
+    :return: The flat index of each format bit, most significant first, for the copy around the top left finder pattern and for the split copy
+    :rtype: tuple[tuple[int, ...], tuple[int, ...]]
+    """
+
+    # Along row 8 to the right of the timing pattern, then up column 8 above it
+    top_left = [(8, column) for column in (0, 1, 2, 3, 4, 5, 7, 8)] + [(row, 8) for row in (7, 5, 4, 3, 2, 1, 0)]
+
+    # Up column 8 from the bottom, then along row 8 to the right edge
+    split = [(row, 8) for row in range(size - 1, size - 8, -1)] + [(8, column) for column in range(size - 8, size)]
+
+    return tuple(row * size + column for row, column in top_left), tuple(row * size + column for row, column in split)
+
+
+@lru_cache(maxsize=None)
+def version_positions(size: int) -> tuple[tuple[int, ...], tuple[int, ...]]:
+    """
+    :param size: The number of modules along each side
+    :type size: int
+    :return: The flat index of each version bit, most significant first, for the bottom left block and for the top right block
+    :rtype: tuple[tuple[int, ...], tuple[int, ...]]
+    """
+
+    bits = range(17, -1, -1)
+
+    bottom_left = tuple((size - 11 + bit % 3) * size + bit // 3 for bit in bits)
+    top_right = tuple((bit // 3) * size + size - 11 + bit % 3 for bit in bits)
+
+    return bottom_left, top_right
+
+
+def read_bits(modules: bytes, positions: tuple[int, ...]) -> int:
+    """
+    :param modules: The modules, row by row
+    :type modules: bytes
+    :param positions: Flat indices, most significant bit first
+    :type positions: tuple[int, ...]
+    :return: The bits stored at the positions, with 1 for dark modules
+    :rtype: int
+    """
+
+    value = 0
+    for position in positions:
+        value = (value << 1) | (modules[position] ^ 1)
+
+    return value
+
+
+def read_format(modules: bytes, size: int) -> tuple[str, int]:
+    """
+    :param modules: The modules, row by row
+    :type modules: bytes
+    :param size: The number of modules along each side
+    :type size: int
+    :return: The EC level and mask, from whichever copy of the format information is readable
+    :rtype: tuple[str, int]
+    """
+
+    first, second = (read_bits(modules, positions) for positions in format_positions(size))
+
+    try:
+        return nearest_code(first, FORMAT_CODES)
+    except ValueError:
+        return nearest_code(second, FORMAT_CODES)
+
+
+def read_version(modules: bytes, size: int) -> int:
+    """
+    :param modules: The modules, row by row
+    :type modules: bytes
+    :param size: The number of modules along each side
+    :type size: int
+    :return: The version. Versions 7 and up also store it in the version information, which must agree with the size
+    :rtype: int
+    """
+
+    if size < 21 or size > 177 or (size - 17) % 4:
+        raise ValueError(f"{size} modules is not the size of any QR code version.")
+
+    version = (size - 17) // 4
+    if version < 7:
+        return version
+
+    for positions in version_positions(size):
+        try:
+            stored = nearest_code(read_bits(modules, positions), VERSION_CODES)
+        except ValueError:
+            continue
+
+        if stored != version:
+            raise ValueError(f"The version information says version {stored}, but the QR code is the size of version {version}.")
+        return version
+
+    raise ValueError("Neither copy of the version information can be read.")
+
+
+#################################
+# Data Modules
+#################################
+
+# Mask conditions from the specification, true where the module is flipped
+# Written out again rather than taken from qr_spec.MASK_CONDITIONS, which the encoder uses, so a wrong mask in the encoder cannot go unnoticed
+MASK_CONDITIONS = (
+    lambda row, column: (row + column) % 2 == 0,
+    lambda row, column: row % 2 == 0,
+    lambda row, column: column % 3 == 0,
+    lambda row, column: (row + column) % 3 == 0,
+    lambda row, column: (row // 2 + column // 3) % 2 == 0,
+    lambda row, column: (row * column) % 2 + (row * column) % 3 == 0,
+    lambda row, column: ((row * column) % 2 + (row * column) % 3) % 2 == 0,
+    lambda row, column: ((row + column) % 2 + (row * column) % 3) % 2 == 0,
+)
+
+# Converts module bytes into ASCII digits so int(..., 2) can pack them
+_MODULE_TO_DIGIT = bytes.maketrans(b'\x00\x01', b'01')
+
+
+@lru_cache(maxsize=None)
+def function_modules(version: int) -> bytes:
+    """
+    :param version: The QR code's version
+    :type version: int
+    :return: size * size flags, 1 for the finder, timing and alignment patterns, the format and version information and the dark module
+    :rtype: bytes
+    """
+
+    size = qr_spec.SIZES[version]
+    flags = bytearray(size * size)
+
+    def fill(top: int, left: int, height: int, width: int) -> None:
+        for row in range(top, top + height):
+            flags[row * size + left:row * size + left + width] = b'\x01' * width
+
+    # Finder patterns with their separators and the format information next to them. The dark module is in the bottom left area
+    fill(0, 0, 9, 9)
+    fill(0, size - 8, 9, 8)
+    fill(size - 8, 0, 8, 9)
+
+    # Timing patterns
+    fill(6, 0, 1, size)
+    fill(0, 6, size, 1)
+
+    # Alignment patterns, except where they would overlap the finder patterns
+    centres = qr_spec.ALIGNMENT_POSITIONS[version]
+    if centres:
+        first, last = centres[0], centres[-1]
+        for row, column in product(centres, repeat=2):
+            if (row, column) not in ((first, first), (first, last), (last, first)):
+                fill(row - 2, column - 2, 5, 5)
+
+    if version >= 7:
+        fill(size - 11, 0, 3, 6)
+        fill(0, size - 11, 6, 3)
+
+    return bytes(flags)
+
+
+@lru_cache(maxsize=None)
+def data_positions(version: int) -> tuple[int, ...]:
+    """
+    :param version: The QR code's version
+    :type version: int
+    :return: The flat index of every data module, in the order the bits are read: up and down 2-module wide columns from the bottom right
+    :rtype: tuple[int, ...]
+    """
+
+    size = qr_spec.SIZES[version]
+    flags = function_modules(version)
+    positions = []
+
+    # Column pairs from the right edge, skipping the vertical timing pattern in column 6
+    pair_columns = [column for column in range(size - 1, 0, -2) if column > 6] + [column for column in range(5, 0, -2)]
+
+    for i, right in enumerate(pair_columns):
+        rows = range(size - 1, -1, -1) if i % 2 == 0 else range(size)
+        for row in rows:
+            for column in (right, right - 1):
+                if not flags[row * size + column]:
+                    positions.append(row * size + column)
+
+    return tuple(positions)
+
+
+@lru_cache(maxsize=None)
+def unmask_word(version: int, mask: int) -> int:
+    """
+    Returns the value to XOR with the packed data modules (1 for light) to undo the mask and turn them into data bits (1 for dark)
+
+    :param version: The QR code's version
+    :type version: int
+    :param mask: The mask (0-7)
+    :type mask: int
+    :return: The mask over the data modules in reading order, with every bit inverted
+    :rtype: int
+    """
+
+    size = qr_spec.SIZES[version]
+    condition = MASK_CONDITIONS[mask]
+
+    digits = ''.join('0' if condition(*divmod(position, size)) else '1' for position in data_positions(version))
+
+    return int(digits, 2)
+
+
+def read_codewords(modules: bytes, version: int, mask: int) -> bytes:
+    """
+    :param modules: The modules, row by row
+    :type modules: bytes
+    :param version: The QR code's version
+    :type version: int
+    :param mask: The mask that was applied
+    :type mask: int
+    :return: Every codeword in the order they were placed, still interleaved. The remainder bits are dropped
+    :rtype: bytes
+    """
+
+    positions = data_positions(version)
+    packed = int(bytes(map(modules.__getitem__, positions)).translate(_MODULE_TO_DIGIT), 2) ^ unmask_word(version, mask)
+
+    num_of_codewords = len(positions) // 8
+
+    return (packed >> (len(positions) - num_of_codewords * 8)).to_bytes(num_of_codewords, 'big')
+
+
+#################################
+# Error Correction
+#################################
+
+def split_blocks(codewords: bytes, version: int, ec_level: str) -> list[tuple[bytes, bytes]]:
+    """
+    Undoes the interleaving: the nth codeword of every block was placed together, data codewords first
+
+    :param codewords: The codewords as read from the matrix
+    :type codewords: bytes
+    :param version: The QR code's version
+    :type version: int
+    :param ec_level: The EC level
+    :type ec_level: str
+    :return: The data codewords and the error correction codewords of each block
+    :rtype: list[tuple[bytes, bytes]]
+    """
+
+    num_ec, g1_blocks, g1_size, g2_blocks, g2_size = qr_spec.BLOCK_STRUCTURE[version][qr_spec.EC_INDEX[ec_level]]
+    num_blocks = g1_blocks + g2_blocks
+    num_data = g1_blocks * g1_size + g2_blocks * g2_size
+
+    # Every block has g1_size codewords interleaved together, then only group 2's blocks have one more each
+    short_end = num_blocks * g1_size
+    blocks = []
+
+    for i in range(num_blocks):
+        data = codewords[i:short_end:num_blocks]
+        if i >= g1_blocks:
+            data += codewords[short_end + i - g1_blocks:short_end + i - g1_blocks + 1]
+
+        blocks.append((data, codewords[num_data + i:num_data + num_blocks * num_ec:num_blocks]))
+
+    return blocks
+
+
+@lru_cache(maxsize=None)
+def codeword_locations(version: int, ec_level: str) -> tuple[tuple[int, int], ...]:
+    """
+    :param version: The QR code's version
+    :type version: int
+    :param ec_level: The EC level
+    :type ec_level: str
+    :return: For every codeword in the order they were placed, the block it belongs to and its position in that block
+    :rtype: tuple[tuple[int, int], ...]
+    """
+
+    num_ec, g1_blocks, g1_size, g2_blocks, g2_size = qr_spec.BLOCK_STRUCTURE[version][qr_spec.EC_INDEX[ec_level]]
+    num_blocks = g1_blocks + g2_blocks
+    short_end = num_blocks * g1_size
+
+    locations = [(k % num_blocks, k // num_blocks) for k in range(short_end)]
+    locations += [(g1_blocks + i, g1_size) for i in range(g2_blocks)]
+    locations += [(k % num_blocks, (g1_size if k % num_blocks < g1_blocks else g2_size) + k // num_blocks) for k in range(num_blocks * num_ec)]
+
+    return tuple(locations)
+
+
+@lru_cache(maxsize=None)
+def module_codewords(version: int) -> dict[int, int]:
+    """
+    :param version: The QR code's version
+    :type version: int
+    :return: The flat index of every data module that holds part of a codeword, and which codeword (in placement order) it holds part of
+    :rtype: dict[int, int]
+    """
+
+    positions = data_positions(version)
+
+    return {position: bit // 8 for bit, position in enumerate(positions[:len(positions) // 8 * 8])}
+
+
+def find_erasures(erased_modules, version: int, ec_level: str) -> list[list[int]]:
+    """
+    Works out which codewords of which blocks are damaged when some modules are known to be unreadable
+
+    :param erased_modules: Flat indices of the damaged modules. Function modules are ignored
+    :type erased_modules: Iterable[int]
+    :param version: The QR code's version
+    :type version: int
+    :param ec_level: The EC level
+    :type ec_level: str
+    :return: The positions of the damaged codewords in each block
+    :rtype: list[list[int]]
+    """
+
+    codewords = module_codewords(version)
+    locations = codeword_locations(version, ec_level)
+
+    structure = qr_spec.BLOCK_STRUCTURE[version][qr_spec.EC_INDEX[ec_level]]
+    erasures = [[] for _ in range(structure[1] + structure[3])]
+
+    for k in {codewords[module] for module in erased_modules if module in codewords}:
+        block, position = locations[k]
+        erasures[block].append(position)
+
+    return erasures
+
+
+def correct_blocks(blocks: list[tuple[bytes, bytes]], erasures: list[list[int]] | None = None) -> tuple[bytes, int]:
+    """
+    :param blocks: The data codewords and the error correction codewords of each block
+    :type blocks: list[tuple[bytes, bytes]]
+    :param erasures: The positions of codewords known to be damaged in each block, see find_erasures. Defaults to None
+    :type erasures: list[list[int]] | None, optional
+    :return: The corrected data codewords of every block joined together, and how many codewords were corrected
+    :rtype: tuple[bytes, int]
+    """
+
+    data_codewords = []
+    corrected = 0
+
+    for i, (data, ec) in enumerate(blocks):
+        num_ec = len(ec)
+
+        # Most blocks have no errors, and checking that is much cheaper than working out the syndromes
+        if reed_solomon.encode(data, num_ec) != ec:
+            block, num_errors = reed_solomon.correct(data + ec, num_ec, erasures[i] if erasures else ())
+            data = bytes(block[:len(data)])
+            corrected += num_errors
+
+        data_codewords.append(data)
+
+    return b''.join(data_codewords), corrected
+
+
+#################################
+# Segments
+#################################
+
+ALPHANUMERIC_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+
+TERMINATOR = '0000'
+
+
+def decode_kanji(value: int) -> str:
+    """
+    :param value: A 13-bit Kanji mode value
+    :type value: int
+    :return: The character it stands for
+    :rtype: str
+    """
+
+    code = (value // 0xC0) << 8 | value % 0xC0
+    code += 0x8140 if code < 0x1F00 else 0xC140
+
+    return code.to_bytes(2, 'big').decode('shift_jis')
+
+
+def parse_segments(data: bytes, version: int) -> list[tuple[str, str | bytes]]:
+    """
+    :param data: The data codewords
+    :type data: bytes
+    :param version: The QR code's version, which sets the character count indicator widths
+    :type version: int
+    :return: A list of (mode indicator, segment data) tuples, in the same form as determine_segments returns them
+    :rtype: list[tuple[str, str | bytes]]
+    """
+
+    bits = format(int.from_bytes(data, 'big'), f'0{len(data) * 8}b')
+    end = len(bits)
+    position = 0
+    segments = []
+
+    # The terminator can be cut short, or left out, when the data fills the QR code
+    while position + 4 <= end:
+        mode = bits[position:position + 4]
+        if mode == TERMINATOR:
+            break
+        if mode not in qr_spec.CHARACTER_COUNT_BITS:
+            raise ValueError(f"Mode indicator {mode} is not supported.")
+
+        count_bits = qr_spec.CHARACTER_COUNT_BITS[mode][version]
+        count = int(bits[position + 4:position + 4 + count_bits], 2)
+        position += 4 + count_bits
+
+        if mode == '0001':
+            length = (count // 3) * 10 + (0, 4, 7)[count % 3]
+        elif mode == '0010':
+            length = (count // 2) * 11 + (count % 2) * 6
+        elif mode == '0100':
+            length = count * 8
+        else:
+            length = count * 13
+
+        if position + length > end:
+            raise ValueError(f"A segment of {count} characters runs past the end of the data.")
+
+        field = bits[position:position + length]
+
+        if mode == '0001':
+            # Groups of 3 digits in 10 bits, with 1 or 2 digits left over in 4 or 7 bits
+            widths = [10] * (count // 3) + ([(0, 4, 7)[count % 3]] if count % 3 else [])
+
+            digits = []
+            start = 0
+            for width in widths:
+                value = int(field[start:start + width], 2)
+                if value >= 10 ** (width // 3):
+                    raise ValueError(f"{value} is not a valid numeric mode group.")
+                digits.append(str(value).zfill(width // 3))
+                start += width
+
+            segment = ''.join(digits)
+
+        elif mode == '0010':
+            # Pairs of characters in 11 bits, with 1 character left over in 6 bits
+            chars = []
+            for start in range(0, (count // 2) * 11, 11):
+                value = int(field[start:start + 11], 2)
+                if value >= 45 * 45:
+                    raise ValueError(f"{value} is not a valid alphanumeric mode pair.")
+                chars.append(ALPHANUMERIC_CHARS[value // 45] + ALPHANUMERIC_CHARS[value % 45])
+            if count % 2:
+                value = int(field[-6:], 2)
+                if value >= 45:
+                    raise ValueError(f"{value} is not a valid alphanumeric mode character.")
+                chars.append(ALPHANUMERIC_CHARS[value])
+
+            segment = ''.join(chars)
+
+        elif mode == '0100':
+            segment = int(field or '0', 2).to_bytes(count, 'big')
+
+        else:
+            segment = ''.join(decode_kanji(int(field[start:start + 13], 2)) for start in range(0, length, 13))
+
+        position += length
+        segments.append((mode, segment))
+
+    return segments
+
+
+#################################
+# Decoding
+#################################
+
+def decode_matrix(matrix: QRMatrix, erased_modules=()) -> DecodedQR:
+    """
+    Reads the data back out of a QR matrix, correcting errors where it can
+    \nDamaged modules that are known about can be passed as erasures. Each damaged codeword then uses up one error correction codeword instead of two
+
+    :param matrix: The QR code, with 0 for dark modules and 1 for light modules
+    :type matrix: QRMatrix
+    :param erased_modules: Flat indices (row * size + column) of modules known to be unreadable. Defaults to none
+    :type erased_modules: Iterable[int], optional
+    :return: The version, EC level, mask and segments that were read, and how many codewords had to be corrected.
+        Raises ValueError if the QR code cannot be read
+    :rtype: DecodedQR
+    """
+
+    modules = bytes(matrix.modules)
+    size = matrix.size
+
+    version = read_version(modules, size)
+    ec_level, mask = read_format(modules, size)
+
+    codewords = read_codewords(modules, version, mask)
+    erasures = find_erasures(erased_modules, version, ec_level) if erased_modules else None
+    data, corrected = correct_blocks(split_blocks(codewords, version, ec_level), erasures)
+
+    return DecodedQR(version, ec_level, mask, parse_segments(data, version), corrected)
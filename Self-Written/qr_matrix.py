@@ -0,0 +1,204 @@
+#########################################################
+# QR Matrix
+# A compact square grid of modules
+#########################################################
+
+# Modules are stored one per byte in a flat bytearray, row by row, using the same values as the rest of the generator:
+# 0 is a dark module and 1 is a light module
+# A second, read-only bytes object marks the function modules (1) that are not part of the data
+
+from collections.abc import Iterator
+
+
+class QRMatrix:
+    """
+    A square matrix of QR code modules stored in a flat bytearray
+
+    Copies share the same storage until one of them is written to (copy-on-write),
+    and the modules are exposed through the buffer protocol as read-only views for zero-copy NumPy access
+    """
+
+    __slots__ = ('size', '_modules', '_function_mask', '_shared')
+
+    def __init__(self, size: int, modules: bytes | bytearray | None = None, function_mask: bytes | None = None):
+        """
+        :param size: The number of modules along each side
+        :type size: int
+        :param modules: size * size module values. Immutable bytes are shared until the first write. Defaults to all dark
+        :type modules: bytes | bytearray, optional
+        :param function_mask: size * size flags, 1 for function modules. Defaults to no function modules
+        :type function_mask: bytes, optional
+        """
+
+        if modules is None:
+            modules = bytearray(size * size)
+        if len(modules) != size * size:
+            raise ValueError(f"Expected {size * size} modules, got {len(modules)}.")
+
+        self.size = size
+        self._function_mask = bytes(size * size) if function_mask is None else function_mask
+
+        # bytes cannot be written to, so they are treated like storage shared with another matrix
+        self._shared = not isinstance(modules, bytearray)
+        self._modules = modules
+
+    @classmethod
+    def from_rows(cls, rows: list[list[int]], function_mask: bytes | None = None) -> 'QRMatrix':
+        """
+        Builds a matrix from a 2D list. None (an unfilled module) is stored as 0
+
+        :param rows: The rows of the matrix
+        :type rows: list[list[int]]
+        :param function_mask: size * size flags, 1 for function modules
+        :type function_mask: bytes, optional
+        :return: A new matrix
+        :rtype: QRMatrix
+        """
+
+        return cls(len(rows), bytearray(module or 0 for row in rows for module in row), function_mask)
+
+    def _ensure_owned(self) -> None:
+        # Copy-on-write: take a private copy of the modules before the first write
+        if self._shared:
+            self._modules = bytearray(self._modules)
+            self._shared = False
+
+    def copy(self) -> 'QRMatrix':
+        """
+        Returns a copy of the matrix. No modules are copied until either matrix is written to
+
+        :return: The copy
+        :rtype: QRMatrix
+        """
+
+        duplicate = QRMatrix.__new__(QRMatrix)
+        duplicate.size = self.size
+        duplicate._modules = self._modules
+        duplicate._function_mask = self._function_mask
+        duplicate._shared = True
+        self._shared = True
+
+        return duplicate
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, QRMatrix):
+            return NotImplemented
+        return self.size == other.size and self._modules == other._modules
+
+    def __repr__(self) -> str:
+        return f"QRMatrix(size={self.size})"
+
+    def __getitem__(self, position: tuple[int, int]) -> int:
+        row, column = position
+        return self._modules[row * self.size + column]
+
+    def __setitem__(self, position: tuple[int, int], value: int) -> None:
+        self._ensure_owned()
+        row, column = position
+        self._modules[row * self.size + column] = value
+
+    @property
+    def modules(self) -> bytes | bytearray | memoryview:
+        """
+        The flat module storage, row by row. Treat it as read-only; use set_modules to write
+        \nWhile the storage is shared with a copy, it is a read-only view, so neither matrix can be changed through the other
+        """
+
+        if self._shared and isinstance(self._modules, bytearray):
+            return memoryview(self._modules).toreadonly()
+        return self._modules
+
+    @property
+    def function_mask(self) -> bytes:
+        """
+        size * size flags, 1 for function modules and reserved areas, 0 for data modules
+        """
+
+        return self._function_mask
+
+    def set_modules(self, modules: bytes | bytearray) -> None:
+        """
+        Replaces every module at once
+
+        :param modules: size * size module values
+        :type modules: bytes | bytearray
+        """
+
+        if len(modules) != self.size * self.size:
+            raise ValueError(f"Expected {self.size * self.size} modules, got {len(modules)}.")
+
+        self._modules = modules
+        self._shared = not isinstance(modules, bytearray)
+
+    def row(self, row: int) -> bytes:
+        """
+        :param row: The row index
+        :type row: int
+        :return: The modules in the row
+        :rtype: bytes
+        """
+
+        start = row * self.size
+        return bytes(self._modules[start:start + self.size])
+
+    def column(self, column: int) -> bytes:
+        """
+        :param column: The column index
+        :type column: int
+        :return: The modules in the column, from top to bottom
+        :rtype: bytes
+        """
+
+        return bytes(self._modules[column::self.size])
+
+    def rows(self) -> Iterator[bytes]:
+        """
+        :return: Every row, from top to bottom
+        :rtype: Iterator[bytes]
+        """
+
+        for row in range(self.size):
+            yield self.row(row)
+
+    def to_list(self) -> list[list[int]]:
+        """
+        :return: The matrix as a 2D list
+        :rtype: list[list[int]]
+        """
+
+        return [list(row) for row in self.rows()]
+
+    def __buffer__(self, flags: int) -> memoryview:
+        # Python 3.12+ buffer protocol. Views are always read-only, see buffer
+        if flags & 1:
+            raise BufferError("QRMatrix buffers are read-only. Write with matrix[row, column] = value or set_modules.")
+        return self.buffer()
+
+    def buffer(self) -> memoryview:
+        """
+        Returns a read-only memoryview of the modules, for example for numpy.frombuffer
+        \nIt is read-only even when the storage is not shared, since a copy made later shares the same storage,
+        and a write through an earlier view would change both matrices
+
+        :return: A read-only view of the modules
+        :rtype: memoryview
+        """
+
+        return memoryview(self._modules).toreadonly()
+
+    def __array__(self, dtype=None, copy=None):
+        # NumPy interop: np.asarray(matrix) is a read-only (size, size) uint8 view of the modules
+        # As NumPy 2 expects, copy=True always copies and copy=False raises if a copy cannot be avoided
+        import numpy as np
+
+        array = np.frombuffer(self.buffer(), dtype=np.uint8).reshape(self.size, self.size)
+        if dtype is not None and np.dtype(dtype) != array.dtype:
+            if copy is False:
+                raise ValueError(f"A {np.dtype(dtype)} array of a QRMatrix cannot be made without a copy.")
+            return array.astype(dtype)
+        if copy:
+            return array.copy()
+        return array
@@ -0,0 +1,436 @@
+#########################################################
+# QR Code HTTP Service
+# GET /qr?data=...&ec=...&scale=... returns an image, GET /metrics returns counters
+#########################################################
+
+# A small HTTP/1.1 server built on asyncio streams, so it needs nothing outside the standard library
+# The event loop only parses requests and writes responses. Encoding and rendering are CPU-bound, so they run in a pool of worker processes
+#
+# Requests are answered in the cheapest way possible:
+#   1. The ETag depends only on the request, so a client that already has the image gets 304 Not Modified without anything being rendered
+#   2. Recently served images are kept in an LRU cache in this process
+#   3. With a disk cache, images made earlier are memory mapped and written to the socket without being copied
+#   4. Identical requests that arrive while an image is being made wait for the same result instead of making it again
+#   5. Anything else is sent to a worker process
+
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import Executor
+import hashlib
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import qr_cache
+import qr_spec
+
+
+CONTENT_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml', 'pdf': 'application/pdf'}
+
+STATUS_REASONS = {
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Content Too Large',
+    414: 'URI Too Long',
+    431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error',
+}
+
+# The longest payload any QR code can hold (numeric mode, version 40, EC level L)
+MAX_DATA_LENGTH = 7089
+MAX_SCALE = 32
+MAX_BORDER = 16
+
+# Payloads are sent in the query string, so the request line must have room for the longest one percent-encoded
+# No payload that fits in a QR code is longer than MAX_DATA_LENGTH bytes in UTF-8 (Kanji: 1817 characters of 3 bytes, byte mode: 2953 bytes),
+# and percent-encoding makes each byte at most 3 characters. The rest is for the path, the other parameters and the HTTP version
+MAX_REQUEST_LINE_BYTES = MAX_DATA_LENGTH * 3 + 1024
+
+# The header lines together, not counting the request line
+MAX_HEADER_BYTES = 16 * 1024
+
+# Request bodies are read and thrown away, so only small ones are accepted
+MAX_BODY_BYTES = 16 * 1024
+
+# Upper bounds of the request latency histogram, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# The same request always gives the same image, so clients and proxies may keep it for as long as they like
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class _HeadTooLarge(Exception):
+    # Raised while a request line or the headers are over their limits, with the status to answer with
+    def __init__(self, status: int, message: bytes):
+        super().__init__(status)
+        self.status = status
+        self.message = message
+
+
+class Metrics:
+    """
+    Counters for /metrics, in the Prometheus text format
+    """
+
+    def __init__(self):
+        self.requests: dict[tuple[str, int], int] = {}
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.renders = 0
+        self.render_errors = 0
+        self.coalesced = 0
+        self.disk_hits = 0
+        self.not_modified = 0
+        self.in_flight = 0
+
+    def observe(self, path: str, status: int, seconds: float) -> None:
+        """
+        :param path: The route that was requested
+        :type path: str
+        :param status: The status code of the response
+        :type status: int
+        :param seconds: How long the request took
+        :type seconds: float
+        """
+
+        key = (path, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.latency_buckets[i] += 1
+        self.latency_count += 1
+        self.latency_sum += seconds
+
+    def render(self, cache: qr_cache.LRUCache) -> str:
+        """
+        :param cache: The image cache, whose counters are included
+        :type cache: qr_cache.LRUCache
+        :return: Every metric in the Prometheus text format
+        :rtype: str
+        """
+
+        lines = ['# TYPE qr_requests_total counter']
+        lines += [f'qr_requests_total{{path="{path}",status="{status}"}} {count}' for (path, status), count in sorted(self.requests.items())]
+
+        lines.append('# TYPE qr_request_duration_seconds histogram')
+        lines += [f'qr_request_duration_seconds_bucket{{le="{bound}"}} {count}' for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets)]
+        lines.append(f'qr_request_duration_seconds_bucket{{le="+Inf"}} {self.latency_count}')
+        lines.append(f'qr_request_duration_seconds_sum {self.latency_sum:.6f}')
+        lines.append(f'qr_request_duration_seconds_count {self.latency_count}')
+
+        stats = cache.stats()
+        for name, kind, value in (
+            ('qr_renders_total', 'counter', self.renders),
+            ('qr_render_errors_total', 'counter', self.render_errors),
+            ('qr_coalesced_total', 'counter', self.coalesced),
+            ('qr_disk_hits_total', 'counter', self.disk_hits),
+            ('qr_not_modified_total', 'counter', self.not_modified),
+            ('qr_renders_in_flight', 'gauge', self.in_flight),
+            ('qr_cache_hits_total', 'counter', stats.hits),
+            ('qr_cache_misses_total', 'counter', stats.misses),
+            ('qr_cache_evictions_total', 'counter', stats.evictions),
+            ('qr_cache_entries', 'gauge', stats.entries),
+            ('qr_cache_bytes', 'gauge', stats.size_bytes),
+        ):
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def parse_query(query: str) -> tuple[str, str, int, int, str]:
+    """
+    Reads the parameters of a /qr request. Raises ValueError if any are missing or out of range
+
+    :param query: The query string, e.g. 'data=hello&ec=Q&scale=8'
+    :type query: str
+    :return: The data, EC level, scale, border and image format. ec defaults to M, scale and border to 4, format to png
+    :rtype: tuple[str, str, int, int, str]
+    """
+
+    params = parse_qs(query, keep_blank_values=True)
+
+    def single(name: str, default: str | None) -> str:
+        values = params.get(name)
+        if not values:
+            if default is None:
+                raise ValueError(f"The '{name}' parameter is required.")
+            return default
+        return values[0]
+
+    data = single('data', None)
+    if len(data) > MAX_DATA_LENGTH:
+        raise ValueError(f"The data is longer than any QR code can hold ({MAX_DATA_LENGTH} characters).")
+
+    ec_level = single('ec', 'M').upper()
+    if ec_level not in qr_spec.EC_LEVELS:
+        raise ValueError(f"Unknown EC level '{ec_level}'. Use one of {', '.join(qr_spec.EC_LEVELS)}.")
+
+    try:
+        scale = int(single('scale', '4'))
+        border = int(single('border', '4'))
+    except ValueError:
+        raise ValueError("scale and border must be whole numbers.") from None
+    if not 1 <= scale <= MAX_SCALE:
+        raise ValueError(f"scale must be between 1 and {MAX_SCALE}.")
+    if not 0 <= border <= MAX_BORDER:
+        raise ValueError(f"border must be between 0 and {MAX_BORDER}.")
+
+    file_format = single('format', 'png').lower()
+    if file_format not in CONTENT_TYPES:
+        raise ValueError(f"Unknown format '{file_format}'. Use one of {', '.join(CONTENT_TYPES)}.")
+
+    return data, ec_level, scale, border, file_format
+
+
+def make_etag(key: tuple) -> str:
+    """
+    :param key: The request parameters
+    :type key: tuple
+    :return: A strong ETag for the image. It only changes with the parameters, or when qr_cache.DISK_FORMAT_VERSION changes
+    :rtype: str
+    """
+
+    return '"' + hashlib.sha256(repr((qr_cache.DISK_FORMAT_VERSION, key)).encode('utf-8')).hexdigest()[:32] + '"'
+
+
+class QRService:
+    """
+    Answers HTTP requests for QR code images, rendering them in an executor
+    """
+
+    def __init__(self, render: Callable[[str, str, int, int, str], bytes], executor: Executor, cache_entries: int | None = 4096,
+                 cache_bytes: int | None = 256 * 1024 * 1024, keep_alive_timeout: float = 15.0, disk: qr_cache.DiskCache | None = None):
+        """
+        :param render: Makes an image as render(data, ec_level, scale, border, file_format). It runs in the executor, so it must be picklable for a process pool
+        :type render: Callable[[str, str, int, int, str], bytes]
+        :param executor: Where images are rendered, usually a ProcessPoolExecutor
+        :type executor: Executor
+        :param cache_entries: The most images to keep in this process, or None for no limit. Defaults to 4096
+        :type cache_entries: int | None, optional
+        :param cache_bytes: The most bytes of images to keep in this process, or None for no limit. Defaults to 256 MiB
+        :type cache_bytes: int | None, optional
+        :param keep_alive_timeout: Seconds an idle connection is kept open. Defaults to 15
+        :type keep_alive_timeout: float, optional
+        :param disk: The disk cache the workers write their images to, so they can be served from here without asking a worker. Defaults to None
+        :type disk: qr_cache.DiskCache | None, optional
+        """
+
+        self.render = render
+        self.executor = executor
+        self.cache = qr_cache.LRUCache(cache_entries, cache_bytes)
+        self.keep_alive_timeout = keep_alive_timeout
+        self.disk = disk
+        self.metrics = Metrics()
+
+        # Images being made right now, so identical requests can wait for the same one
+        self._in_flight: dict[tuple, asyncio.Future] = {}
+
+    async def image(self, key: tuple) -> bytes | memoryview:
+        """
+        :param key: The data, EC level, scale, border and image format
+        :type key: tuple
+        :return: The image, from the cache, from the disk cache as a view of the mapped file, from a render that is already running, or from a new render
+        :rtype: bytes | memoryview
+        """
+
+        image = self.cache.get(key)
+        if image is not None:
+            return image
+
+        # Mapping a file that is in the page cache takes microseconds, so it is done here rather than in the executor
+        # The view is not added to self.cache, since each open map holds a file descriptor. It is unmapped once the response is written
+        if self.disk is not None:
+            stored = self.disk.get(qr_cache.render_key(*key), '.' + key[4])
+            if stored is not None:
+                self.metrics.disk_hits += 1
+                return stored
+
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, self.render, *key)
+            self._in_flight[key] = future
+            self.metrics.renders += 1
+            self.metrics.in_flight += 1
+            future.add_done_callback(lambda done: self._finish_render(key, done))
+        else:
+            self.metrics.coalesced += 1
+
+        # Shielded, so a client that disconnects does not cancel the render for everyone else waiting on it
+        return await asyncio.shield(future)
+
+    def _finish_render(self, key: tuple, future: asyncio.Future) -> None:
+        self._in_flight.pop(key, None)
+        self.metrics.in_flight -= 1
+
+        if future.cancelled() or future.exception() is not None:
+            self.metrics.render_errors += 1
+            return
+
+        image = future.result()
+        self.cache.put(key, image, len(image))
+
+    async def respond(self, method: str, target: str, headers: dict[str, str]) -> tuple[int, dict[str, str], bytes | memoryview, str]:
+        """
+        :param method: The request method
+        :type method: str
+        :param target: The request target, e.g. '/qr?data=hello'
+        :type target: str
+        :param headers: The request headers, with lower case names
+        :type headers: dict[str, str]
+        :return: The status code, the response headers, the body, and the route for the metrics
+        :rtype: tuple[int, dict[str, str], bytes | memoryview, str]
+        """
+
+        url = urlsplit(target)
+        path = url.path if url.path in ('/qr', '/metrics') else 'other'
+
+        if path == 'other':
+            return 404, {'Content-Type': 'text/plain; charset=utf-8'}, b'Not found\n', path
+        if method not in ('GET', 'HEAD'):
+            return 405, {'Content-Type': 'text/plain; charset=utf-8', 'Allow': 'GET, HEAD'}, b'Only GET and HEAD are allowed\n', path
+
+        if path == '/metrics':
+            return 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}, self.metrics.render(self.cache).encode('utf-8'), path
+
+        try:
+            key = parse_query(url.query)
+        except ValueError as error:
+            return 400, {'Content-Type': 'text/plain; charset=utf-8'}, f"{error}\n".encode('utf-8'), path
+
+        etag = make_etag(key)
+        response_headers = {'ETag': etag, 'Cache-Control': CACHE_CONTROL}
+
+        if etag in (tag.strip() for tag in headers.get('if-none-match', '').split(',')):
+            self.metrics.not_modified += 1
+            return 304, response_headers, b'', path
+
+        try:
+            image = await self.image(key)
+        except qr_spec.DataTooLongError as error:
+            # Data that does not fit is the client's mistake. Anything else raised by the executor is the server's, and becomes a 500
+            return 400, {'Content-Type': 'text/plain; charset=utf-8'}, f"The QR code cannot be made: {error}\n".encode('utf-8'), path
+
+        response_headers['Content-Type'] = CONTENT_TYPES[key[4]]
+        return 200, response_headers, image, path
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serves requests on one connection until the client closes it, asks to close it, or leaves it idle for too long
+
+        :param reader: The connection's reader
+        :type reader: asyncio.StreamReader
+        :param writer: The connection's writer
+        :type writer: asyncio.StreamWriter
+        """
+
+        try:
+            while True:
+                try:
+                    request_line, header_lines = await asyncio.wait_for(self._read_head(reader), self.keep_alive_timeout)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except _HeadTooLarge as error:
+                    await self._send(writer, error.status, {'Content-Type': 'text/plain; charset=utf-8'}, error.message, False, False)
+                    return
+
+                started = time.perf_counter()
+
+                try:
+                    method, target, version = request_line.split(' ')
+
+                    headers = {}
+                    for line in header_lines:
+                        name, _, value = line.partition(':')
+                        if name:
+                            headers[name.strip().lower()] = value.strip()
+
+                    length = int(headers.get('content-length') or 0)
+                    if length < 0:
+                        raise ValueError("Negative Content-Length")
+                except ValueError:
+                    await self._send(writer, 400, {'Content-Type': 'text/plain; charset=utf-8'}, b'Malformed request\n', False, False)
+                    return
+
+                # The body is not read, so the connection is closed instead of being left in the middle of it
+                if length > MAX_BODY_BYTES:
+                    await self._send(writer, 413, {'Content-Type': 'text/plain; charset=utf-8'}, b'Request body too large\n', False, False)
+                    return
+
+                # Bodies are not used, but have to be read so the next request on the connection starts in the right place
+                if length:
+                    await reader.readexactly(length)
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+                try:
+                    status, response_headers, body, path = await self.respond(method, target, headers)
+                except Exception:
+                    status, response_headers, body, path = 500, {'Content-Type': 'text/plain; charset=utf-8'}, b'Internal server error\n', 'other'
+
+                await self._send(writer, status, response_headers, body, keep_alive, method == 'HEAD')
+                self.metrics.observe(path, status, time.perf_counter() - started)
+
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+        finally:
+            writer.close()
+
+    async def _read_head(self, reader: asyncio.StreamReader) -> tuple[str, list[str]]:
+        # Reads the request line and the header lines one line at a time, so the request line and the headers have separate limits
+        # The reader's own limit is MAX_REQUEST_LINE_BYTES, so no single line can be longer than that
+        try:
+            request_line = await reader.readuntil(b'\r\n')
+        except asyncio.LimitOverrunError:
+            raise _HeadTooLarge(414, b'Request target too long\n') from None
+
+        header_lines = []
+        header_bytes = 0
+
+        while True:
+            try:
+                line = await reader.readuntil(b'\r\n')
+            except asyncio.LimitOverrunError:
+                raise _HeadTooLarge(431, b'Request headers too large\n') from None
+
+            if line == b'\r\n':
+                return request_line[:-2].decode('iso-8859-1'), header_lines
+
+            header_bytes += len(line)
+            if header_bytes > MAX_HEADER_BYTES:
+                raise _HeadTooLarge(431, b'Request headers too large\n')
+
+            header_lines.append(line[:-2].decode('iso-8859-1'))
+
+    async def _send(self, writer: asyncio.StreamWriter, status: int, headers: dict[str, str], body: bytes | memoryview, keep_alive: bool, head_only: bool) -> None:
+        lines = [f'HTTP/1.1 {status} {STATUS_REASONS.get(status, "")}']
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        lines.append(f'Content-Length: {len(body)}')
+        lines.append('Connection: ' + ('keep-alive' if keep_alive else 'close'))
+
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('iso-8859-1'))
+        if not head_only and body:
+            writer.write(body)
+        await writer.drain()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8080) -> None:
+        """
+        Accepts connections until the task is cancelled
+
+        :param host: The address to listen on. Defaults to '127.0.0.1'
+        :type host: str, optional
+        :param port: The port to listen on. Defaults to 8080
+        :type port: int, optional
+        """
+
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_REQUEST_LINE_BYTES, reuse_address=True)
+
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,356 @@
+#########################################################
+# Reed-Solomon Error Correction
+# https://www.thonky.com/qr-code-tutorial/error-correction-coding
+#########################################################
+
+from functools import lru_cache
+
+import galois_field as gf
+
+# QR codes only ever use between 7 and 30 error correction codewords per block
+QR_EC_CODEWORD_COUNTS = range(7, 31)
+
+
+#################################
+# Generator Polynomials
+#################################
+
+# Registry of generator polynomials keyed by degree (the number of EC codewords)
+# Each polynomial is stored as bytes of integer coefficients, highest power of x first,
+# so the leading coefficient is always 1
+_generator_polynomials: dict[int, bytes] = {0: b'\x01'}
+
+
+def generator_polynomial(degree: int) -> bytes:
+    """
+    Returns the generator polynomial (x - a^0)(x - a^1)...(x - a^(degree-1)), computing and memoising it if needed
+
+    :param degree: The number of error correction codewords the polynomial generates
+    :type degree: int
+    :return: The integer coefficients of the polynomial, starting with the highest power of x
+    :rtype: bytes
+    """
+
+    polynomial = _generator_polynomials.get(degree)
+    if polynomial is not None:
+        return polynomial
+
+    if degree < 0:
+        raise ValueError("The generator polynomial degree cannot be negative.")
+
+    # Build on the largest polynomial that has already been computed
+    known_degree = max(d for d in _generator_polynomials if d < degree)
+    coefficients = bytearray(_generator_polynomials[known_degree])
+
+    for i in range(known_degree, degree):
+        # Multiply by (x - a^i). Subtraction is XOR, so this is (x + a^i)
+        root = gf.EXP[i]
+        coefficients.append(0)
+        for j in range(len(coefficients) - 1, 0, -1):
+            coefficients[j] ^= gf.MUL[coefficients[j - 1]][root]
+
+        _generator_polynomials[i + 1] = bytes(coefficients)
+
+    return _generator_polynomials[degree]
+
+
+def precompute_generator_polynomials(degrees=QR_EC_CODEWORD_COUNTS) -> None:
+    """
+    Fills the registry with the generator polynomials for every given degree
+
+    :param degrees: The degrees to compute. Defaults to every EC codeword count used by QR codes
+    :type degrees: Iterable[int]
+    """
+
+    for degree in degrees:
+        generator_polynomial(degree)
+
+
+precompute_generator_polynomials()
+
+
+#################################
+# Encoding
+#################################
+
+# For each degree, the generator polynomial (without its leading 1) multiplied by every possible feedback byte
+# Each product is packed into a single integer so one XOR updates the whole shift register
+_feedback_tables: dict[int, tuple[int, ...]] = {}
+
+
+def _feedback_table(degree: int) -> tuple[int, ...]:
+    """
+    Returns the 256 packed products of the generator polynomial's lower terms with every feedback byte
+
+    :param degree: The number of error correction codewords
+    :type degree: int
+    :return: Entry f is the generator polynomial's lower coefficients multiplied by f, packed big-endian into an integer
+    :rtype: tuple[int, ...]
+    """
+
+    table = _feedback_tables.get(degree)
+    if table is not None:
+        return table
+
+    lower_terms = generator_polynomial(degree)[1:]
+    table = tuple(int.from_bytes(bytes(gf.MUL[f][c] for c in lower_terms), 'big') for f in range(256))
+    _feedback_tables[degree] = table
+
+    return table
+
+
+def encode(data: bytes, num_ec_codewords: int) -> bytes:
+    """
+    Returns the error correction codewords for a single block of data codewords
+
+    This is the remainder of the message polynomial divided by the generator polynomial,
+    computed with a linear feedback shift register instead of long division
+
+    :param data: The data codewords of the block
+    :type data: bytes | bytearray | list[int]
+    :param num_ec_codewords: How many error correction codewords to generate
+    :type num_ec_codewords: int
+    :return: The error correction codewords
+    :rtype: bytes
+    """
+
+    if num_ec_codewords == 0:
+        return b''
+
+    feedback = _feedback_table(num_ec_codewords)
+    shift = 8 * (num_ec_codewords - 1)
+    register_mask = (1 << (8 * num_ec_codewords)) - 1
+
+    # The register holds the running remainder, highest coefficient in the top byte
+    register = 0
+    for codeword in data:
+        register = ((register << 8) & register_mask) ^ feedback[codeword ^ (register >> shift)]
+
+    return register.to_bytes(num_ec_codewords, 'big')
+
+
+#################################
+# Decoding
+#################################
+
+# The error correction codewords make every block a multiple of the generator polynomial
+# A block that has been damaged is found and repaired from its syndromes: the block evaluated at each root of the generator polynomial
+#
+# Every step works on whole polynomials at once instead of looping over their coefficients:
+#   - a polynomial is packed into an integer, one byte per coefficient, lowest power in the lowest byte
+#   - multiplying every coefficient by the same number is one bytes.translate through that number's row of gf.MUL
+#   - adding polynomials is XOR, and multiplying by x^k is a shift by 8k bits
+#   - evaluating a polynomial at many points is one table lookup per coefficient, XORed together,
+#     since each term's values at every point only depend on its coefficient and power (see _evaluation_table)
+#
+# Codeword j of a block of n codewords is the coefficient of x^(n - 1 - j)
+
+def _root_points(num_ec_codewords: int) -> bytes:
+    # The roots of the generator polynomial: a^0, a^1, ..., a^(num_ec_codewords - 1)
+    return gf.EXP[:num_ec_codewords]
+
+
+@lru_cache(maxsize=None)
+def _position_points(length: int) -> bytes:
+    # The root the error locator has for an error at each position j: the inverse of a^(length - 1 - j)
+    return bytes(gf.EXP[(j + 1 - length) % 255] for j in range(length))
+
+
+@lru_cache(maxsize=1024)
+def _evaluation_table(points: bytes, m: int) -> tuple[int, ...]:
+    """
+    Returns the contribution of a term c x^m to a polynomial's value at every point, for every possible coefficient c
+
+    :param points: The points the polynomial is evaluated at
+    :type points: bytes
+    :param m: The power of x
+    :type m: int
+    :return: Entry c holds c * point^m for every point, packed big-endian in the same order as the points
+    :rtype: tuple[int, ...]
+    """
+
+    column = bytes(gf.EXP[(gf.LOG[point] * m) % 255] for point in points)
+
+    return tuple(int.from_bytes(column.translate(gf.MUL[c]), 'big') for c in range(256))
+
+
+def _evaluate_everywhere(coefficients: bytes, points: bytes) -> int:
+    """
+    :param coefficients: The polynomial, lowest power first
+    :type coefficients: bytes
+    :param points: The points to evaluate it at
+    :type points: bytes
+    :return: The value at every point, packed big-endian in the same order as the points
+    :rtype: int
+    """
+
+    total = 0
+    for m, coefficient in enumerate(coefficients):
+        if coefficient:
+            total ^= _evaluation_table(points, m)[coefficient]
+
+    return total
+
+
+def _scale(polynomial: int, factor: int, width: int) -> int:
+    # Multiplies every coefficient of a packed polynomial by the same number
+    return int.from_bytes(polynomial.to_bytes(width, 'little').translate(gf.MUL[factor]), 'little')
+
+
+def remainder(codewords: bytes, num_ec_codewords: int) -> bytes:
+    """
+    Divides the block by the generator polynomial with the same shift register as encode
+
+    :param codewords: The data codewords followed by the error correction codewords
+    :type codewords: bytes
+    :param num_ec_codewords: How many of the codewords are error correction codewords
+    :type num_ec_codewords: int
+    :return: The remainder, highest power first. It is all zeros if the block has no errors
+    :rtype: bytes
+    """
+
+    split = len(codewords) - num_ec_codewords
+    expected = encode(codewords[:split], num_ec_codewords)
+
+    return (int.from_bytes(expected, 'big') ^ int.from_bytes(codewords[split:], 'big')).to_bytes(num_ec_codewords, 'big')
+
+
+def syndromes(codewords: bytes, num_ec_codewords: int) -> list[int]:
+    """
+    Evaluates the block at a^0, a^1, ..., a^(num_ec_codewords - 1)
+    \nEvery root of the generator polynomial is also a root of the block minus its remainder, so only the remainder is evaluated
+
+    :param codewords: The data codewords followed by the error correction codewords
+    :type codewords: bytes
+    :param num_ec_codewords: How many of the codewords are error correction codewords
+    :type num_ec_codewords: int
+    :return: The syndromes. They are all 0 if the block has no errors
+    :rtype: list[int]
+    """
+
+    # The remainder is stored highest power first, so it is reversed to lowest power first
+    values = _evaluate_everywhere(remainder(codewords, num_ec_codewords)[::-1], _root_points(num_ec_codewords))
+
+    return list(values.to_bytes(num_ec_codewords, 'big'))
+
+
+def correct(codewords: bytes, num_ec_codewords: int, erasures=()) -> tuple[bytearray, int]:
+    """
+    Corrects a block with e wrong codewords and f erasures, as long as 2e + f <= num_ec_codewords
+
+    Berlekamp-Massey finds the error locator polynomial from the syndromes, a Chien search finds its roots
+    (the positions of the errors), and Forney's formula gives the value of each error
+
+    :param codewords: The data codewords followed by the error correction codewords
+    :type codewords: bytes
+    :param num_ec_codewords: How many of the codewords are error correction codewords
+    :type num_ec_codewords: int
+    :param erasures: Positions of codewords known or suspected to be wrong, e.g. from damaged modules. Defaults to none
+    :type erasures: Iterable[int], optional
+    :return: The corrected block, and how many codewords were changed. Raises ValueError if there are too many errors
+    :rtype: tuple[bytearray, int]
+    """
+
+    block = bytearray(codewords)
+    length = len(block)
+
+    if erasures:
+        erasures = sorted(set(erasures))
+        if erasures[0] < 0 or erasures[-1] >= length:
+            raise ValueError(f"Erasure positions must be between 0 and {length - 1}.")
+        if len(erasures) > num_ec_codewords:
+            raise ValueError(f"A block with {num_ec_codewords} error correction codewords cannot fill in {len(erasures)} erasures.")
+
+    excess = remainder(block, num_ec_codewords)
+    if not any(excess):
+        return block, 0
+
+    too_many_errors = f"The block has too many errors to correct with {num_ec_codewords} error correction codewords."
+
+    mul, exp, log = gf.MUL, gf.EXP, gf.LOG
+    num_erasures = len(erasures)
+
+    # Berlekamp-Massey, started from the erasure locator so each erasure only uses up one error correction codeword
+    # Next to each locator it keeps the locator times the syndromes (up to x^(num_ec_codewords - 1)),
+    # so every discrepancy is just one byte of it, and the final one is the error evaluator Forney's formula needs
+    # Both are packed into one integer, the product in the low num_ec_codewords bytes and the locator from byte `gap` up,
+    # with enough zero bytes between them that shifting never carries the product into the locator
+    gap = 2 * num_ec_codewords + 2
+    width = 2 * gap
+    state_mask = ((1 << (8 * num_ec_codewords)) - 1) | -(1 << (8 * gap))
+
+    syndrome = int.from_bytes(_evaluate_everywhere(excess[::-1], _root_points(num_ec_codewords)).to_bytes(num_ec_codewords, 'big'), 'little')
+
+    # The erasure locator is the product of (1 + X x) for every erasure, where X = a^(length - 1 - j)
+    locator = 1
+    for j in erasures:
+        locator ^= _scale(locator, exp[(length - 1 - j) % 255], gap) << 8
+
+    product = 0
+    for m, coefficient in enumerate(locator.to_bytes(num_erasures + 1, 'little')):
+        product ^= _scale(syndrome, coefficient, gap) << (8 * m)
+
+    state = ((locator << (8 * gap)) | product) & state_mask
+    previous, previous_log = state, 0
+    degree, shift = num_erasures, 1
+
+    for n in range(num_erasures, num_ec_codewords):
+        discrepancy = (state >> (8 * n)) & 0xFF
+        if discrepancy == 0:
+            shift += 1
+            continue
+
+        # Subtract (discrepancy / previous discrepancy) * x^shift * the previous locator
+        scaled = int.from_bytes(previous.to_bytes(width, 'little').translate(mul[exp[log[discrepancy] - previous_log + 255]]), 'little')
+        updated = (state ^ (scaled << (8 * shift))) & state_mask
+
+        if 2 * degree <= n + num_erasures:
+            previous, previous_log = state, log[discrepancy]
+            degree = n + 1 + num_erasures - degree
+            shift = 1
+        else:
+            shift += 1
+
+        state = updated
+
+    product = state & ((1 << (8 * num_ec_codewords)) - 1)
+    coefficients = (state >> (8 * gap)).to_bytes(gap, 'little').rstrip(b'\x00')
+    num_errata = len(coefficients) - 1
+    if num_errata > num_ec_codewords or 2 * num_errata - num_erasures > num_ec_codewords:
+        raise ValueError(too_many_errors)
+
+    # Chien search: evaluate the locator at the root for every position at once
+    # The odd powers are kept apart: in GF(256), x times the derivative of the locator is exactly its odd powers
+    points = _position_points(length)
+    odd_coefficients = bytes(c if m % 2 else 0 for m, c in enumerate(coefficients))
+    odd = _evaluate_everywhere(odd_coefficients, points)
+    even = _evaluate_everywhere(bytes(c if m % 2 == 0 else 0 for m, c in enumerate(coefficients)), points)
+
+    values = (even ^ odd).to_bytes(length, 'big')
+    positions = []
+    j = values.find(0)
+    while j != -1:
+        positions.append(j)
+        j = values.find(0, j + 1)
+
+    if len(positions) != num_errata:
+        raise ValueError(too_many_errors)
+
+    # Forney: the value of the error at X is X * evaluator(X^-1) / derivative(X^-1), which is evaluator(X^-1) / odd powers(X^-1)
+    evaluator = _evaluate_everywhere(product.to_bytes(num_ec_codewords, 'little'), points).to_bytes(length, 'big')
+    odd_values = odd.to_bytes(length, 'big')
+
+    changed = 0
+    for j in positions:
+        numerator, denominator = evaluator[j], odd_values[j]
+        if denominator == 0:
+            raise ValueError(too_many_errors)
+
+        if numerator:
+            block[j] ^= exp[log[numerator] - log[denominator] + 255]
+            changed += 1
+
+    if any(remainder(block, num_ec_codewords)):
+        raise ValueError(too_many_errors)
+
+    return block, changed
@@ -0,0 +1,402 @@
+#########################################################
+# Renderers
+# Turn a finished QR matrix into an image or raw bytes
+#########################################################
+
+# Every renderer works in memory and returns its result, or writes into a buffer or file object the caller owns
+# Nothing is written to the filesystem unless the caller passes a file, so codes can be served straight from memory
+# 0 (dark) modules are black and 1 (light) modules are white. By default one module becomes one pixel, with no quiet zone
+# Images are built from packed 1-bit rows, and scaled with byte translation tables, so no pixel is touched in a Python loop
+# Pillow and NumPy are optional, and only needed by the renderers that return their types
+
+from collections.abc import Iterator
+from functools import lru_cache
+from io import BytesIO, StringIO
+import re
+import struct
+from typing import BinaryIO, TextIO
+import zlib
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from qr_matrix import QRMatrix
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+@lru_cache(maxsize=None)
+def _expansion_tables(scale: int) -> tuple[bytes, ...]:
+    """
+    Returns the bytes.translate tables that scale packed rows horizontally
+    \nWhen every pixel is repeated scale times, each byte of 8 pixels becomes scale bytes. Table j maps a byte to the jth of them
+
+    :param scale: How many pixels wide each module becomes
+    :type scale: int
+    :return: scale translation tables
+    :rtype: tuple[bytes, ...]
+    """
+
+    expanded = [int(''.join(bit * scale for bit in format(byte, '08b')), 2).to_bytes(scale, 'big') for byte in range(256)]
+
+    return tuple(bytes(scaled_byte[j] for scaled_byte in expanded) for j in range(scale))
+
+
+def packed_rows(matrix: QRMatrix, scale: int = 1, border: int = 0) -> tuple[int, list[bytes]]:
+    """
+    Packs the QR code into 1-bit rows, 1 for light modules, first module in the highest bit, each row padded to a whole byte
+    \nThe border is a quiet zone of light modules around the code. Each row is scaled horizontally; repeat it scale times to scale vertically
+
+    :param matrix: The finished QR code
+    :type matrix: QRMatrix
+    :param scale: How many pixels wide and high each module becomes. Defaults to 1
+    :type scale: int, optional
+    :param border: How many modules of quiet zone to add on every side. Defaults to 0
+    :type border: int, optional
+    :return: The width of the image in pixels, and one packed row for each row of modules including the border
+    :rtype: tuple[int, list[bytes]]
+    """
+
+    if scale < 1 or border < 0:
+        raise ValueError("The scale must be at least 1 and the border cannot be negative.")
+
+    size = matrix.size
+    width = size + 2 * border
+    row_bytes = (width + 7) // 8
+    padding = bytes(row_bytes * 8 - width)
+
+    # Add the border, and pad every row to a whole number of bytes
+    modules = bytes(matrix.modules)
+    side = b'\x01' * border
+    blank = (b'\x01' * width + padding) * border
+    rows = (side + padding + side).join([modules[i:i + size] for i in range(0, size * size, size)])
+    bordered = blank + side + rows + side + padding + blank
+
+    # Pack 8 modules into each byte: every 8th module becomes the same bit of every byte, so 8 shifts pack all of them
+    packed = sum(int.from_bytes(bordered[k::8], 'big') << (7 - k) for k in range(8)).to_bytes(width * row_bytes, 'big')
+
+    # Scale horizontally by interleaving the translated bytes. The rows get longer, but only the bytes that hold pixels are kept
+    if scale > 1:
+        scaled = bytearray(len(packed) * scale)
+        for j, table in enumerate(_expansion_tables(scale)):
+            scaled[j::scale] = packed.translate(table)
+
+        packed = bytes(scaled)
+        row_bytes *= scale
+
+    pixel_width = width * scale
+    pixel_row_bytes = (pixel_width + 7) // 8
+
+    return pixel_width, [packed[i:i + pixel_row_bytes] for i in range(0, width * row_bytes, row_bytes)]
+
+
+def to_pil(matrix: QRMatrix, scale: int = 1, border: int = 0) -> 'Image.Image':
+    """
+    Renders the QR code as a 1-bit PIL image
+
+    :param matrix: The finished QR code
+    :type matrix: QRMatrix
+    :param scale: How many pixels wide and high each module becomes. Defaults to 1
+    :type scale: int, optional
+    :param border: How many modules of quiet zone to add on every side. Defaults to 0
+    :type border: int, optional
+    :return: The image
+    :rtype: PIL.Image.Image
+    """
+
+    if Image is None:
+        raise Exception("Pillow is needed to render PIL images.")
+
+    width, rows = packed_rows(matrix, scale, border)
+
+    # Repeating a packed row scale times scales it vertically
+    return Image.frombytes('1', (width, width), b''.join([row * scale for row in rows]))
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    # Length, type, data, and a CRC of the type and data
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def to_png(matrix: QRMatrix, scale: int = 1, border: int = 0, compress_level: int = 6) -> bytes:
+    """
+    Renders the QR code as the contents of a 1-bit greyscale PNG file
+    \nThe PNG is written directly with zlib, so Pillow is not needed
+
+    :param matrix: The finished QR code
+    :type matrix: QRMatrix
+    :param scale: How many pixels wide and high each module becomes. Defaults to 1
+    :type scale: int, optional
+    :param border: How many modules of quiet zone to add on every side. Defaults to 0
+    :type border: int, optional
+    :param compress_level: The zlib compression level, from 0 (none) to 9 (smallest). Defaults to 6
+    :type compress_level: int, optional
+    :return: The PNG file
+    :rtype: bytes
+    """
+
+    width, rows = packed_rows(matrix, scale, border)
+
+    # Every row of pixels starts with its filter type, 0 (none), and each row of modules is repeated scale times
+    image_data = b''.join([(b'\x00' + row) * scale for row in rows])
+
+    # Width, height, bit depth 1, colour type 0 (greyscale), default compression, filtering and no interlacing
+    header = struct.pack('>IIBBBBB', width, width, 1, 0, 0, 0, 0)
+
+    return (
+        PNG_SIGNATURE
+        + _png_chunk(b'IHDR', header)
+        + _png_chunk(b'IDAT', zlib.compress(image_data, compress_level))
+        + _png_chunk(b'IEND', b'')
+    )
+
+
+def to_numpy(matrix: QRMatrix):
+    """
+    Renders the QR code as a NumPy array
+
+    :param matrix: The finished QR code
+    :type matrix: QRMatrix
+    :return: A new (size, size) uint8 array, 0 for dark modules and 1 for light modules
+    :rtype: numpy.ndarray
+    """
+
+    if np is None:
+        raise Exception("NumPy is needed to render NumPy arrays.")
+
+    return np.array(matrix, dtype=np.uint8)
+
+
+def packed_size(matrix: QRMatrix) -> int:
+    """
+    :param matrix: The QR code
+    :type matrix: QRMatrix
+    :return: The number of bytes pack_into writes: each row is padded to a whole number of bytes
+    :rtype: int
+    """
+
+    return matrix.size * ((matrix.size + 7) // 8)
+
+
+def pack_into(matrix: QRMatrix, buffer, offset: int = 0) -> int:
+    """
+    Writes the QR code as raw 1-bit rows into a buffer the caller supplies
+    \nThe layout is the same as a raw 1-bit PIL image: 1 for light modules, first module in the highest bit, each row padded with 0s to a whole byte
+
+    :param matrix: The finished QR code
+    :type matrix: QRMatrix
+    :param buffer: Any writable buffer, e.g. a bytearray, memoryview, mmap or NumPy array
+    :type buffer: Buffer
+    :param offset: Where in the buffer to start writing. Defaults to 0
+    :type offset: int, optional
+    :return: The number of bytes written
+    :rtype: int
+    """
+
+    _, rows = packed_rows(matrix)
+    total = sum(len(row) for row in rows)
+
+    view = memoryview(buffer).cast('B')
+    if offset < 0 or offset + total > len(view):
+        raise ValueError(f"The buffer needs {total} bytes from offset {offset}, but is only {len(view)} bytes long.")
+
+    view[offset:offset + total] = b''.join(rows)
+
+    return total
+
+
+def to_packed_bytes(matrix: QRMatrix) -> bytes:
+    """
+    Renders the QR code as raw 1-bit rows, in the same layout as pack_into
+
+    :param matrix: The finished QR code
+    :type matrix: QRMatrix
+    :return: The packed rows
+    :rtype: bytes
+    """
+
+    buffer = bytearray(packed_size(matrix))
+    pack_into(matrix, buffer)
+
+    return bytes(buffer)
+
+
+#################################
+# Vector Output
+#################################
+
+# Each row's dark modules are merged into horizontal runs, so a run of n dark modules costs one short command instead of n rectangles
+# The SVG and PDF are written straight to a file object as they are generated
+
+# A run of dark modules in a row
+DARK_RUN = re.compile(rb'\x00+')
+
+
+def dark_runs(matrix: QRMatrix) -> Iterator[tuple[int, int, int]]:
+    """
+    Finds every horizontal run of dark modules
+
+    :param matrix: The finished QR code
+    :type matrix: QRMatrix
+    :return: (row, column, length) for each run, row by row from the top and left to right
+    :rtype: Iterator[tuple[int, int, int]]
+    """
+
+    for row, modules in enumerate(matrix.rows()):
+        for run in DARK_RUN.finditer(modules):
+            yield row, run.start(), run.end() - run.start()
+
+
+def write_svg(matrix: QRMatrix, file: TextIO, scale: float = 1, border: int = 0, dark: str = '#000', light: str | None = None) -> None:
+    """
+    Writes the QR code as an SVG image with a single path
+    \nEach run of dark modules is drawn as a horizontal line 1 module thick, moving relative to the end of the previous run
+
+    :param matrix: The finished QR code
+    :type matrix: QRMatrix
+    :param file: A text file object to write to
+    :type file: TextIO
+    :param scale: The width and height of each module in pixels. Defaults to 1
+    :type scale: float, optional
+    :param border: How many modules of quiet zone to add on every side. Defaults to 0
+    :type border: int, optional
+    :param dark: The colour of the dark modules. Defaults to '#000'
+    :type dark: str, optional
+    :param light: The background colour, or None for a transparent background. Defaults to None
+    :type light: str | None, optional
+    """
+
+    width = matrix.size + 2 * border
+    pixels = f"{width * scale:g}"
+
+    file.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" viewBox="0 0 {width} {width}" shape-rendering="crispEdges">')
+    if light is not None:
+        file.write(f'<rect width="{width}" height="{width}" fill="{light}"/>')
+
+    file.write(f'<path stroke="{dark}" d="')
+
+    # Lines run through the middle of each row, hence the .5. After the first run, each move is relative to the end of the previous run
+    # Commands are written a row at a time
+    x, y = None, None
+    for row, modules in enumerate(matrix.rows(), start=border):
+        commands = []
+        for run in DARK_RUN.finditer(modules):
+            column, length = border + run.start(), run.end() - run.start()
+            if x is None:
+                commands.append(f"M{column} {row}.5h{length}")
+            else:
+                commands.append(f"m{column - x} {row - y}h{length}")
+            x, y = column + length, row
+
+        file.write(''.join(commands))
+
+    file.write('"/></svg>\n')
+
+
+def to_svg(matrix: QRMatrix, scale: float = 1, border: int = 0, dark: str = '#000', light: str | None = None) -> str:
+    """
+    Renders the QR code as an SVG image, as for write_svg
+
+    :param matrix: The finished QR code
+    :type matrix: QRMatrix
+    :param scale: The width and height of each module in pixels. Defaults to 1
+    :type scale: float, optional
+    :param border: How many modules of quiet zone to add on every side. Defaults to 0
+    :type border: int, optional
+    :param dark: The colour of the dark modules. Defaults to '#000'
+    :type dark: str, optional
+    :param light: The background colour, or None for a transparent background. Defaults to None
+    :type light: str | None, optional
+    :return: The SVG document
+    :rtype: str
+    """
+
+    output = StringIO()
+    write_svg(matrix, output, scale, border, dark, light)
+
+    return output.getvalue()
+
+
+def write_pdf(matrix: QRMatrix, file: BinaryIO, scale: float = 1, border: int = 0, compress: bool = True) -> None:
+    """
+    Writes the QR code as a single page PDF, with each run of dark modules filled as one rectangle
+
+    :param matrix: The finished QR code
+    :type matrix: QRMatrix
+    :param file: A binary file object to write to
+    :type file: BinaryIO
+    :param scale: The width and height of each module in points (1/72 inch). Defaults to 1
+    :type scale: float, optional
+    :param border: How many modules of quiet zone to add on every side. Defaults to 0
+    :type border: int, optional
+    :param compress: Whether to compress the drawing commands with zlib. Defaults to True
+    :type compress: bool, optional
+    """
+
+    width = matrix.size + 2 * border
+    page = f"{width * scale:g}"
+
+    # Scale to modules and flip the y axis, so rows count down from the top like the matrix
+    commands = [f"{scale:g} 0 0 {-scale:g} 0 {page} cm\n"]
+    commands += [f"{border + column} {border + row} {length} 1 re\n" for row, column, length in dark_runs(matrix)]
+    commands.append("f\n")
+
+    content = ''.join(commands).encode('ascii')
+    if compress:
+        content = zlib.compress(content)
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page} {page}] /Contents 4 0 R >>".encode('ascii'),
+        f"<< /Length {len(content)}{' /Filter /FlateDecode' if compress else ''} >>\nstream\n".encode('ascii') + content + b"\nendstream",
+    ]
+
+    # The cross-reference table needs the byte offset of every object, so count the bytes as they are written
+    header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    file.write(header)
+    written = len(header)
+
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(written)
+
+        obj = f"{number} 0 obj\n".encode('ascii') + body + b"\nendobj\n"
+        file.write(obj)
+        written += len(obj)
+
+    xref = [f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"]
+    xref += [f"{offset:010d} 00000 n \n" for offset in offsets]
+    xref.append(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{written}\n%%EOF\n")
+
+    file.write(''.join(xref).encode('ascii'))
+
+
+def to_pdf(matrix: QRMatrix, scale: float = 1, border: int = 0, compress: bool = True) -> bytes:
+    """
+    Renders the QR code as a single page PDF, as for write_pdf
+
+    :param matrix: The finished QR code
+    :type matrix: QRMatrix
+    :param scale: The width and height of each module in points (1/72 inch). Defaults to 1
+    :type scale: float, optional
+    :param border: How many modules of quiet zone to add on every side. Defaults to 0
+    :type border: int, optional
+    :param compress: Whether to compress the drawing commands with zlib. Defaults to True
+    :type compress: bool, optional
+    :return: The PDF file
+    :rtype: bytes
+    """
+
+    output = BytesIO()
+    write_pdf(matrix, output, scale, border, compress)
+
+    return output.getvalue()
@@ -0,0 +1,111 @@
+#########################################################
+# QR Decoder and verify
+# Checks that generated QR codes read back as their data, and that damaged ones fail verification
+#########################################################
+
+import importlib.util
+from pathlib import Path
+import sys
+
+import pytest
+
+SOURCE_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(SOURCE_DIR))
+
+import qr_decoder
+import qr_spec
+
+# qr-code.py cannot be imported by name, so it is loaded from its path
+_spec = importlib.util.spec_from_file_location('qr_code', SOURCE_DIR / 'qr-code.py')
+qr_code = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(qr_code)
+
+
+PAYLOADS = {
+    'numeric': '0123456789' * 12,
+    'alphanumeric': 'HELLO WORLD $%*+-./:',
+    'byte': 'https://example.com/?q=café&n=1',
+    'utf-8': 'price: 5€',
+    'kanji': '漢字日本語',
+    'mixed': 'ORDER-0001234567890123/ABCD 漢字 done',
+}
+
+SEGMENT_MODES = {'numeric': {'0001'}, 'alphanumeric': {'0010'}, 'byte': {'0100'}, 'kanji': {'1000'}}
+
+
+def encode(data: str, ec_level: str):
+    matrix = qr_code.encode_qr_matrix(data, ec_level, verify=True)
+    return matrix, qr_decoder.decode_matrix(matrix)
+
+
+@pytest.mark.parametrize('ec_level', qr_spec.EC_LEVELS)
+@pytest.mark.parametrize('kind', PAYLOADS)
+def test_round_trip(kind, ec_level):
+    data = PAYLOADS[kind]
+    matrix, decoded = encode(data, ec_level)
+
+    assert decoded.text == data
+    assert decoded.ec_level == ec_level
+    assert decoded.corrected == 0
+    assert qr_spec.SIZES[decoded.version] == matrix.size
+
+    modes = {mode for mode, _ in decoded.segments}
+    if kind in SEGMENT_MODES:
+        assert modes == SEGMENT_MODES[kind]
+    elif kind == 'mixed':
+        assert len(modes) > 1
+
+
+@pytest.mark.parametrize('version', [1, 7, 40])
+def test_round_trip_across_sizes(version):
+    data = 'A' * qr_code.get_max_payload(version, 'M', '0010')
+    matrix, decoded = encode(data, 'M')
+
+    assert decoded.version == version
+    assert decoded.text == data
+
+
+def flip(matrix, position: int) -> None:
+    matrix[divmod(position, matrix.size)] ^= 1
+
+
+def test_single_flipped_format_module_is_corrected():
+    data = PAYLOADS['byte']
+    matrix, decoded = encode(data, 'Q')
+
+    flip(matrix, qr_decoder.format_positions(matrix.size)[0][3])
+
+    qr_code.verify_qr_matrix(matrix, data, decoded.version, decoded.ec_level, decoded.mask)
+
+
+def test_wrong_format_information_fails_verification():
+    data = PAYLOADS['byte']
+    matrix, decoded = encode(data, 'Q')
+
+    # Write the format information of another mask into both copies, so it reads back cleanly but wrongly
+    codes = {info: code for code, info in qr_decoder.FORMAT_CODES.items()}
+    difference = codes[('Q', decoded.mask)] ^ codes[('Q', decoded.mask ^ 1)]
+
+    for positions in qr_decoder.format_positions(matrix.size):
+        assert qr_decoder.read_bits(matrix.modules, positions) == codes[('Q', decoded.mask)]
+
+        for bit, position in enumerate(reversed(positions)):
+            if difference >> bit & 1:
+                flip(matrix, position)
+
+    # The data is then unmasked with the wrong mask, and no longer decodes
+    assert qr_decoder.read_format(matrix.modules, matrix.size) == ('Q', decoded.mask ^ 1)
+    with pytest.raises(Exception, match='cannot be decoded'):
+        qr_code.verify_qr_matrix(matrix, data, decoded.version, decoded.ec_level, decoded.mask)
+
+
+@pytest.mark.parametrize(('num_flipped', 'message'), [(1, 'only decodes after correcting'), (200, 'cannot be decoded')])
+def test_corrupted_data_fails_verification(num_flipped, message):
+    data = PAYLOADS['mixed']
+    matrix, decoded = encode(data, 'L')
+
+    for position in qr_decoder.data_positions(decoded.version)[:num_flipped]:
+        flip(matrix, position)
+
+    with pytest.raises(Exception, match=message):
+        qr_code.verify_qr_matrix(matrix, data, decoded.version, decoded.ec_level, decoded.mask)
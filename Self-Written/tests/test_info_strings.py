@@ -0,0 +1,74 @@
+#########################################################
+# Format and Version Information Tables
+# Checks the precomputed FORMAT_STRINGS and VERSION_STRINGS against the BCH computation and the specification
+#########################################################
+
+import importlib.util
+from pathlib import Path
+import sys
+
+import pytest
+
+SOURCE_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(SOURCE_DIR))
+
+# qr-code.py cannot be imported by name, so it is loaded from its path
+_spec = importlib.util.spec_from_file_location('qr_code', SOURCE_DIR / 'qr-code.py')
+qr_code = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(qr_code)
+
+
+# Published values, from ISO/IEC 18004 Annex C and D (also listed at https://www.thonky.com/qr-code-tutorial/format-version-tables)
+PUBLISHED_FORMAT_STRINGS = {
+    ('L', 0): '111011111000100',
+    ('L', 7): '110100101110110',
+    ('M', 0): '101010000010010',
+    ('M', 5): '100000011001110',
+    ('Q', 2): '011111100110001',
+    ('H', 4): '000011101100010',
+}
+
+PUBLISHED_VERSION_STRINGS = {
+    7: '000111110010010100',
+    8: '001000010110111100',
+    21: '010101011010000011',
+    40: '101000110001101001',
+}
+
+
+def polynomial_remainder(value: int, generator: int) -> int:
+    # Long division of GF(2) polynomials, written out here so the check does not depend on galois_field
+    while value.bit_length() >= generator.bit_length():
+        value ^= generator << (value.bit_length() - generator.bit_length())
+    return value
+
+
+def test_format_strings_match_bch_computation():
+    assert len(qr_code.FORMAT_STRINGS) == 32
+
+    for (ec_level, mask), format_string in qr_code.FORMAT_STRINGS.items():
+        assert format_string == qr_code.compute_format_string(ec_level, mask)
+
+        # Unmasked, every format string is a code word of the (15, 5) BCH code
+        assert polynomial_remainder(int(format_string, 2) ^ 0b101010000010010, 0b10100110111) == 0
+
+
+def test_version_strings_match_bch_computation():
+    assert qr_code.VERSION_STRINGS[:7] == ('',) * 7
+
+    for version in range(7, 41):
+        version_string = qr_code.VERSION_STRINGS[version]
+
+        assert version_string == qr_code.compute_version_string(version)
+        assert int(version_string[:6], 2) == version
+        assert polynomial_remainder(int(version_string, 2), 0b1111100100101) == 0
+
+
+@pytest.mark.parametrize(('ec_level', 'mask'), PUBLISHED_FORMAT_STRINGS)
+def test_format_strings_match_specification(ec_level, mask):
+    assert qr_code.FORMAT_STRINGS[(ec_level, mask)] == PUBLISHED_FORMAT_STRINGS[(ec_level, mask)]
+
+
+@pytest.mark.parametrize('version', PUBLISHED_VERSION_STRINGS)
+def test_version_strings_match_specification(version):
+    assert qr_code.generate_version_string(version) == PUBLISHED_VERSION_STRINGS[version]
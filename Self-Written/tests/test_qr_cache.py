@@ -0,0 +1,35 @@
+#########################################################
+# QR Code Cache
+# Checks the limits and replacement rules of the in-memory LRU cache
+#########################################################
+
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from qr_cache import LRUCache
+
+
+def test_oversize_value_replaces_the_old_entry():
+    cache = LRUCache(max_entries=None, max_bytes=10)
+
+    cache.put('k', 'old', 5)
+    cache.put('k', 'new', 50)
+
+    assert cache.get('k') is None
+    assert 'k' not in cache
+    assert cache.stats().size_bytes == 0
+
+
+def test_least_recently_used_is_evicted_first():
+    cache = LRUCache(max_entries=2, max_bytes=None)
+
+    cache.put('a', 1, 1)
+    cache.put('b', 2, 1)
+    cache.get('a')
+    cache.put('c', 3, 1)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.stats().evictions == 1
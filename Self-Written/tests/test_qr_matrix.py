@@ -0,0 +1,67 @@
+#########################################################
+# QR Matrix
+# Checks that copy-on-write copies never share writes, whichever way the modules are reached
+#########################################################
+
+from pathlib import Path
+import sys
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from qr_matrix import QRMatrix
+
+
+def make_matrix() -> QRMatrix:
+    return QRMatrix(21, bytearray(i % 2 for i in range(21 * 21)))
+
+
+def test_writes_do_not_reach_copies():
+    matrix = make_matrix()
+    duplicate = matrix.copy()
+
+    matrix[0, 8] ^= 1
+
+    assert duplicate[0, 8] != matrix[0, 8]
+    assert duplicate == make_matrix()
+
+
+def test_views_are_read_only():
+    matrix = make_matrix()
+
+    for view in (matrix.buffer(), matrix.modules, matrix.copy().modules):
+        if isinstance(view, memoryview):
+            assert view.readonly
+
+    with pytest.raises(TypeError):
+        matrix.buffer()[0] = 1
+
+
+def test_numpy_view_taken_before_a_copy_cannot_change_it():
+    np = pytest.importorskip('numpy')
+
+    matrix = make_matrix()
+    array = np.asarray(matrix)
+    duplicate = matrix.copy()
+
+    with pytest.raises(ValueError):
+        array[0, 8] ^= 1
+
+    matrix[0, 8] ^= 1
+    assert duplicate[0, 8] == make_matrix()[0, 8]
+    assert array[0, 8] == make_matrix()[0, 8] # The view belongs to the storage the copy kept
+
+
+def test_numpy_copy_argument():
+    np = pytest.importorskip('numpy')
+
+    matrix = make_matrix()
+
+    copied = np.array(matrix, dtype=np.uint8)
+    copied[0, 0] ^= 1
+    assert matrix[0, 0] == make_matrix()[0, 0]
+
+    with pytest.raises(ValueError):
+        matrix.__array__(dtype=np.int32, copy=False)
+    assert matrix.__array__(dtype=np.int32).dtype == np.int32
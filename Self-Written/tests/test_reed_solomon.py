@@ -0,0 +1,109 @@
+#########################################################
+# Reed-Solomon Decoding
+# Checks that errors and erasures are corrected up to the limit of the code, and refused cleanly past it
+#########################################################
+
+from pathlib import Path
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import qr_spec
+import reed_solomon
+
+
+# "HELLO WORLD" as version 1-M, from https://www.thonky.com/qr-code-tutorial/error-correction-coding
+HELLO_WORLD_DATA = bytes([32, 91, 11, 120, 209, 114, 220, 77, 67, 64, 236, 17, 236, 17, 236, 17])
+HELLO_WORLD_EC = bytes([196, 35, 39, 119, 235, 215, 231, 226, 93, 23])
+
+# Every block shape used by a QR code: (data codewords, EC codewords)
+BLOCK_SHAPES = sorted({
+    (data_codewords, structure[0])
+    for version in qr_spec.VERSIONS
+    for structure in qr_spec.BLOCK_STRUCTURE[version]
+    for data_codewords in (structure[2], structure[4]) if data_codewords
+})
+
+
+def make_block(rng: random.Random, num_data: int, num_ec: int) -> bytes:
+    data = bytes(rng.randrange(256) for _ in range(num_data))
+    return data + reed_solomon.encode(data, num_ec)
+
+
+def damage(rng: random.Random, block: bytes, num_errors: int, num_erasures: int) -> tuple[bytearray, list[int]]:
+    # Wrong codewords get a different value. Erased codewords may or may not have changed, as with a real smudge
+    damaged = bytearray(block)
+    positions = rng.sample(range(len(block)), num_errors + num_erasures)
+
+    for position in positions[:num_errors]:
+        damaged[position] ^= rng.randrange(1, 256)
+    for position in positions[num_errors:]:
+        damaged[position] = rng.randrange(256)
+
+    return damaged, positions[num_errors:]
+
+
+def test_hello_world_round_trip():
+    assert reed_solomon.encode(HELLO_WORLD_DATA, 10) == HELLO_WORLD_EC
+
+    block = HELLO_WORLD_DATA + HELLO_WORLD_EC
+    assert reed_solomon.correct(block, 10) == (bytearray(block), 0)
+
+    damaged = bytearray(block)
+    for position in (0, 7, 15, 20, 25):
+        damaged[position] ^= 0x5A
+
+    corrected, changed = reed_solomon.correct(damaged, 10)
+    assert corrected == block
+    assert changed == 5
+
+
+@pytest.mark.parametrize(('num_data', 'num_ec'), BLOCK_SHAPES)
+def test_errors_and_erasures_within_the_bound_are_corrected(num_data, num_ec):
+    rng = random.Random(num_data * 31 + num_ec)
+
+    for _ in range(20):
+        block = make_block(rng, num_data, num_ec)
+
+        num_erasures = rng.randint(0, num_ec)
+        num_errors = rng.randint(0, (num_ec - num_erasures) // 2)
+        damaged, erasures = damage(rng, block, num_errors, num_erasures)
+
+        corrected, _ = reed_solomon.correct(damaged, num_ec, erasures)
+        assert corrected == block
+
+
+@pytest.mark.parametrize(('num_data', 'num_ec'), [(19, 7), (16, 10), (43, 24), (115, 30)])
+def test_damage_beyond_the_bound_fails_cleanly(num_data, num_ec):
+    rng = random.Random(num_ec)
+    refused = 0
+
+    for _ in range(50):
+        block = make_block(rng, num_data, num_ec)
+
+        num_erasures = rng.randint(0, num_ec)
+        num_errors = (num_ec - num_erasures) // 2 + 1
+        damaged, erasures = damage(rng, block, num_errors, num_erasures)
+
+        try:
+            corrected, _ = reed_solomon.correct(damaged, num_ec, erasures)
+        except ValueError:
+            refused += 1
+            continue
+
+        # Past the bound the nearest code word may be a different one, but whatever comes back must be a valid block
+        assert not any(reed_solomon.remainder(corrected, num_ec))
+
+    assert refused >= 40
+
+
+def test_more_erasures_than_ec_codewords_are_refused():
+    block = HELLO_WORLD_DATA + HELLO_WORLD_EC
+
+    with pytest.raises(ValueError):
+        reed_solomon.correct(block, 10, range(11))
+    with pytest.raises(ValueError):
+        reed_solomon.correct(block, 10, [len(block)])
@@ -0,0 +1,81 @@
+#########################################################
+# QR Code HTTP Service
+# Checks the request size limits and which errors become 4xx and which 5xx
+#########################################################
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import sys
+from urllib.parse import quote
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import qr_service
+import qr_spec
+
+
+def render(data: str, ec_level: str, scale: int, border: int, file_format: str) -> bytes:
+    # Stands in for the real renderer, so only the HTTP handling is tested
+    if data == 'too long':
+        raise qr_spec.DataTooLongError("Input too long.")
+    if data == 'bug':
+        raise RuntimeError("An encoder bug")
+    return b'image'
+
+
+def status_of(raw_request: bytes) -> int:
+    async def exchange() -> bytes:
+        with ThreadPoolExecutor(1) as executor:
+            service = qr_service.QRService(render, executor)
+            server = await asyncio.start_server(service.handle_connection, '127.0.0.1', 0, limit=qr_service.MAX_REQUEST_LINE_BYTES)
+            port = server.sockets[0].getsockname()[1]
+
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(raw_request)
+            await writer.drain()
+            response = await reader.read()
+
+            writer.close()
+            server.close()
+            await server.wait_closed()
+
+        return response
+
+    return int(asyncio.run(exchange()).split(b' ', 2)[1])
+
+
+def get(target: str, headers: str = '') -> bytes:
+    return f'GET {target} HTTP/1.1\r\nConnection: close\r\n{headers}\r\n'.encode('iso-8859-1')
+
+
+def test_request_without_headers():
+    assert status_of(b'GET /qr?data=hello HTTP/1.0\r\n\r\n') == 200
+
+
+@pytest.mark.parametrize('data', ['7' * qr_service.MAX_DATA_LENGTH, '漢' * 1817, 'ÿ' * 2953])
+def test_largest_payloads_fit_in_a_get_request(data):
+    # Percent-encoding every byte is the worst a client can do
+    encoded = ''.join(f'%{byte:02X}' for byte in data.encode('utf-8'))
+    assert status_of(get(f'/qr?data={encoded}&ec=L&scale=4&border=4&format=png')) == 200
+
+
+def test_request_line_over_the_limit_is_414():
+    assert status_of(get('/qr?data=' + 'a' * qr_service.MAX_REQUEST_LINE_BYTES)) == 414
+
+
+def test_headers_over_the_limit_are_431():
+    headers = ''.join(f'X-Filler-{i}: {"a" * 1000}\r\n' for i in range(20))
+    assert status_of(get('/qr?data=hello', headers)) == 431
+
+
+@pytest.mark.parametrize(('length', 'status'), [(-5, 400), (qr_service.MAX_BODY_BYTES + 1, 413)])
+def test_bad_content_length(length, status):
+    assert status_of(get('/qr?data=hello', f'Content-Length: {length}\r\n')) == status
+
+
+@pytest.mark.parametrize(('data', 'status'), [('hello', 200), ('too long', 400), ('bug', 500)])
+def test_render_errors(data, status):
+    assert status_of(get('/qr?data=' + quote(data))) == status